@@ -0,0 +1,196 @@
+import json
+import re
+import simcal as sc
+import numpy as np
+from pathlib import Path
+from typing import Any, Callable
+
+from SMPISimulator import summit
+from ResultStream import MEGABYTE
+from Utils import ExplainedVarianceLoss, join_segments, parse_bandwidth, parse_latency, parse_piecewise, piecewise_factor
+
+# SMPI's default piecewise factors, used unless the calibration sets them
+DEFAULT_BANDWIDTH_FACTOR = "65472:0.940694;15424:0.697866;9376:0.58729;5776:1.08739;3484:0.77493;1426:0.608902;732:0.341987;257:0.338112;0:0.812084"
+DEFAULT_LATENCY_FACTOR = "65472:11.6436;15424:3.48845;9376:2.59299;5776:2.18796;3484:1.88101;1426:1.61075;732:1.9503;257:1.95341;0:2.01467"
+BANDWIDTH_FACTOR_KEYS = ["network/bandwidth-factor", "smpi/bw-factor"]
+LATENCY_FACTOR_KEYS = ["network/latency-factor", "smpi/lat-factor"]
+
+# benchmark -> (partner of each rank, whether every rank sends at once)
+# "half": rank r exchanges with rank r + P/2, "random": with any other rank
+BENCHMARK_PATTERNS = {
+    "PingPong": ("half", False),
+    "PingPing": ("half", True),
+    "Birandom": ("random", True),
+    "Unirandom": ("random", False),
+}
+
+
+def parse_list(value: str) -> list[int]:
+    # "{18, 6, 6}" -> [18, 6, 6]
+    return [int(item) for item in re.findall(r"\d+", str(value))]
+
+
+class AnalyticalSimulator(sc.Simulator):
+    """LogGP-style estimate of the IMB-P2P benchmarks on the Summit platform, without running SMPI.
+
+    A message of s bytes between two ranks takes lat_factor(s) * L + s / (bw_factor(s) * B),
+    with L the latencies along the route (PCIe, then two fat-tree links per level climbed)
+    and B the share of the most contended link of the route (PCIe and limiter of the node,
+    fat-tree links of each level) left to one flow when every rank communicates at once.
+    Ranks are placed in blocks of processes / node_count on consecutive nodes, like the
+    hostfile does. Mbytes/sec is aggregated over the sending ranks, as in the ground truth.
+
+    It takes the calibration dicts of SMPISimulator and returns the same loss, in well
+    under a millisecond, so it can screen candidates before any of them is simulated.
+    """
+
+    def __init__(self, ground_truth, summit_dir: Path = None):
+        super().__init__()
+        summit_dir = Path(summit_dir) if summit_dir is not None else summit
+        self.ground_truth = ground_truth
+        self.loss_function = ExplainedVarianceLoss(ground_truth[1])
+
+        with open(summit_dir / "config/node_config.json") as f:
+            self.node = json.load(f)
+        with open(summit_dir / "config/6-racks-no-gpu-no-nvme.json") as f:
+            self.topology = json.load(f)
+
+        # summit_generator.py passes these to FatTreeParams as (levels, down, up, links_number)
+        fat_tree = self.topology["Fat-Tree_parameters"]
+        self.levels = int(fat_tree["levels"])
+        self.down = parse_list(fat_tree["up_links"])
+        self.up = parse_list(fat_tree["down_links"])
+        self.links = parse_list(fat_tree["links_number"])
+        # nodes under one switch of each level, level 0 being a node
+        self.subtree = np.cumprod([1] + self.down)
+
+        self.scenarios = [self.scenario(i[0], int(i[1]), int(i[2]), i[3]) for i in ground_truth[0]]
+
+    def scenario(self, benchmark: str, node_count: int, processes: int, byte_sizes) -> dict:
+        if benchmark not in BENCHMARK_PATTERNS:
+            raise ValueError(f"No analytical model for benchmark {benchmark}")
+        pattern, bidirectional = BENCHMARK_PATTERNS[benchmark]
+        ppn = max(processes // node_count, 1)
+
+        if pattern == "half":
+            ranks = np.arange(processes)
+            first, second = ranks // ppn, ((ranks + processes // 2) % processes) // ppn
+            weights = np.ones(processes)
+        else:
+            # every other rank equally likely, ppn - 1 of them on the same node
+            first, second = (nodes.ravel() for nodes in np.meshgrid(np.arange(node_count), np.arange(node_count)))
+            weights = np.where(first == second, ppn - 1, ppn).astype(float)
+
+        # lowest level whose switch sees both nodes, 0 for the same node
+        level = np.full(len(first), self.levels)
+        for l in range(self.levels, -1, -1):
+            level[first // self.subtree[l] == second // self.subtree[l]] = l
+        probability = np.bincount(level, weights=weights, minlength=self.levels + 1) / weights.sum()
+
+        senders = processes if bidirectional or pattern == "random" else processes // 2
+        return {
+            "byte_sizes": np.asarray(byte_sizes, dtype=float),
+            "node_count": node_count,
+            "ppn": ppn,
+            "senders": senders,
+            # flows each node sends, and carries in both directions on its shared links
+            "node_flows": senders / node_count,
+            "link_flows": (2 if bidirectional else 1) * senders / node_count,
+            "probability": probability,
+        }
+
+    def parameters(self, calibration: dict) -> dict:
+        values = {**self.node, **{key: self.topology[key] for key in ["bandwidth", "latency"]}}
+        values.update({key: str(value) for key, value in join_segments(calibration).items()})
+        bandwidth_factor = next((values[key] for key in BANDWIDTH_FACTOR_KEYS if key in values), DEFAULT_BANDWIDTH_FACTOR)
+        latency_factor = next((values[key] for key in LATENCY_FACTOR_KEYS if key in values), DEFAULT_LATENCY_FACTOR)
+        return {
+            "pcie_bw": parse_bandwidth(values["pcie_bw"]),
+            "pcie_lat": parse_latency(values["pcie_lat"]),
+            "xbus_bw": parse_bandwidth(values["xbus_bw"]),
+            "xbus_lat": parse_latency(values["xbus_lat"]),
+            "limiter_bw": parse_bandwidth(values["limiter_bw"]),
+            "bandwidth": parse_bandwidth(values["bandwidth"]),
+            "latency": parse_latency(values["latency"]),
+            "bandwidth_factor": parse_piecewise(bandwidth_factor),
+            "latency_factor": parse_piecewise(latency_factor),
+        }
+
+    def predict(self, parameters: dict, scenario: dict) -> np.ndarray:
+        # Mbytes/sec of one scenario for each of its byte sizes
+        sizes = scenario["byte_sizes"]
+        probability = scenario["probability"]
+        leaving = 1 - probability[0]
+
+        # two CPUs, each with its own PCIe link to the NIC, share the node's flows
+        pcie = parameters["pcie_bw"] / max(scenario["link_flows"] * leaving / 2, 1)
+        limiter = parameters["limiter_bw"] / max(scenario["link_flows"] * leaving, 1)
+        xbus = parameters["xbus_bw"] / max(scenario["link_flows"] * probability[0], 1)
+
+        # fat-tree links are split-duplex, a level is shared by the flows of its subtree going past it
+        bandwidths = [xbus]
+        latencies = [parameters["xbus_lat"]]
+        bottleneck = min(pcie, limiter)
+        for l in range(1, self.levels + 1):
+            capacity = np.prod(self.up[:l]) * self.links[l - 1] * parameters["bandwidth"]
+            crossing = min(self.subtree[l - 1], scenario["node_count"]) * scenario["node_flows"] * probability[l:].sum()
+            bottleneck = min(bottleneck, capacity / max(crossing, 1))
+            bandwidths.append(bottleneck)
+            latencies.append(2 * parameters["pcie_lat"] + 2 * l * parameters["latency"])
+
+        latency_factor = piecewise_factor(parameters["latency_factor"], sizes)
+        bandwidth_factor = piecewise_factor(parameters["bandwidth_factor"], sizes)
+        times = (
+            latency_factor[None, :] * np.array(latencies)[:, None]
+            + sizes[None, :] / (bandwidth_factor[None, :] * np.array(bandwidths)[:, None])
+        )
+        mean_time = probability @ times
+        return scenario["senders"] * sizes / mean_time / MEGABYTE
+
+    def simulate(self, calibration: dict) -> list[float]:
+        parameters = self.parameters(calibration)
+        return np.concatenate([self.predict(parameters, scenario) for scenario in self.scenarios]).tolist()
+
+    def loss(self, calibration: dict) -> float:
+        return self.loss_function(self.simulate(calibration))
+
+    def run(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]) -> Any:
+        return self.loss(calibration)
+
+
+class PrescreenedSimulator(sc.Simulator):
+    """Runs the full simulator only on candidates the analytical model finds promising.
+
+    A candidate whose analytical loss is above the given quantile of the analytical losses
+    seen so far is not simulated; it gets the worst full loss seen so far, so it never
+    looks better than a simulated candidate. The first warmup candidates are always
+    simulated.
+    """
+
+    def __init__(self, simulator: Callable, analytical: AnalyticalSimulator, quantile: float = 0.5, warmup: int = 10):
+        super().__init__()
+        self.simulator = simulator
+        self.analytical = analytical
+        self.quantile = quantile
+        self.warmup = warmup
+        self.analytical_losses = []
+        self.worst_loss = None
+        self.screened = 0
+
+    def run(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]) -> Any:
+        analytical_loss = self.analytical.loss(calibration)
+        self.analytical_losses.append(analytical_loss)
+
+        if (
+            len(self.analytical_losses) > self.warmup
+            and self.worst_loss is not None
+            and analytical_loss > np.quantile(self.analytical_losses, self.quantile)
+        ):
+            self.screened += 1
+            print(f"Screened out, analytical loss {analytical_loss}")
+            return self.worst_loss
+
+        loss = self.simulator(calibration)
+        if self.worst_loss is None or loss > self.worst_loss:
+            self.worst_loss = loss
+        return loss
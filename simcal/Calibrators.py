@@ -0,0 +1,319 @@
+import re
+import sys
+import warnings
+import numpy as np
+from concurrent.futures import Executor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from time import perf_counter
+from typing import Callable, Optional
+
+from scipy.stats import norm
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.gaussian_process.kernels import ConstantKernel, Matern, WhiteKernel
+
+
+class SearchCalibrator:
+    """Base for the calibrators implemented here rather than in simcal.
+
+    Parameters are searched in the unit hypercube and mapped linearly onto [start, end]
+    before being formatted, like sc.parameter.Linear(start, end).format(fmt). The
+    coordinator is a concurrent.futures executor running simulator(calibration), workers
+    evaluations at a time.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.parameters: dict[str, tuple[float, float, str]] = {}
+        self.rng = np.random.default_rng(seed)
+        # (point, calibration, loss) of every finished evaluation
+        self.history: list[tuple[np.ndarray, dict, float]] = []
+        # promising points to evaluate before any random one, see warm_start
+        self.suggested: list[np.ndarray] = []
+
+    def add_param(self, name: str, start: float, end: float, fmt: str = "%f"):
+        self.parameters[name] = (start, end, fmt)
+        return self
+
+    @property
+    def dimension(self) -> int:
+        return len(self.parameters)
+
+    def to_calibration(self, point: np.ndarray) -> dict[str, str]:
+        return {
+            name: fmt % (start + x * (end - start))
+            for x, (name, (start, end, fmt)) in zip(point, self.parameters.items())
+        }
+
+    def random_points(self, count: int) -> np.ndarray:
+        return self.rng.random((count, self.dimension))
+
+    def sample(self, count: int) -> list[np.ndarray]:
+        # suggested points first, random ones for the rest
+        points, self.suggested = self.suggested[:count], self.suggested[count:]
+        return points + list(self.random_points(count - len(points)))
+
+    def warm_start(self, model: Callable[[dict], float], candidates: int = 10000, keep: int = None):
+        # ranks random candidates with a cheap model of the loss, the best ones get evaluated first
+        keep = keep or 2 * self.dimension
+        points = self.random_points(candidates)
+        losses = np.array([model(self.to_calibration(point)) for point in points])
+        self.suggested = list(points[np.argsort(losses)[:keep]])
+
+    def best(self) -> tuple[Optional[dict], Optional[float]]:
+        if not self.history:
+            return None, None
+        _, calibration, loss = min(self.history, key=lambda entry: entry[2])
+        return calibration, loss
+
+    def record(self, point: np.ndarray, calibration: dict, loss: float):
+        self.history.append((np.asarray(point, dtype=float), calibration, float(loss)))
+
+    def to_point(self, calibration: dict) -> np.ndarray:
+        point = []
+        for name, (start, end, _) in self.parameters.items():
+            # leading number of the formatted value, "86.85Gf" -> 86.85
+            value = float(re.match(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?", str(calibration[name])).group())
+            point.append((value - start) / (end - start))
+        return np.array(point)
+
+    def restore(self, evaluations: list[tuple[dict, float]]):
+        # rebuilds the history from (calibration, loss) pairs, e.g. from a Journal; they may
+        # hold more parameters than those searched, when some were pinned
+        for calibration, loss in evaluations:
+            if not set(self.parameters) <= set(calibration):
+                continue
+            self.record(self.to_point(calibration), {name: calibration[name] for name in self.parameters}, loss)
+
+    def losses(self, simulator: Callable, calibrations: list[dict], coordinator: Executor) -> list[float]:
+        # a failed evaluation gets an infinite loss rather than ending the calibration
+        futures = [coordinator.submit(simulator, calibration) for calibration in calibrations]
+        losses = []
+        for future in futures:
+            try:
+                losses.append(future.result())
+            except Exception as error:
+                sys.stderr.write(f"Evaluation failed: {error}\n")
+                losses.append(float("inf"))
+        return losses
+
+    def evaluate(self, simulator: Callable, points, coordinator: Executor) -> list[float]:
+        # evaluates a batch of points and waits for all of them, failed ones are not recorded
+        points = [np.asarray(point, dtype=float) for point in points]
+        calibrations = [self.to_calibration(point) for point in points]
+        losses = self.losses(simulator, calibrations, coordinator)
+        for point, calibration, loss in zip(points, calibrations, losses):
+            if np.isfinite(loss):
+                self.record(point, calibration, loss)
+        return losses
+
+    def calibrate(self, simulator: Callable, timelimit: float = None, coordinator: Executor = None, workers: int = 1):
+        if coordinator is None:
+            coordinator = ThreadPoolExecutor(max_workers=workers)
+        deadline = perf_counter() + timelimit if timelimit is not None else float("inf")
+        self._calibrate(simulator, deadline, coordinator, workers)
+        return self.best()
+
+    def _calibrate(self, simulator: Callable, deadline: float, coordinator: Executor, workers: int):
+        raise NotImplementedError()
+
+
+class BayesianOptimization(SearchCalibrator):
+    """Gaussian-process surrogate with expected improvement, keeping the whole pool busy.
+
+    Each time a worker is free, a candidate is proposed by maximizing expected improvement
+    over random samples, with the points still being evaluated added to the surrogate with
+    the best loss seen so far ("constant liar") so a batch does not collapse on one point.
+    """
+
+    def __init__(
+        self, initial_points: int = None, candidates: int = 2000, xi: float = 0.01, seed: int = None,
+        max_evaluations: int = None
+    ):
+        super().__init__(seed)
+        self.initial_points = initial_points
+        self.candidates = candidates
+        self.xi = xi
+        # evaluations of one calibrate() call, on top of the time limit
+        self.max_evaluations = max_evaluations
+
+    def surrogate(self, points: np.ndarray, values: np.ndarray) -> GaussianProcessRegressor:
+        kernel = ConstantKernel(1.0) * Matern(length_scale=np.full(self.dimension, 0.3), nu=2.5) + WhiteKernel(1e-3)
+        model = GaussianProcessRegressor(kernel=kernel, normalize_y=True, n_restarts_optimizer=2,
+                                         random_state=int(self.rng.integers(2**31)))
+        with warnings.catch_warnings():
+            # hyperparameters hitting their bounds is expected with few, noisy points
+            warnings.simplefilter("ignore", ConvergenceWarning)
+            model.fit(points, values)
+        return model
+
+    def expected_improvement(self, model: GaussianProcessRegressor, points: np.ndarray, best: float) -> np.ndarray:
+        mean, std = model.predict(points, return_std=True)
+        std = np.maximum(std, 1e-12)
+        improvement = best - mean - self.xi
+        z = improvement / std
+        return improvement * norm.cdf(z) + std * norm.pdf(z)
+
+    def propose(self, pending: list[np.ndarray]) -> np.ndarray:
+        points = np.array([point for point, _, _ in self.history])
+        # losses span orders of magnitude, the surrogate fits their logarithm
+        values = np.log(np.array([loss for _, _, loss in self.history]) + 1e-12)
+
+        best = values.min()
+        if pending:
+            points = np.vstack([points] + pending)
+            values = np.concatenate([values, np.full(len(pending), best)])
+
+        model = self.surrogate(points, values)
+        candidates = self.random_points(self.candidates)
+        return candidates[np.argmax(self.expected_improvement(model, candidates, best))]
+
+    def _calibrate(self, simulator: Callable, deadline: float, coordinator: Executor, workers: int):
+        initial_points = self.initial_points or max(2 * self.dimension, workers)
+        queue = self.sample(max(initial_points - len(self.history), 0))
+
+        budget = self.max_evaluations if self.max_evaluations is not None else float("inf")
+        pending = {}
+        while pending or (perf_counter() < deadline and budget > 0):
+            while len(pending) < workers and perf_counter() < deadline and budget > 0:
+                if queue:
+                    point = queue.pop(0)
+                elif len(self.history) >= 2:
+                    point = self.propose(list(pending.values()))
+                elif not pending:
+                    point = self.random_points(1)[0]
+                else:
+                    # not enough data for a surrogate yet, wait for the initial design
+                    break
+                calibration = self.to_calibration(point)
+                pending[coordinator.submit(simulator, calibration)] = point
+                budget -= 1
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                point = pending.pop(future)
+                try:
+                    self.record(point, self.to_calibration(point), future.result())
+                except Exception as error:
+                    sys.stderr.write(f"Evaluation failed: {error}\n")
+
+
+class SuccessiveHalving(SearchCalibrator):
+    """Hyperband over a ladder of simulators of increasing fidelity.
+
+    low_fidelity holds cheaper variants of the simulator (fewer iterations, byte sizes or
+    nodes), the simulator given to calibrate being the full-fidelity one. Each bracket
+    samples candidates, scores them on one rung, promotes the best 1/eta to the next rung
+    and so on; brackets start on successively higher rungs with fewer candidates, so bad
+    guesses about the cheap variants' fidelity are hedged. Only full-fidelity losses count
+    towards the best calibration.
+    """
+
+    def __init__(self, low_fidelity: list[Callable], eta: int = 3, seed: int = None):
+        super().__init__(seed)
+        self.low_fidelity = list(low_fidelity)
+        self.eta = eta
+        # (rung, point, loss) of every low-fidelity evaluation
+        self.rung_history: list[tuple[int, np.ndarray, float]] = []
+
+    def brackets(self, workers: int):
+        top = len(self.low_fidelity)
+        for s in range(top, -1, -1):
+            # at least one candidate per worker on the first rung of the bracket
+            count = max(int(np.ceil((top + 1) / (s + 1) * self.eta ** s)), workers)
+            yield top - s, count
+
+    def _calibrate(self, simulator: Callable, deadline: float, coordinator: Executor, workers: int):
+        rungs = self.low_fidelity + [simulator]
+
+        while perf_counter() < deadline:
+            for first_rung, count in self.brackets(workers):
+                points = self.sample(count)
+
+                for rung in range(first_rung, len(rungs)):
+                    if perf_counter() >= deadline:
+                        return
+
+                    if rung == len(rungs) - 1:
+                        self.evaluate(simulator, points, coordinator)
+                        break
+
+                    calibrations = [self.to_calibration(point) for point in points]
+                    losses = self.losses(rungs[rung], calibrations, coordinator)
+                    self.rung_history.extend((rung, point, loss) for point, loss in zip(points, losses))
+
+                    survivors = max(len(points) // self.eta, 1)
+                    points = [points[index] for index in np.argsort(losses)[:survivors]]
+
+
+class HierarchicalSearch(SearchCalibrator):
+    """Bayesian optimization over the platform parameters, each candidate platform getting its
+    own Bayesian optimization over the runtime parameters.
+
+    Runtime parameters are those is_runtime accepts, by default the SMPI options (names with
+    a "/"), which change no platform build: the candidates of an inner search all run on the
+    platform the first one built. Platforms are scored with the best loss of their inner
+    search, which evaluates inner_evaluations candidates on the whole coordinator, starting
+    from the best runtime values found so far. Platforms are searched one at a time.
+    """
+
+    def __init__(self, inner_evaluations: int = 20, is_runtime: Callable[[str], bool] = None, seed: int = None):
+        super().__init__(seed)
+        self.inner_evaluations = inner_evaluations
+        self.is_runtime = is_runtime or (lambda name: "/" in name)
+
+    def level(self, names: list[str], **options) -> BayesianOptimization:
+        calibrator = BayesianOptimization(seed=int(self.rng.integers(2**31)), **options)
+        for name in names:
+            calibrator.add_param(name, *self.parameters[name])
+        return calibrator
+
+    def _calibrate(self, simulator: Callable, deadline: float, coordinator: Executor, workers: int):
+        runtime = [name for name in self.parameters if self.is_runtime(name)]
+        platform = [name for name in self.parameters if name not in runtime]
+        if not runtime or not platform:
+            # a single level
+            flat = self.level(list(self.parameters))
+            flat.history, flat.suggested = self.history, self.suggested
+            flat._calibrate(simulator, deadline, coordinator, workers)
+            return
+
+        runtime_index = [list(self.parameters).index(name) for name in runtime]
+        platform_index = [list(self.parameters).index(name) for name in platform]
+        outer = self.level(platform)
+        outer.suggested = [point[platform_index] for point in self.suggested]
+        inner_start = [point[runtime_index] for point in self.suggested[:1]]
+
+        # restored evaluations: the best one of each platform seeds the outer search
+        restored = {}
+        for point, calibration, loss in sorted(self.history, key=lambda entry: entry[2]):
+            restored.setdefault(tuple(point[platform_index]), (point, loss))
+        for point, loss in restored.values():
+            outer.record(point[platform_index], outer.to_calibration(point[platform_index]), loss)
+        if restored:
+            inner_start = [min(restored.values(), key=lambda entry: entry[1])[0][runtime_index]]
+
+        def search_runtime(platform_calibration: dict) -> float:
+            nonlocal inner_start
+            inner = self.level(
+                runtime, max_evaluations=self.inner_evaluations,
+                initial_points=max(self.inner_evaluations // 2, min(workers, self.inner_evaluations)),
+            )
+            inner.suggested = list(inner_start)
+            inner._calibrate(
+                lambda calibration: simulator({**platform_calibration, **calibration}), deadline, coordinator, workers
+            )
+            for point, calibration, loss in inner.history:
+                full = {**platform_calibration, **calibration}
+                self.record(self.to_point(full), {name: full[name] for name in self.parameters}, loss)
+
+            calibration, loss = inner.best()
+            if calibration is None:
+                raise TimeoutError("No time left to search the runtime parameters")
+            if loss <= self.best()[1]:
+                inner_start = [inner.to_point(calibration)]
+            return loss
+
+        with ThreadPoolExecutor(max_workers=1) as platforms:
+            outer._calibrate(search_runtime, deadline, platforms, 1)
@@ -0,0 +1,218 @@
+import argparse
+import multiprocessing
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from queue import Queue
+from typing import Any
+
+import simcal as sc
+
+from Scheduler import set_worker_share
+
+AUTHKEY_ENV = "MPI_BENCH_CAL_AUTHKEY"
+
+# simulators of a worker process, unpickled once when it starts
+_simulators = None
+
+
+def default_authkey() -> bytes:
+    # servers unpickle what clients send, so there is no built-in key anyone could read
+    authkey = os.environ.get(AUTHKEY_ENV, "").encode()
+    if not authkey:
+        raise RuntimeError(f"Remote workers need a shared secret in ${AUTHKEY_ENV}")
+    return authkey
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def _start_worker(payload: bytes, base_dir: str, index: int, count: int):
+    # every worker runs from a directory of its own, its simulators keep their own
+    # workspaces, result store connection and best loss; the count workers of a machine
+    # each admit simulations for their share of it
+    global _simulators
+    work_dir = Path(base_dir) / f"worker-{os.getpid()}"
+    work_dir.mkdir(parents=True, exist_ok=True)
+    os.chdir(work_dir)
+    set_worker_share(index, count)
+    _simulators = pickle.loads(payload)
+
+
+def _start_pool_worker(payload: bytes, base_dir: str, started, count: int):
+    with started.get_lock():
+        index = started.value
+        started.value += 1
+    _start_worker(payload, base_dir, index, count)
+
+
+def _evaluate(index: int, calibration: dict) -> float:
+    return _simulators[index](calibration)
+
+
+class ProcessPool:
+    """Evaluations in local worker processes, each with its own copy of the simulators.
+
+    simulators is the list of simulators the calibration uses (the full one and its lower
+    fidelities), evaluate() runs simulators[index] on a calibration in the first idle worker.
+    Workers are spawned rather than forked, the calibrator already runs threads.
+    """
+
+    def __init__(self, simulators: list, workers: int, work_dir: Path = None):
+        self.workers = workers
+        self.work_dir = Path(tempfile.mkdtemp(prefix="mpi_bench_cal_workers-", dir=work_dir))
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_start_pool_worker,
+            initargs=(pickle.dumps(simulators), str(self.work_dir), context.Value("i", 0), workers),
+        )
+
+    def evaluate(self, index: int, calibration: dict) -> Future:
+        return self.executor.submit(_evaluate, index, calibration)
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class RemotePool:
+    """Evaluations on worker servers started with `python Coordinators.py host:port`.
+
+    One connection, so one evaluation at a time, per address; start several servers on a
+    host to use several of its cores. The simulators are pickled to the servers, the paths
+    they hold (hostfile, binaries, result store, journal) must exist there as well. Servers
+    and calibrator authenticate with authkey, by default ${AUTHKEY_ENV}, which must be set.
+    """
+
+    def __init__(self, simulators: list, addresses: list[str], authkey: bytes = None):
+        authkey = authkey or default_authkey()
+        self.workers = len(addresses)
+        self.tasks = Queue()
+        self.lock = threading.Lock()
+        self.alive = len(addresses)
+
+        payload = pickle.dumps(simulators)
+        hosts = [parse_address(address)[0] for address in addresses]
+        self.threads = []
+        for position, address in enumerate(addresses):
+            connection = Client(parse_address(address), authkey=authkey)
+            # servers of the same host share its cores and memory
+            host = hosts[position]
+            connection.send(("start", payload, hosts[:position].count(host), hosts.count(host)))
+            thread = threading.Thread(target=self.dispatch, args=(address, connection), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def evaluate(self, index: int, calibration: dict) -> Future:
+        future = Future()
+        self.tasks.put((future, index, calibration))
+        return future
+
+    def dispatch(self, address: str, connection):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            future, index, calibration = task
+            # a running future is one a lost worker handed back
+            if not (future.running() or future.set_running_or_notify_cancel()):
+                continue
+            try:
+                connection.send(("evaluate", index, calibration))
+                status, value = connection.recv()
+            except (OSError, EOFError) as error:
+                sys.stderr.write(f"Lost worker {address}: {error}\n")
+                with self.lock:
+                    self.alive -= 1
+                    last = self.alive == 0
+                if last:
+                    future.set_exception(error)
+                else:
+                    # another worker takes the evaluation over
+                    self.tasks.put(task)
+                break
+            if status == "error":
+                future.set_exception(RuntimeError(f"Evaluation failed on {address}:\n{value}"))
+            else:
+                future.set_result(value)
+        connection.close()
+
+    def shutdown(self):
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class DispatchingSimulator(sc.Simulator):
+    """Stands for simulators[index] of a pool, the calibrator's thread waits while a worker runs it."""
+
+    def __init__(self, pool, index: int):
+        super().__init__()
+        self.pool = pool
+        self.index = index
+
+    def run(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]) -> Any:
+        return self.pool.evaluate(self.index, calibration).result()
+
+
+def _serve_connection(connection, base_dir: str):
+    _, payload, index, count = connection.recv()
+    _start_worker(payload, base_dir, index, count)
+    work_dir = Path.cwd()
+    try:
+        while True:
+            try:
+                _, index, calibration = connection.recv()
+            except EOFError:
+                break
+            try:
+                connection.send(("result", _evaluate(index, calibration)))
+            except Exception:
+                connection.send(("error", traceback.format_exc()))
+    finally:
+        connection.close()
+        os.chdir(base_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def serve(address: str, authkey: bytes = None, work_dir: Path = None):
+    # one forked process per connected calibrator, so every connection gets its own
+    # simulators and working directory
+    # refuse to listen without a key before creating anything
+    authkey = authkey or default_authkey()
+    base_dir = Path(tempfile.mkdtemp(prefix="mpi_bench_cal_server-", dir=work_dir))
+    context = multiprocessing.get_context("fork")
+    try:
+        with Listener(parse_address(address), authkey=authkey) as listener:
+            sys.stderr.write(f"Serving evaluations on {address}\n")
+            while True:
+                connection = listener.accept()
+                context.Process(target=_serve_connection, args=(connection, str(base_dir)), daemon=True).start()
+                connection.close()
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Serve calibration evaluations to run_smpi_calibrator.py --coordinator remote, authenticated with ${AUTHKEY_ENV}")
+    parser.add_argument("address", type=str, help="host:port to listen on")
+    parser.add_argument("--work_dir", type=str, default=None, help="Directory for the working directories of the workers (Default: system temporary directory)")
+    args = parser.parse_args()
+    if not os.environ.get(AUTHKEY_ENV):
+        parser.error(f"set ${AUTHKEY_ENV} to the secret shared with the calibrator")
+    try:
+        serve(args.address, work_dir=args.work_dir)
+    except KeyboardInterrupt:
+        pass
@@ -1,48 +1,178 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
+from pathlib import Path
 from typing import List
 
+from Utils import CACHE_ROOT
+
+GROUND_TRUTH_CACHE = CACHE_ROOT / "ground_truth"
+
+# columns the ground truth is indexed on, in index order
+INDEX_COLUMNS = ["benchmark_parent", "benchmark", "node_count", "processes", "bytes"]
+
 
 class MPIGroundTruth:
-    def __init__(self, filename: str):
-        self.full_df = pd.read_csv(filename)
-        self.df = self.full_df.copy(deep=True)
+    def __init__(self, filename: str, cache_dir: Path = GROUND_TRUTH_CACHE):
+        self.filename = Path(filename).resolve()
+        self.cache_dir = Path(cache_dir)
+        self.benchmark_parent = None
+
+        self.columns, self.categories = self._load()
+        self._build_index()
+
+    def _cache_path(self) -> Path:
+        stat = self.filename.stat()
+        key = f"{self.filename}|{stat.st_size}|{stat.st_mtime_ns}"
+        return self.cache_dir / hashlib.sha256(key.encode()).hexdigest()[:16]
+
+    def _write_cache(self, cache_path: Path):
+        df = pd.read_csv(self.filename)
+
+        meta = {"columns": list(df.columns), "categories": {}}
+        values = {}
+        for column in df.columns:
+            series = df[column]
+            if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+                values[column] = series.to_numpy()
+            else:
+                # strings are stored as integer codes, -1 standing for a missing value
+                categorical = pd.Categorical(series)
+                values[column] = categorical.codes.astype(np.int32)
+                meta["categories"][column] = [str(category) for category in categorical.categories]
+
+        # lexsort is stable, so each group starts at its first row in the csv
+        order = np.lexsort([values[column] for column in reversed(INDEX_COLUMNS)])
+
+        tmp_path = Path(tempfile.mkdtemp(dir=cache_path.parent))
+        for number, column in enumerate(meta["columns"]):
+            np.save(tmp_path / f"{number}.npy", values[column])
+
+        np.save(tmp_path / "order.npy", order)
+        with open(tmp_path / "meta.json", "w") as f:
+            json.dump(meta, f)
+
+        try:
+            os.rename(tmp_path, cache_path)
+        except OSError:
+            # another process wrote the same cache in the meantime
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _load(self):
+        cache_path = self._cache_path()
+        if not (cache_path / "meta.json").exists():
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self._write_cache(cache_path)
+
+        with open(cache_path / "meta.json") as f:
+            meta = json.load(f)
+
+        columns = {
+            column: np.load(cache_path / f"{number}.npy", mmap_mode="r")
+            for number, column in enumerate(meta["columns"])
+        }
+        self.order = np.load(cache_path / "order.npy", mmap_mode="r")
+        categories = {column: np.array(values, dtype=object) for column, values in meta["categories"].items()}
+        return columns, categories
+
+    def _build_index(self):
+        # (benchmark_parent, benchmark, node_count, processes) -> [(bytes, start, end)] into self.order
+        sorted_keys = [np.asarray(self.columns[column])[self.order] for column in INDEX_COLUMNS]
+        changed = np.zeros(len(self.order), dtype=bool)
+        if len(self.order):
+            changed[0] = True
+        for values in sorted_keys:
+            different = values[1:] != values[:-1]
+            if values.dtype.kind == "f":
+                different &= ~(np.isnan(values[1:]) & np.isnan(values[:-1]))
+            changed[1:] |= different
+        starts = np.flatnonzero(changed)
+        ends = np.append(starts[1:], len(self.order))
+
+        self.index = {}
+        for start, end in zip(starts, ends):
+            parent, benchmark, node_count, processes, byte_size = (values[start] for values in sorted_keys)
+            key = (
+                self.categories["benchmark_parent"][parent],
+                self.categories["benchmark"][benchmark],
+                int(node_count),
+                int(processes),
+            )
+            self.index.setdefault(key, []).append((byte_size, int(start), int(end)))
+
+    def _frame(self, rows: np.ndarray, metrics: List = None) -> pd.DataFrame:
+        data = {}
+        for column in (metrics if metrics is not None else self.columns.keys()):
+            values = self.columns[column][rows]
+            if column in self.categories:
+                codes = values
+                values = np.full(len(codes), np.nan, dtype=object)
+                values[codes >= 0] = self.categories[column][codes[codes >= 0]]
+            data[column] = values
+        return pd.DataFrame(data, index=rows)
+
+    def _rows(self, benchmark: str = None, node_count: int = None, processes: int = None) -> np.ndarray:
+        if None in (self.benchmark_parent, benchmark, node_count, processes):
+            candidates = self.index.items()
+        else:
+            # fully specified scenario, a single lookup
+            key = (self.benchmark_parent, benchmark, node_count, processes)
+            candidates = [(key, self.index.get(key, []))]
+
+        ranges = []
+        for (parent, bench, nodes, procs), groups in candidates:
+            if self.benchmark_parent is not None and parent != self.benchmark_parent:
+                continue
+            if benchmark is not None and bench != benchmark:
+                continue
+            if node_count is not None and nodes != node_count:
+                continue
+            if processes is not None and procs != processes:
+                continue
+            ranges.extend(self.order[start:end] for _, start, end in groups)
+
+        if not ranges:
+            return np.array([], dtype=np.int64)
+        # csv order, like a boolean mask over the whole file would give
+        return np.sort(np.concatenate(ranges))
+
+    @property
+    def full_df(self) -> pd.DataFrame:
+        return self._frame(np.arange(len(self.order)))
+
+    @property
+    def df(self) -> pd.DataFrame:
+        return self._frame(self._rows())
 
     def set_benchmark_parent(self, benchmark_parent: str):
         if not benchmark_parent == "all":
-            temp_df = self.df
-            self.df = temp_df[temp_df['benchmark_parent'] == benchmark_parent]
+            self.benchmark_parent = benchmark_parent
         else:
-            self.df = self.full_df
+            self.benchmark_parent = None
 
     def get_ground_truth(self, benchmark: str = None, node_count: int = None, processes: int = None, metrics: List = None):
-        df = self.df
-        conditions = []
-        if benchmark is not None:
-            conditions.append(df['benchmark'] == benchmark)
-        if node_count is not None:
-            conditions.append(df['node_count'] == node_count)
-        if processes is not None:
-            conditions.append(df['processes'] == processes)
-
-        
-        if conditions:
-            combined_conditions = conditions[0]
-            for condition in conditions[1:]:
-                combined_conditions &= condition
-
-            filtered_df = df[combined_conditions]
-        else:
-            filtered_df = df
+        return self._frame(self._rows(benchmark, node_count, processes), metrics)
 
-        if metrics is not None:
-            return filtered_df[metrics]
-        
-        return filtered_df
-    
     def get_scenarios(self, node_count: int = None):
-        if node_count is not None:
-            return self.df[self.df['node_count'] == node_count].drop_duplicates(subset=['benchmark', 'processes'])[["benchmark", "node_count", "processes"]].reset_index(drop=True)
-        return self.df.drop_duplicates(subset=['benchmark', 'node_count', 'processes'])[["benchmark", "node_count", "processes"]].reset_index(drop=True)
+        scenarios = []
+        for (parent, benchmark, nodes, processes), groups in self.index.items():
+            if self.benchmark_parent is not None and parent != self.benchmark_parent:
+                continue
+            if node_count is not None and nodes != node_count:
+                continue
+            first_row = min(self.order[start] for _, start, _ in groups)
+            scenarios.append((first_row, benchmark, nodes, processes))
+
+        # several parents can share a scenario, keep its first appearance in the csv
+        scenarios.sort()
+        scenario_df = pd.DataFrame(
+            [scenario[1:] for scenario in scenarios], columns=["benchmark", "node_count", "processes"]
+        )
+        return scenario_df.drop_duplicates().reset_index(drop=True)
 
 
 def main():
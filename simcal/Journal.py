@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+from pathlib import Path
+from time import time
+
+
+class Journal:
+    """Append-only JSON-lines record of a calibration campaign, so it can be resumed after a crash.
+
+    Every evaluation is written and fsync'ed as soon as it finishes, with the campaign time
+    elapsed so far (including previous sessions), which is what a resumed session deducts
+    from its time limit.
+    """
+
+    def __init__(self, filename: Path):
+        self.filename = Path(filename).resolve()
+        self.lock = threading.Lock()
+        self.offset = self.elapsed()
+        # wall clock, so that worker processes account time the same way
+        self.session_start = time()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def read(self) -> list[dict]:
+        records = []
+        if not self.filename.exists():
+            return records
+        with open(self.filename) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # a line cut short by the crash we are resuming from
+                    continue
+        return records
+
+    def evaluations(self) -> list[dict]:
+        return [record for record in self.read() if record.get("type") == "evaluation"]
+
+    def elapsed(self) -> float:
+        return max((record.get("elapsed", 0.0) for record in self.read()), default=0.0)
+
+    def best(self) -> tuple[dict, float]:
+        # mini-batch estimates only rank candidates for the search, one with a lucky sample
+        # can look better than any full loss, so only full losses are candidates here
+        complete = [
+            record for record in self.evaluations() if not record.get("aborted") and not record.get("estimate")
+        ]
+        if not complete:
+            return None, None
+        record = min(complete, key=lambda record: record["loss"])
+        return record["calibration"], record["loss"]
+
+    def _append(self, record: dict):
+        record["elapsed"] = self.offset + time() - self.session_start
+        record["time"] = time()
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            with open(self.filename, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def start_session(self, time_limit: float):
+        self._append({"type": "session", "time_limit": time_limit})
+
+    def record(self, calibration: dict, scenarios: list, loss: float, aborted: bool = False, estimate: bool = False):
+        # estimate: loss is a mini-batch estimate of the full loss, see Scenarios.py
+        self._append({
+            "type": "evaluation",
+            "calibration": {key: str(value) for key, value in calibration.items()},
+            "scenarios": scenarios,
+            "loss": loss,
+            "aborted": aborted,
+            "estimate": estimate,
+        })
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+from Utils import CACHE_ROOT
+
+SIMGRID_INSTALL_PATH = "/usr/local"
+
+DEFAULT_CACHE_DIR = CACHE_ROOT / "platforms"
+
+
+@lru_cache(maxsize=None)
+def toolchain_fingerprint(simgrid_path: str = SIMGRID_INSTALL_PATH) -> str:
+    # compiler version + simgrid headers/library, anything that changes the produced .so
+    parts = []
+    try:
+        out = subprocess.run(["g++", "--version"], capture_output=True, text=True)
+        parts.append(out.stdout.splitlines()[0] if out.stdout else "")
+    except OSError:
+        parts.append("no-g++")
+
+    simgrid = Path(simgrid_path)
+    version_header = simgrid / "include/simgrid/version.h"
+    if version_header.exists():
+        parts.append(hashlib.sha256(version_header.read_bytes()).hexdigest())
+    library = simgrid / "lib/libsimgrid.so"
+    if library.exists():
+        parts.append(str(library.resolve()))
+
+    return "|".join(parts)
+
+
+@lru_cache(maxsize=None)
+def sources_fingerprint(summit_dir: str) -> str:
+    # the generator and the C++ sources it compiles are part of the key
+    digest = hashlib.sha256()
+    summit_dir = Path(summit_dir)
+    for name in ["summit_generator.py", "src/summit_base.cpp", "src/summit_base.hpp", "src/node_config.hpp",
+                 "src/summit_runtime.cpp"]:
+        source = summit_dir / name
+        if source.exists():
+            digest.update(name.encode())
+            digest.update(source.read_bytes())
+    return digest.hexdigest()
+
+
+def platform_key(node: dict, topology: dict, summit_dir: Path) -> str:
+    # canonical form: sorted keys, no whitespace, so equal configs always hash the same
+    canonical = json.dumps(
+        {
+            "node": node,
+            "topology": topology,
+            "toolchain": toolchain_fingerprint(),
+            "sources": sources_fingerprint(str(summit_dir)),
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def evict_lru(directory: Path, max_bytes: int, patterns: list[str]):
+    # least recently used first, by mtime, until the files matching patterns fit in max_bytes
+    entries = []
+    for pattern in patterns:
+        for entry in Path(directory).glob(pattern):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        entry.unlink(missing_ok=True)
+        total -= size
+
+
+class PlatformCache:
+    """On-disk cache of built platform libraries, keyed on platform_key, with LRU eviction."""
+
+    def __init__(self, cache_dir: Path = DEFAULT_CACHE_DIR, max_bytes: int = 2 * 1024**3):
+        self.cache_dir = Path(cache_dir).resolve()
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _entry(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.so"
+
+    def fetch(self, key: str, destination: Path) -> bool:
+        entry = self._entry(key)
+        try:
+            # bump the mtime so eviction sees this entry as recently used
+            os.utime(entry)
+        except FileNotFoundError:
+            return False
+
+        destination = Path(destination)
+        destination.unlink(missing_ok=True)
+        try:
+            os.link(entry, destination)
+        except OSError:
+            shutil.copy2(entry, destination)
+        return True
+
+    def store(self, key: str, platform_file: Path):
+        # copy to a temporary name first so concurrent readers never see a partial file
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        shutil.copy2(platform_file, tmp_name)
+        os.replace(tmp_name, self._entry(key))
+        self.evict()
+
+    def evict(self):
+        evict_lru(self.cache_dir, self.max_bytes, ["*.so"])
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from time import time
+from typing import Any, Callable, Iterable
+
+from Utils import CACHE_ROOT
+
+DEFAULT_RESULT_STORE = CACHE_ROOT / "results.sqlite"
+
+
+def canonical_key(*parts) -> str:
+    # str() on every leaf so that 86.85 and "86.85" or numpy scalars key the same way
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResultStore:
+    """SQLite-backed memo of simulated values, plus coalescing of identical in-flight computations.
+
+    Once the results take more than max_bytes, the oldest ones are deleted.
+    """
+
+    def __init__(self, filename: Path = DEFAULT_RESULT_STORE, max_bytes: int = 4 * 1024**3):
+        self.filename = Path(filename).resolve()
+        self.max_bytes = max_bytes
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, Future] = {}
+        self._db = None
+        self._pid = None
+
+    def __getstate__(self):
+        # a worker process opens its own connection
+        return {"filename": self.filename, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per process, shared by its threads under self._lock
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.filename, timeout=60, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value REAL NOT NULL, created REAL NOT NULL)"
+            )
+            # eviction goes through the oldest results first
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+            self._db.commit()
+            self._pid = os.getpid()
+        return self._db
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, float]:
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            db = self._connection()
+            # stay well below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = db.execute(
+                    f"SELECT key, value FROM results WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                )
+                found.update(rows.fetchall())
+        return found
+
+    def put_many(self, values: dict[str, float]):
+        now = time()
+        with self._lock:
+            db = self._connection()
+            db.executemany(
+                "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                [(key, float(value), now) for key, value in values.items()],
+            )
+            db.commit()
+            self.evict(db)
+
+    def evict(self, db: sqlite3.Connection):
+        # called with self._lock held; down to 90% of max_bytes, so the next puts do not
+        # evict again straight away. Freed pages are reused rather than returned to the system.
+        page_size = db.execute("PRAGMA page_size").fetchone()[0]
+        pages = db.execute("PRAGMA page_count").fetchone()[0] - db.execute("PRAGMA freelist_count").fetchone()[0]
+        used = pages * page_size
+        if used <= self.max_bytes:
+            return
+        rows = db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        excess = rows - int(rows * 0.9 * self.max_bytes / used)
+        db.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY created LIMIT ?)", (excess,))
+        db.commit()
+
+    def coalesce(self, key: str, compute: Callable[[], Any]) -> Any:
+        # the first caller computes, concurrent callers with the same key wait for its result
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = compute()
+            future.set_result(result)
+            return result
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
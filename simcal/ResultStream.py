@@ -0,0 +1,224 @@
+import io
+import json
+import os
+import signal
+import subprocess
+import shutil
+import sys
+import tarfile
+from pathlib import Path
+from time import perf_counter, sleep
+from typing import Callable, Iterator, NamedTuple, Optional
+
+# wrapper_parallel writes one JSON object per measured byte size to the file named by this
+# environment variable, e.g.
+#   {"benchmark": "PingPong", "bytes": 1024, "repetitions": 640, "relstderr": 0.01,
+#    "mbytes_per_sec": 1432.5, "t_avg": 0.71, "wall_time": 2.3}
+# and keeps printing the Mbytes/sec values on stdout for older callers, benchmark by
+# benchmark when given several as a comma separated list.
+RESULT_FILE_ENV = "MPI_BENCH_RESULT_FILE"
+
+# when set, names a file of per measurement relative standard error targets, one JSON
+# object per line, e.g.
+#   {"benchmark": "PingPong", "bytes": 1024, "relstderr": 0.005}
+# each measurement stops as soon as it reaches its target (or the iterations cap), the
+# threshold argument still applies to those without one
+TARGET_FILE_ENV = "MPI_BENCH_TARGET_FILE"
+
+# bytes in a megabyte of mbytes_per_sec, as in IMB's Mbytes/sec and the ground truth
+MEGABYTE = 1e6
+
+# fields a wrapper_parallel that writes no records still gives, through its stdout
+LEGACY_FIELDS = {"bytes", "mbytes_per_sec", "wall_time", "benchmark"}
+
+
+class SimulationRecord(NamedTuple):
+    bytes: int
+    mbytes_per_sec: float
+    repetitions: Optional[int] = None
+    relstderr: Optional[float] = None
+    t_avg: Optional[float] = None
+    # wall-clock seconds spent simulating this byte size, or the whole run when unknown
+    wall_time: Optional[float] = None
+    benchmark: Optional[str] = None
+
+    @classmethod
+    def from_json(cls, line: str) -> "SimulationRecord":
+        fields = json.loads(line)
+        if not isinstance(fields, dict) or "bytes" not in fields:
+            raise ValueError(f"not a record: {line!r}")
+        return cls(**{name: fields.get(name) for name in cls._fields})
+
+
+def reap(process: subprocess.Popen, block: bool = False) -> bool:
+    # Popen.poll()/wait() through os.wait4, which also gives the resource usage of the
+    # process and of the children it waited for, kept in process.rusage
+    if process.returncode is not None:
+        return True
+    try:
+        pid, status, rusage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+    except ChildProcessError:
+        return process.poll() is not None
+    if pid == 0:
+        return False
+    process.returncode = os.waitstatus_to_exitcode(status)
+    process.rusage = rusage
+    return True
+
+
+def kill(process: subprocess.Popen):
+    # the simulation runs in its own session, take its smpirun children down with it
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def parse_records(lines: list[str], result_file: Path) -> Iterator[SimulationRecord]:
+    # a malformed line is reported and skipped, the records around it still count
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield SimulationRecord.from_json(line)
+        except (ValueError, TypeError) as error:
+            sys.stderr.write(f"Skipping malformed record of {result_file}: {error}\n")
+
+
+def follow_records(
+    result_file: Path, process: subprocess.Popen, poll_interval: float = 0.05
+) -> Iterator[SimulationRecord]:
+    # yields records as the simulation writes them, until the process is gone
+    result_file = Path(result_file)
+    position = 0
+    pending = ""
+    while True:
+        finished = reap(process)
+        if result_file.exists():
+            with open(result_file) as f:
+                f.seek(position)
+                chunk = f.read()
+                position = f.tell()
+            pending += chunk
+            *lines, pending = pending.split("\n")
+            yield from parse_records(lines, result_file)
+        if finished:
+            # a last record without its newline
+            yield from parse_records([pending], result_file)
+            break
+        sleep(poll_interval)
+
+
+def legacy_records(std_out: str, byte_sizes: list, wall_time: float, benchmarks: list = None) -> list[SimulationRecord]:
+    # space separated Mbytes/sec values, in byte size order for each benchmark in turn
+    benchmarks = benchmarks or [None]
+    values = [float(x) for x in std_out.split() if x != ""]
+    expected = [(benchmark, byte_size) for benchmark in benchmarks for byte_size in byte_sizes]
+    if len(values) != len(expected):
+        # unexpected output, keep every value so the caller sees the mismatch
+        expected = [(benchmarks[0] if len(benchmarks) == 1 else None, None)] * len(values)
+    return [
+        SimulationRecord(bytes=byte_size, mbytes_per_sec=value, wall_time=wall_time, benchmark=benchmark)
+        for (benchmark, byte_size), value in zip(expected, values)
+    ]
+
+
+def stream_simulation(
+    command: list, byte_sizes: list, work_dir: Path, name: str,
+    on_record: Callable[[SimulationRecord], None] = None, on_start: Callable[[subprocess.Popen], None] = None,
+    benchmarks: list = None, limits: Callable[[int], None] = None, targets: dict = None, fields: set = None,
+) -> tuple[list[SimulationRecord], subprocess.Popen]:
+    # the simulation runs from work_dir/name, where its stdout, stderr and records go along
+    # with whatever it writes to its working directory (p2p_*.log, ...); stdout and stderr
+    # go to files so a chatty simulation can never block on a full pipe. fields are the
+    # SimulationRecord fields the caller needs, a wrapper_parallel without the records
+    # protocol is an error when they are not all in LEGACY_FIELDS or when targets are given.
+    run_dir = Path(work_dir) / name
+    if run_dir.exists():
+        shutil.rmtree(run_dir)
+    run_dir.mkdir(parents=True)
+    result_file = run_dir / "results.jsonl"
+
+    env = dict(os.environ)
+    env[RESULT_FILE_ENV] = str(result_file)
+    if targets:
+        # (benchmark, bytes) -> relstderr target
+        target_file = run_dir / "targets.jsonl"
+        with open(target_file, "w") as f:
+            for (benchmark, byte_size), target in targets.items():
+                f.write(json.dumps({"benchmark": benchmark, "bytes": byte_size, "relstderr": target}) + "\n")
+        env[TARGET_FILE_ENV] = str(target_file)
+
+    start = perf_counter()
+    with open(run_dir / "stdout", "w") as std_out, open(run_dir / "stderr", "w") as std_err:
+        process = subprocess.Popen(
+            [str(arg) for arg in command], stdout=std_out, stderr=std_err, env=env, cwd=run_dir,
+            start_new_session=True,
+        )
+    process.rusage = None
+    if limits is not None:
+        # applied from here rather than in a preexec_fn, which can deadlock the child of a
+        # threaded parent before it execs
+        try:
+            limits(process.pid)
+        except ProcessLookupError:
+            pass
+    if on_start is not None:
+        on_start(process)
+
+    records = []
+    try:
+        for record in follow_records(result_file, process):
+            if record.benchmark is None and benchmarks is not None and len(benchmarks) == 1:
+                record = record._replace(benchmark=benchmarks[0])
+            records.append(record)
+            if on_record is not None:
+                on_record(record)
+    except BaseException:
+        # nobody would be left to wait for the simulation
+        kill(process)
+        reap(process, block=True)
+        raise
+    reap(process, block=True)
+
+    if not result_file.exists() and process.returncode != 0:
+        # failed before writing anything, the caller sees the missing records
+        return records, process
+
+    if not result_file.exists():
+        # the wrapper does not speak the protocol, fall back to its stdout, which only has
+        # the Mbytes/sec values of the global threshold
+        unsupported = sorted(set(fields or ()) - LEGACY_FIELDS) + ([TARGET_FILE_ENV] if targets else [])
+        if unsupported:
+            raise RuntimeError(
+                f"{command[0]} wrote no {RESULT_FILE_ENV} records, so it cannot provide {', '.join(unsupported)}"
+            )
+        records = legacy_records(
+            (run_dir / "stdout").read_text(), byte_sizes, perf_counter() - start, benchmarks
+        )
+        if on_record is not None:
+            for record in records:
+                on_record(record)
+
+    return records, process
+
+
+def retain_logs(run_dir: Path, archive: Path, tail_bytes: int = 2**20, keep: int = 100):
+    # the last tail_bytes of every file of a run, in a gzipped tar; only the keep newest
+    # archives of its directory, by name, remain
+    run_dir, archive = Path(run_dir), Path(archive)
+    archive.parent.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(archive, "w:gz") as tar:
+        for path in sorted(run_dir.iterdir()):
+            if not path.is_file():
+                continue
+            with open(path, "rb") as f:
+                f.seek(max(path.stat().st_size - tail_bytes, 0))
+                data = f.read(tail_bytes)
+            info = tarfile.TarInfo(path.name)
+            info.size = len(data)
+            info.mtime = int(path.stat().st_mtime)
+            tar.addfile(info, io.BytesIO(data))
+
+    for old in sorted(archive.parent.glob("*.tar.gz"))[:-keep]:
+        old.unlink(missing_ok=True)
@@ -1,44 +1,264 @@
 import sys
 import os
+import copy
+import contextvars
+import hashlib
+import importlib.util
 import json
-import glob
+import re
+import subprocess
+import threading
 import simcal as sc
-from typing import List, Callable, Any
+from contextlib import nullcontext
+from typing import Any, NamedTuple
 from pathlib import Path
-import pandas as pd
-import shutil
 from math import sqrt
 import numpy as np
-from time import perf_counter
-from GroundTruth import MPIGroundTruth
-from Utils import explained_variance_error
-from calibrate_flops import calibrate_hostspeed
+from time import perf_counter, time_ns
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from Utils import CACHE_ROOT, ExplainedVarianceLoss, join_segments
+from calibrate_flops import calibrate_hostspeed, HOSTSPEED_TTL
+from PlatformCache import PlatformCache, evict_lru, platform_key, sources_fingerprint, toolchain_fingerprint
+from ResultStore import ResultStore, canonical_key
+from Journal import Journal
+from ResultStream import SimulationRecord, stream_simulation, retain_logs, kill
+from Tracing import Tracer, span, record_span
+from Workspace import WorkspacePool
+from Scheduler import AdmissionScheduler, Reservation
 
 MPI_EXEC = Path("../bin").resolve()
 summit = Path("./Summit").resolve()
 
+# objects of the platform builds, shared by all the calibrations, see summit_generator.py
+DEFAULT_BUILD_DIR = CACHE_ROOT / "platform_build"
+
+# Bump when a change here alters what a simulation returns, so stored results are not reused
+SIMULATOR_VERSION = "3"
+
+# benchmark_parent of the ground truth -> IMB executable in MPI_EXEC
+BENCHMARK_EXECUTABLES = {"P2P": "IMB-P2P", "1": "IMB-MPI1", "NBC": "IMB-NBC", "RMA": "IMB-RMA"}
+
+# bounds of the per byte size relative standard error targets of adaptive repetitions
+MIN_RELSTDERR_TARGET = 0.001
+MAX_RELSTDERR_TARGET = 0.1
+
+# summit_generator.py modules by path, imported once per process
+_generators = {}
+_generators_lock = threading.Lock()
+
+
+def load_generator(summit_dir: Path):
+    # imported rather than run, so builds share this process and report failures as exceptions
+    path = Path(summit_dir) / "summit_generator.py"
+    with _generators_lock:
+        if path not in _generators:
+            spec = importlib.util.spec_from_file_location(f"summit_generator_{len(_generators)}", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            _generators[path] = module
+        return _generators[path]
+
+
+class PlatformBuildError(Exception):
+    # the generator's own BuildError belongs to a module worker processes cannot unpickle
+    pass
+
+
+class EvaluationFailed(Exception):
+    # a simulation gave fewer values than its scenario has byte sizes, there is no loss to compute
+    pass
+
+
+class EvaluationAborted(Exception):
+    def __init__(self, lower_bound):
+        super().__init__(f"Evaluation aborted, its loss is at least {lower_bound}")
+        self.lower_bound = lower_bound
+
+
+class Cancellation:
+    """Shared by the scenarios of one evaluation, kills their wrapper_parallel processes once cancelled."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.processes = set()
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def register(self, process: subprocess.Popen):
+        with self.lock:
+            self.processes.add(process)
+            if self.event.is_set():
+                self._kill(process)
+
+    def unregister(self, process: subprocess.Popen):
+        with self.lock:
+            self.processes.discard(process)
+
+    def cancel(self):
+        with self.lock:
+            self.event.set()
+            for process in self.processes:
+                self._kill(process)
+
+    def _kill(self, process: subprocess.Popen):
+        kill(process)
+
+
+class Caches(NamedTuple):
+    # stored results of every simulation, and built platforms
+    results: ResultStore = None
+    platforms: PlatformCache = None
+
+
+class Admission(NamedTuple):
+    # simulations only start once the cores and memory they need are free, in workspaces
+    # of their own, at most max_parallel_scenarios scenarios at a time
+    scheduler: AdmissionScheduler = None
+    workspaces: WorkspacePool = None
+    max_parallel_scenarios: int = None
+
+
+class Recording(NamedTuple):
+    # journal of the evaluations and their per-phase timing; the outputs of a simulation are
+    # dropped with its workspace, those of failed ones are first archived in log_dir, up to
+    # max_retained_logs archives of the last log_tail_bytes of each file
+    journal: Journal = None
+    tracer: Tracer = None
+    log_dir: Path = "simulation_logs"
+    max_retained_logs: int = 100
+    log_tail_bytes: int = 2**20
+
+
+class PlatformBuild(NamedTuple):
+    # wrapper_parallel and the benchmarks, the Summit platform sources, and where the
+    # generator keeps the objects it can reuse, concurrent builds included, up to
+    # build_dir_bytes of them; hostspeed is measured unless given
+    mpi_exec: Path = None
+    summit_dir: Path = None
+    runtime_platform: bool = True
+    build_dir: Path = None
+    build_dir_bytes: int = 2 * 1024**3
+    hostspeed: float = None
+    hostspeed_ttl: float = HOSTSPEED_TTL
+
+
 class SMPISimulator(sc.Simulator):
 
     def __init__(
-        self, ground_truth, benchmark_parent, hostfile, threshold=0.0, num_procs=1, time=0
+        self, ground_truth, benchmark_parent, hostfile, threshold=0.0, num_procs=1, time=0,
+        iterations=10000, early_abort=False, batch_benchmarks=False, adaptive_repetitions=False, target_ratio=0.5,
+        caches: Caches = None, admission: Admission = None, recording: Recording = None,
+        platform_build: PlatformBuild = None
     ):
         super().__init__()
-        self.hostfile = hostfile
+        # absolute, simulations may run from another working directory
+        self.hostfile = Path(hostfile).resolve()
         self.benchmark_parent = benchmark_parent
         self.threshold = threshold
         self.time = time
         self.ground_truth = ground_truth
         self.num_procs = num_procs
-        self.loss_function = explained_variance_error
-        self.hostspeed = calibrate_hostspeed()
+        self.loss_function = ExplainedVarianceLoss(ground_truth[1])
+
+        caches = caches or Caches()
+        self.caches = Caches(
+            caches.results if caches.results is not None else ResultStore(),
+            caches.platforms if caches.platforms is not None else PlatformCache(),
+        )
+        admission = admission or Admission()
+        self.admission = Admission(
+            admission.scheduler if admission.scheduler is not None else AdmissionScheduler(),
+            admission.workspaces if admission.workspaces is not None else WorkspacePool(),
+            admission.max_parallel_scenarios or os.cpu_count() or 1,
+        )
+        recording = recording or Recording()
+        self.recording = recording._replace(
+            log_dir=Path(recording.log_dir).resolve() if recording.log_dir is not None else None
+        )
+        platform_build = platform_build or PlatformBuild()
+        self.platform_build = platform_build._replace(
+            mpi_exec=Path(platform_build.mpi_exec).resolve() if platform_build.mpi_exec is not None else MPI_EXEC,
+            summit_dir=Path(platform_build.summit_dir).resolve() if platform_build.summit_dir is not None else summit,
+            build_dir=Path(platform_build.build_dir).resolve() if platform_build.build_dir is not None else DEFAULT_BUILD_DIR,
+            hostspeed=platform_build.hostspeed if platform_build.hostspeed is not None
+            else calibrate_hostspeed(ttl=platform_build.hostspeed_ttl),
+        )
 
-    def need_more_benchs(self, count, iterations, relstderr):
+        self.iterations = iterations
+        # with adaptive repetitions, each (benchmark, byte size) measurement stops once its
+        # relative standard error is target_ratio times the one of the ground truth mean,
+        # iterations being only a cap
+        self.adaptive_repetitions = adaptive_repetitions
+        self.target_ratio = target_ratio
+        self.relstderr_targets = self.compute_relstderr_targets()
+        # (benchmark, node_count, processes, byte_size) -> (repetitions, relstderr) last achieved
+        self.achieved_repetitions = {}
+        # one wrapper_parallel run for all the benchmarks of a (parent, node_count, processes)
+        self.batch_benchmarks = batch_benchmarks
+        if self.platform_build.runtime_platform:
+            self.runtime_library = self.build_runtime_platform()
+        # objects and runtime platforms of older sources or toolchains, the least recently
+        # used first
+        if self.platform_build.build_dir.exists():
+            evict_lru(self.platform_build.build_dir, self.platform_build.build_dir_bytes, ["*.o", "*.so"])
+
+        # best loss returned so far, an evaluation that can no longer beat it is aborted
+        self.early_abort = early_abort
+        self.best_loss = None
+        self.best_loss_lock = threading.Lock()
+        # (benchmark, node_count, processes) -> {"time": seconds, "loss": loss contribution}
+        self.scenario_stats = {}
+
+        # optional callback receiving every SimulationRecord as soon as it is produced
+        self.on_record = None
+
+        # losses already in the journal are returned without simulating again
+        self.replay = {}
+        if self.recording.journal is not None:
+            for record in self.recording.journal.evaluations():
+                if not record.get("estimate"):
+                    self.replay[canonical_key(record["calibration"])] = record["loss"]
+            _, self.best_loss = self.recording.journal.best()
+
+    def __getstate__(self):
+        # sent to worker processes, see Coordinators.py
+        state = self.__dict__.copy()
+        del state["best_loss_lock"]
+        state["on_record"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.best_loss_lock = threading.Lock()
+
+    def variant(self, ground_truth=None, iterations=None):
+        # the same simulator on other (usually cheaper) scenarios, for multi-fidelity calibration
+        other = copy.copy(self)
+        if ground_truth is not None:
+            other.ground_truth = ground_truth
+            other.loss_function = ExplainedVarianceLoss(ground_truth[1])
+        if iterations is not None:
+            other.iterations = iterations
+        other.relstderr_targets = other.compute_relstderr_targets()
+        other.achieved_repetitions = {}
+        # losses of different variants are not comparable
+        other.best_loss = None
+        other.best_loss_lock = threading.Lock()
+        other.scenario_stats = {}
+        other.recording = other.recording._replace(journal=None)
+        other.replay = {}
+        return other
+
+    def need_more_benchs(self, count, iterations, relstderr, threshold=None):
         # setting a minimum iteration of 10
+        threshold = self.threshold if threshold is None else threshold
         res = (count < iterations) and (
             (count < 10)
-            or (self.threshold < 0.0)
+            or (threshold < 0.0)
             or (count < 2)
-            or (relstderr >= self.threshold)
+            or (relstderr >= threshold)
         )
 
         # print("DEBUG: need_more_benchs", count, iterations, relstderr, res)
@@ -46,14 +266,109 @@ class SMPISimulator(sc.Simulator):
         return res
 
 
-    def compile_platform(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]):
-        tmp_dir = env.tmp_dir()
+    def compute_relstderr_targets(self):
+        # (parent, benchmark, node_count, processes, byte_size) -> relative standard error target
+        if not self.adaptive_repetitions:
+            return {}
+        targets = {}
+        values = iter(self.ground_truth[1])
+        for i in self.ground_truth[0]:
+            for byte_size in i[3]:
+                samples = np.asarray(next(values), dtype=float)
+                samples = samples[np.isfinite(samples)]
+                if len(samples) < 2 or samples.mean() == 0:
+                    # nothing to derive a target from, the global threshold applies
+                    continue
+                ground_truth_relstderr = samples.std(ddof=1) / abs(samples.mean()) / sqrt(len(samples))
+                targets[(self.scenario_parent(i), i[0], i[1], i[2], byte_size)] = float(np.clip(
+                    self.target_ratio * ground_truth_relstderr, MIN_RELSTDERR_TARGET, MAX_RELSTDERR_TARGET
+                ))
+        return targets
+
+    def relstderr_target(self, i, byte_size):
+        return self.relstderr_targets.get((self.scenario_parent(i), i[0], i[1], i[2], byte_size))
+
+    def scenario_parent(self, i):
+        # known points are (benchmark, node_count, processes, byte_sizes[, executable[, metric]])
+        return i[4] if len(i) > 4 else self.benchmark_parent
+
+    def scenario_metric(self, i):
+        # SimulationRecord field compared to the ground truth
+        return i[5] if len(i) > 5 else "mbytes_per_sec"
+
+    def simulator_version(self):
+        # Everything besides the calibration and the scenario that can change a simulated value
+        binaries = []
+        parents = sorted({self.benchmark_parent} | {self.scenario_parent(i) for i in self.ground_truth[0]})
+        for binary in [self.platform_build.mpi_exec / "wrapper_parallel"] + [self.platform_build.mpi_exec / parent for parent in parents]:
+            if binary.exists():
+                stat = binary.stat()
+                binaries.append((binary.name, stat.st_size, stat.st_mtime))
+
+        return (
+            SIMULATOR_VERSION,
+            binaries,
+            sources_fingerprint(str(self.platform_build.summit_dir)),
+            self.platform_build.runtime_platform,
+            self.platform_build.hostspeed,
+            self.threshold,
+            self.iterations,
+        )
 
-        print(f"Creating temporary directory: {tmp_dir}")
-        # copy summit folder into tmpdir
-        shutil.copytree(summit, tmp_dir / "Summit")
+    def result_key(self, version, calibration, benchmark, node_count, processes, byte_size, parent=None,
+                   metric="mbytes_per_sec", target=None):
+        # results measured to a relative standard error target are not those of a fixed threshold
+        extra = () if target is None else (target,)
+        return canonical_key(
+            version,
+            {key: str(value) for key, value in calibration.items()},
+            parent or self.benchmark_parent,
+            metric,
+            benchmark,
+            int(node_count),
+            int(processes),
+            int(byte_size),
+            *extra,
+        )
+
+    def build_runtime_platform(self):
+        # The runtime platform is built once per version of the sources and reads its parameters from summit_platform.cfg
+        version = hashlib.sha256(f"{toolchain_fingerprint()}|{sources_fingerprint(str(self.platform_build.summit_dir))}".encode())
+        runtime_library = self.platform_build.build_dir / f"summit_runtime-{version.hexdigest()[:16]}.so"
+        try:
+            # marked as recently used, so it is the last to be evicted
+            os.utime(runtime_library)
+            return runtime_library
+        except FileNotFoundError:
+            pass
+
+        generator = load_generator(self.platform_build.summit_dir)
+        try:
+            generator.build_runtime(self.platform_build.build_dir, runtime_library)
+        except generator.BuildError as error:
+            sys.stderr.write(f"Runtime platform was unable to be built!\n\n{error}\n")
+            raise PlatformBuildError(str(error)) from None
+
+        return runtime_library
+
+    def write_platform_config(self, filename, node: dict, topology: dict):
+        # Flat "key = value" file read by load_platform in src/summit_runtime.cpp
+        config = dict(node)
+        config["name"] = topology["name"]
+        config.update(topology["Fat-Tree_parameters"])
+        for key in ["node_generator_cb", "limiter_cb", "bandwidth", "latency", "sharing_policy"]:
+            config[key] = topology[key]
+
+        with open(filename, "w") as f:
+            for key, value in config.items():
+                f.write(f"{key} = {value}\n")
+
+    def smpi_config(self, calibration: dict[str, sc.parameters.Value]) -> list[str]:
+        # calibration keys with a "/" are SMPI options given to every run, they need no platform build
+        return [f"--cfg={key}:{value}" for key, value in join_segments(calibration).items() if "/" in key]
+
+    def compile_platform(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value], tmp_dir: Path):
 
-        smpi_args_dict = {}
         node_args_dict = {}
         topology_args_dict = {}
         # iterations = 1 # NOTE: remove this line
@@ -62,66 +377,98 @@ class SMPISimulator(sc.Simulator):
 
         # Parsing the calibration arguments to sort them into the correct dictionaries
         # Calibration Arguments consist of
-        #   1. smpi arguments (passed into the wrapper executable)
+        #   1. smpi arguments (passed into the wrapper executable, see smpi_config)
         #   2. node arguments (node_config.json)
         #   3. topology arguments (topology.json)
 
         # TODO: clean this up a bit
         for key, value in calibration.items():
             if "/" in key:
-                smpi_args_dict[key] = value
+                continue
             elif key in topology_config:
                 topology_args_dict[key] = value
             else:
                 node_args_dict[key] = value
 
-        # parse the smpi_args_dict into cmd args for smpirun
-        smpi_args = []
-        for key, value in smpi_args_dict.items():
-            smpi_args.append(f"--cfg={key}:{value}")
-
         # Rebuilding the platform .so file with the new node and topology configurations
-        template_node = summit / "config/node_config.json"
-        template_topology = summit / "config/6-racks-no-gpu-no-nvme.json"
-
-
-        with open(template_node, "r") as f:
-            node = json.load(f)
-            for key, value in node_args_dict.items():
-                node[key] = str(value)
-
-        with open(tmp_dir / "node_config.json", "w") as f:
-            json.dump(node, f, indent=4)
-
-        with open(template_topology, "r") as f:
-            topology = json.load(f)
-            topology["name"] = "summit_temp"
-            for key, value in topology_args_dict.items():
-                topology[key] = str(value)
+        template_node = self.platform_build.summit_dir / "config/node_config.json"
+        template_topology = self.platform_build.summit_dir / "config/6-racks-no-gpu-no-nvme.json"
+
+
+        with span("config"):
+            with open(template_node, "r") as f:
+                node = json.load(f)
+                for key, value in node_args_dict.items():
+                    node[key] = str(value)
+
+            with open(tmp_dir / "node_config.json", "w") as f:
+                json.dump(node, f, indent=4)
+
+            with open(template_topology, "r") as f:
+                topology = json.load(f)
+                topology["name"] = "summit_temp"
+                for key, value in topology_args_dict.items():
+                    topology[key] = str(value)
+
+        # The prebuilt runtime platform only needs its configuration file next to it
+        if self.platform_build.runtime_platform:
+            with span("config"):
+                self.write_platform_config(tmp_dir / "summit_platform.cfg", node, topology)
+            platform_file = tmp_dir / "summit_temp.so"
+            platform_file.unlink(missing_ok=True)
+            platform_file.symlink_to(self.runtime_library)
+            return tmp_dir
+
+        # Reusing a previously built platform if these exact configurations were already compiled
+        key = platform_key(node, topology, self.platform_build.summit_dir)
+        with span("platform_cache"):
+            cached = self.caches.platforms.fetch(key, tmp_dir / "summit_temp.so")
+        if cached:
+            print(f"Reusing cached platform {key[:12]} in {tmp_dir}")
+            return tmp_dir
+
+        # candidates differing only in their SMPI options (e.g. the inner loop of a hierarchical
+        # search) arrive together, one of them builds and the others take its platform
+        built_dir = self.caches.results.coalesce(
+            f"platform:{key}", lambda: self.build_platform(node, topology, key, tmp_dir)
+        )
+        if built_dir != tmp_dir:
+            with span("platform_cache"):
+                cached = self.caches.platforms.fetch(key, tmp_dir / "summit_temp.so")
+            if not cached:
+                # evicted in between
+                self.build_platform(node, topology, key, tmp_dir)
 
-        with open(tmp_dir / "topology.json", "w") as f:
-            json.dump(topology, f, indent=4)
+        return tmp_dir
 
-        # Calling the summit platform generator
-        platform_args = (
-            [tmp_dir / "Summit/summit_generator.py"]
-            + [tmp_dir / "node_config.json"]
-            + [tmp_dir / "topology.json"]
-        )
+    def build_platform(self, node: dict, topology: dict, key: str, tmp_dir: Path) -> Path:
+        print(f"Building platform in workspace: {tmp_dir}")
 
-        _, std_err, exit_code = env.bash("python3", platform_args)
+        # Calling the summit platform generator, a failed build fails this evaluation only
+        generator = load_generator(self.platform_build.summit_dir)
+        with span("generator"):
+            try:
+                _, timings = generator.build_platform(node, topology, self.platform_build.build_dir, tmp_dir / "summit_temp.so")
+            except generator.BuildError as error:
+                sys.stderr.write(f"Platform was unable to be built!\n\n{error}\n")
+                raise PlatformBuildError(str(error)) from None
+            # one span per g++ step of the generator
+            for step, seconds in timings:
+                record_span(step, seconds)
 
-        if exit_code:
-            sys.stderr.write(
-                f"Platform was unable to be built and has failed with exit code {exit_code}!\n\n{std_err}\n"
-            )
-            exit(1)
+        with span("platform_cache"):
+            self.caches.platforms.store(key, tmp_dir / "summit_temp.so")
 
         return tmp_dir
 
 
-    def run_single_simulation(self, tmp_dir, benchmark, iterations, byte_size):
-        executable = MPI_EXEC / self.benchmark_parent
+    def run_single_simulation_records(
+        self, tmp_dir, benchmark, iterations, byte_size, cancellation: Cancellation = None, name=None, parent=None,
+        reservation: Reservation = None, targets: dict = None, smpi_args: list[str] = None, metrics: set = None
+    ) -> list[SimulationRecord]:
+        # several benchmarks of the same executable can share one run
+        benchmarks = list(benchmark) if isinstance(benchmark, (list, tuple)) else [benchmark]
+        executable = self.platform_build.mpi_exec / (parent or self.benchmark_parent)
 
         platform_file = tmp_dir / "summit_temp.so"
 
@@ -133,53 +480,316 @@ class SMPISimulator(sc.Simulator):
             platform_file,
             self.hostfile,
             str(executable),
-            benchmark,
+            ",".join(benchmarks),
             self.threshold,
             iterations,
             ','.join(map(str, byte_size)),
             "--log=root.threshold:error",
-            f"--cfg=smpi/host-speed:{self.hostspeed}f"
-        ]
-
-        std_out, std_err, exit_code = sc.bash(
-            MPI_EXEC / "wrapper_parallel", cmd_args, std_in=None
-        )
-
-        error_file = open("error.log", "a")
-
-        print(f"Std_err: \n{std_err}", file=error_file)
+            f"--cfg=smpi/host-speed:{self.platform_build.hostspeed}f"
+        ] + list(smpi_args or [])
+
+        if cancellation is not None and cancellation.is_set():
+            return []
+
+        # output files of this simulation inside tmp_dir
+        name = re.sub(r"\W+", "_", name or "-".join(benchmarks))
+
+        # records are handed to self.on_record as the simulation produces them
+        started = []
+
+        def on_start(process):
+            started.append(process)
+            if cancellation is not None:
+                cancellation.register(process)
+
+        start = perf_counter()
+        try:
+            records, process = stream_simulation(
+                [self.platform_build.mpi_exec / "wrapper_parallel"] + cmd_args,
+                byte_size,
+                tmp_dir,
+                name,
+                on_record=self.on_record,
+                on_start=on_start,
+                benchmarks=benchmarks,
+                limits=self.admission.scheduler.limits(reservation) if reservation is not None else None,
+                targets=targets,
+                fields=metrics,
+            )
+        finally:
+            # the process is gone either way, its pid must not be killed later on
+            if cancellation is not None:
+                for process in started:
+                    cancellation.unregister(process)
+        if reservation is not None and not (cancellation is not None and cancellation.is_set()):
+            self.admission.scheduler.observe(reservation, perf_counter() - start, process.rusage)
+        if cancellation is not None and cancellation.is_set():
+            # killed halfway, whatever it wrote is incomplete
+            return []
+
+        if process.returncode != 0 or len(records) < len(benchmarks) * len(byte_size):
+            self.retain_logs(tmp_dir / name, name, f"exit code {process.returncode}, {len(records)} records")
+
+        return records
+
+    def retain_logs(self, run_dir, name, reason):
+        if self.recording.log_dir is None:
+            return
+        archive = self.recording.log_dir / f"{time_ns()}-{os.getpid()}-{name}.tar.gz"
+        retain_logs(run_dir, archive, self.recording.log_tail_bytes, self.recording.max_retained_logs)
+        sys.stderr.write(f"Simulation {name} failed ({reason}), logs kept in {archive}\n")
+
+    def run_single_simulation(self, tmp_dir, benchmark, iterations, byte_size, cancellation: Cancellation = None, name=None):
+        records = self.run_single_simulation_records(tmp_dir, benchmark, iterations, byte_size, cancellation, name)
+        return [record.mbytes_per_sec for record in records]
+
+    def scenario_order(self, groups, scenarios):
+        # cheapest and most discriminating first: highest loss contribution per second of
+        # simulation, scenarios never timed before go first so they get measured
+        def priority(index):
+            i, _, _, missing = scenarios[index]
+            stats = self.scenario_stats.get((i[0], i[1], i[2]))
+            if stats is None:
+                return (0, i[2] * len(missing))
+            return (1, -stats["loss"] / max(stats["time"], 1e-6))
+
+        # a group of scenarios simulated together goes as early as its most urgent one
+        return sorted(groups, key=lambda group: min(priority(index) for index in group))
+
+    def scenario_groups(self, pending, scenarios):
+        # scenarios simulated by the same wrapper_parallel run
+        if not self.batch_benchmarks:
+            return [[index] for index in pending]
+        groups = {}
+        for index in pending:
+            i = scenarios[index][0]
+            groups.setdefault((self.scenario_parent(i), i[1], i[2]), []).append(index)
+        return list(groups.values())
+
+    def report_repetitions(self, i, records):
+        # repetitions each measurement took, and those that hit the iterations cap before
+        # their target, i.e. would still need more without it
+        for record in records:
+            if record.repetitions is None:
+                continue
+            self.achieved_repetitions[(i[0], i[1], i[2], record.bytes)] = (record.repetitions, record.relstderr)
+            target = self.relstderr_target(i, record.bytes)
+            if (
+                target is not None and record.relstderr is not None
+                and self.need_more_benchs(record.repetitions, float("inf"), record.relstderr, target)
+            ):
+                sys.stderr.write(
+                    f"{i[0]} {i[1]} {i[2]} {record.bytes}B: relstderr {record.relstderr:.4f} after "
+                    f"{record.repetitions} repetitions, target {target:.4f}\n"
+                )
+
+    def update_scenario_stats(self, i, duration, loss):
+        key = (i[0], i[1], i[2])
+        stats = self.scenario_stats.get(key)
+        if stats is None:
+            self.scenario_stats[key] = {"time": duration, "loss": loss}
+        else:
+            # exponential moving averages, candidates drift as the calibration goes on
+            stats["time"] = 0.7 * stats["time"] + 0.3 * duration
+            stats["loss"] = 0.7 * stats["loss"] + 0.3 * loss
+
+    def simulate(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]):
+        version = self.simulator_version()
+
+        scenarios = []
+        first_entry = 0
+        with span("result_store"):
+            for i in self.ground_truth[0]:
+                keys = [
+                    self.result_key(version, calibration, i[0], i[1], i[2], byte_size, self.scenario_parent(i),
+                                    self.scenario_metric(i), self.relstderr_target(i, byte_size))
+                    for byte_size in i[3]
+                ]
+                stored = self.caches.results.get_many(keys)
+                missing = [byte_size for byte_size, key in zip(i[3], keys) if key not in stored]
+                scenarios.append((i, keys, stored, missing))
+
+        # ground truth entries of each scenario, in the flattened order the loss expects
+        entries = []
+        for i, keys, _, _ in scenarios:
+            entries.append(slice(first_entry, first_entry + len(keys)))
+            first_entry += len(keys)
+
+        pending = [index for index, scenario in enumerate(scenarios) if scenario[3]]
+
+        # NaN until simulated, used to bound the loss while the evaluation is running
+        partial = np.full(first_entry, np.nan)
+        for index, (i, keys, stored, missing) in enumerate(scenarios):
+            partial[entries[index]] = [stored.get(key, np.nan) for key in keys]
+
+        best_loss = self.best_loss if self.early_abort else None
+        if pending and best_loss is not None:
+            lower_bound = self.loss_function.lower_bound(partial)
+            if lower_bound > best_loss:
+                raise EvaluationAborted(lower_bound)
+
+        # the platform is only needed if something has to be simulated
+        if pending:
+            # a recycled workspace, emptied again once the evaluation is over
+            with self.admission.workspaces.workspace() as tmp_dir:
+                with span("compile_platform"):
+                    self.compile_platform(env, calibration, tmp_dir)
+                smpi_args = self.smpi_config(calibration)
+                cancellation = Cancellation()
+                lower_bound = None
+                failure = None
+
+                def run_group(group):
+                    start = perf_counter()
+                    i = scenarios[group[0]][0]
+                    benchmarks = [scenarios[index][0][0] for index in group]
+                    # every benchmark of the run goes through every missing byte size of the group
+                    byte_sizes = sorted(set().union(*(scenarios[index][3] for index in group)))
+                    targets = {
+                        (benchmark, byte_size): self.relstderr_target(scenarios[index][0], byte_size)
+                        for index, benchmark in zip(group, benchmarks) for byte_size in byte_sizes
+                        if self.relstderr_target(scenarios[index][0], byte_size) is not None
+                    }
+                    name = f"{'+'.join(benchmarks)}-{i[1]}-{i[2]}"
+                    with span("admission", scenario=name):
+                        reservation = self.admission.scheduler.reserve(self.scenario_parent(i), i[1], i[2], byte_sizes)
+                    try:
+                        with span("wrapper_parallel", scenario=name, byte_sizes=len(byte_sizes),
+                                  cores=reservation.footprint.cores, memory=reservation.footprint.memory):
+                            records = self.run_single_simulation_records(
+                                tmp_dir, benchmarks, self.iterations, byte_sizes, cancellation, name,
+                                self.scenario_parent(i), reservation, targets, smpi_args,
+                                {self.scenario_metric(scenarios[index][0]) for index in group}
+                            )
+                    finally:
+                        self.admission.scheduler.release(reservation)
+                    return records, perf_counter() - start
+
+                # each task blocks on its own wrapper_parallel process, so threads are enough to keep
+                # the simulations of the different scenarios running side by side, as many at once
+                # as the scheduler admits
+                with span("simulations"), ThreadPoolExecutor(
+                    max_workers=min(len(pending), self.admission.max_parallel_scenarios)
+                ) as executor:
+                    # each task gets a copy of the context, so its span is nested in this evaluation
+                    futures = {
+                        executor.submit(contextvars.copy_context().run, run_group, group): group
+                        for group in self.scenario_order(self.scenario_groups(pending, scenarios), scenarios)
+                    }
+
+                    for future in as_completed(futures):
+                        if cancellation.is_set():
+                            break
+
+                        group = futures[future]
+                        records, duration = future.result()
+                        new_results = {}
+                        for index in group:
+                            i, keys, stored, missing = scenarios[index]
+                            metric = self.scenario_metric(i)
+                            own = [record for record in records if record.benchmark == i[0]]
+                            values = {
+                                record.bytes: getattr(record, metric) for record in own
+                                if getattr(record, metric) is not None
+                            }
+                            temp = [values[byte_size] for byte_size in missing if byte_size in values]
+                            if len(temp) != len(missing):
+                                # a failed run is never stored, and fails the evaluation
+                                failure = f"{i[0]} {i[1]} {i[2]} gave {metric} for {len(temp)} of {len(missing)} byte sizes"
+                                continue
+
+                            self.report_repetitions(i, own)
+                            missing_keys = [key for key in keys if key not in stored]
+                            new_results.update(zip(missing_keys, temp))
+                            stored.update(zip(missing_keys, temp))
+                            partial[entries[index]] = [stored[key] for key in keys]
+
+                            scenario_loss = self.loss_function.entry_losses(np.nan_to_num(partial))[0][entries[index]]
+                            self.update_scenario_stats(i, duration / len(group), float(scenario_loss.sum()))
+
+                        with span("result_store"):
+                            self.caches.results.put_many(new_results)
+
+                        if best_loss is not None and failure is None:
+                            lower_bound = self.loss_function.lower_bound(partial)
+                        if failure is not None or (lower_bound is not None and lower_bound > best_loss):
+                            # no point in simulating the rest
+                            for pending_future in futures:
+                                pending_future.cancel()
+                            cancellation.cancel()
+
+                if failure is not None:
+                    raise EvaluationFailed(failure)
+                if cancellation.is_set():
+                    raise EvaluationAborted(lower_bound)
+
+        # reassemble in ground truth order
+        res = []
+        for i, keys, stored, missing in scenarios:
+            res.extend(stored[key] for key in keys)
 
-        final_results = [float(x) for x in std_out.strip().split(" ") if x != ""]
+        return res
 
-        return final_results
+    def scenario_outputs(self, res):
+        # per-scenario split of a flat result list, as written to the journal
+        outputs = []
+        position = 0
+        for i in self.ground_truth[0]:
+            outputs.append({
+                "benchmark": i[0],
+                "node_count": int(i[1]),
+                "processes": int(i[2]),
+                "bytes": [int(byte_size) for byte_size in i[3]],
+                "values": res[position:position + len(i[3])],
+            })
+            position += len(i[3])
+        return outputs
 
     def run(
         self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]
     ) -> Any:
         print("Running simulator with calibration: ", calibration)
-        res = []
         start_time = perf_counter()
 
-        tmp_dir = self.compile_platform(env, calibration)
-
-        for i in self.ground_truth[0]:
-            temp = self.run_single_simulation(tmp_dir, i[0], 10000, i[3])
-            res.extend(temp)
-
-            files = glob.glob('p2p_*.log')
-
-            # Loop through and remove each file
-            for file in files:
-                try:
-                    os.remove(file)
-                except OSError as e:
-                    print(f"Error: {file} : {e.strerror}")
+        replay_key = canonical_key({key: str(value) for key, value in calibration.items()})
+        if replay_key in self.replay:
+            print(f"Loss from journal: {self.replay[replay_key]}")
+            return self.replay[replay_key]
+
+        tracing = self.recording.tracer.evaluation(calibration=calibration) if self.recording.tracer is not None else nullcontext()
+        with tracing:
+            return self.evaluate(env, calibration, start_time)
+
+    def evaluate(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value], start_time: float):
+        # identical candidates evaluated concurrently only get simulated once
+        candidate_key = canonical_key(
+            self.simulator_version(),
+            {key: str(value) for key, value in calibration.items()},
+            self.benchmark_parent,
+            self.ground_truth[0],
+        )
+        try:
+            res = self.caches.results.coalesce(candidate_key, lambda: self.simulate(env, calibration))
+        except EvaluationAborted as aborted:
+            # the bound is already worse than the best candidate, which is all the calibrator needs
+            print(f"Aborted, loss is at least {aborted.lower_bound}")
+            print(f"Time taken: {perf_counter() - start_time}")
+            if self.recording.journal is not None:
+                self.recording.journal.record(calibration, [], aborted.lower_bound, aborted=True)
+            return aborted.lower_bound
 
-            # print(f"Result for {i[0]}: {temp}")
         print("-----------", file=sys.stderr)
         print(f"Result: \n{res}\n", file=sys.stderr)
-        ret = self.loss_function(res, self.ground_truth[1])
+        with span("loss"):
+            ret = self.loss_function(res)
         print("Loss: ", ret)
+
+        with self.best_loss_lock:
+            if self.best_loss is None or ret < self.best_loss:
+                self.best_loss = ret
+
+        if self.recording.journal is not None:
+            self.recording.journal.record(calibration, self.scenario_outputs(res), ret)
         print(f"Time taken: {perf_counter() - start_time}")
         
         return ret
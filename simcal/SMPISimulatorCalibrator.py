@@ -1,63 +1,220 @@
-import json
-import os
 import sys
 from time import perf_counter
 from datetime import timedelta
 
-
-import simcal
-from sklearn.metrics import mean_squared_error as sklearn_mean_squared_error
-from pathlib import Path
-from typing import List, Callable, Any
 import simcal as sc
 
 import SMPISimulator
-from GroundTruth import MPIGroundTruth
+from Calibrators import SearchCalibrator, BayesianOptimization, SuccessiveHalving, HierarchicalSearch
+from AnalyticalSimulator import AnalyticalSimulator, PrescreenedSimulator
+from Coordinators import ProcessPool, RemotePool, DispatchingSimulator
+from Scenarios import MiniBatchSimulator, CandidateHistory
+from Sensitivity import screen, FixedParameters, ScreeningSimulator
+from Utils import segment_key
+from concurrent.futures import ThreadPoolExecutor
+
+# name -> (start, end, format) of the platform parameters being calibrated
+PLATFORM_PARAMETERS = {
+    "cpu_speed": (20, 100, "%.2fGf"),
+    "pcie_bw": (16, 160, "%.2fGBps"),
+    "pcie_lat": (1, 20, "%.2fns"),
+    "xbus_bw": (60, 70, "%.2fGBps"),
+    "xbus_lat": (1, 20, "%.2fns"),
+    "limiter_bw": (90, 10000, "%.2fGbps"),
+    "latency": (1e-8, 1e-10, "%.10f"),
+    "bandwidth": (25e9, 250e9, "%.2f"),
+}
+
+# SMPI piecewise factors, each segment calibrated on its own: name -> (start, end, format) of
+# the factor of every segment, segments being named by the smallest message size they apply to
+SMPI_FACTOR_PARAMETERS = {
+    "network/bandwidth-factor": (0.1, 10, "%.4f"),
+    "network/latency-factor": (0.1, 100, "%.4f"),
+}
+SMPI_FACTOR_THRESHOLDS = [65472, 15424, 9376, 5776, 3484, 1426, 732, 257, 0]
 
 class SMPISimulatorCalibrator:
-    def __init__(self, algorithm: str, simulator: SMPISimulator):
+    def __init__(
+        self, algorithm: str, simulator: SMPISimulator, low_fidelity: list = None,
+        analytical: AnalyticalSimulator = None, analytical_mode: str = "warm_start", analytical_candidates: int = 10000,
+        minibatch: int = None, confirm_top: int = 3, screening: int = 0, screening_threshold: float = 0.05,
+        smpi_factors: bool = False, inner_evaluations: int = 20
+    ):
         self.algorithm = algorithm
         self.simulator = simulator
+        # cheaper variants of the simulator, from lowest to highest fidelity, for hyperband
+        self.low_fidelity = low_fidelity or []
+        # analytical model used to warm start our own calibrators ("warm_start") or to skip
+        # the simulation of unpromising candidates ("prescreen", the only option for simcal's)
+        self.analytical = analytical
+        self.analytical_mode = analytical_mode
+        self.analytical_candidates = analytical_candidates
+        # candidates are scored on an estimate from minibatch scenarios of the ground truth,
+        # the confirm_top best ones are evaluated on all of them at the end
+        self.minibatch = minibatch
+        self.confirm_top = confirm_top
+        # Morris trajectories run before the search, parameters whose influence stays below
+        # screening_threshold of the largest one for every benchmark are pinned
+        self.screening = screening
+        self.screening_threshold = screening_threshold
+        # also calibrate the SMPI piecewise factors, which the hierarchical search explores
+        # inner_evaluations at a time for each platform
+        self.smpi_factors = smpi_factors
+        self.inner_evaluations = inner_evaluations
 
-    def compute_calibration(self, time_limit: float, num_threads: int):
+    def compute_calibration(
+        self, time_limit: float, num_threads: int, coordinator: str = "thread", remote_workers: list[str] = None
+    ):
+        # "thread" runs the simulators in threads of this process, "process" in num_threads
+        # worker processes and "remote" on the servers listed in remote_workers, each with
+        # its own copy of the simulators
         if self.algorithm == "grid":
             calibrator = sc.calibrators.Grid()
         elif self.algorithm == "random":
             calibrator = sc.calibrators.Random()
         elif self.algorithm == "gradient":
             calibrator = sc.calibrators.GradientDescent(0.001, 0.00001)
+        elif self.algorithm == "bayesopt":
+            calibrator = BayesianOptimization()
+        elif self.algorithm == "hyperband":
+            calibrator = SuccessiveHalving(self.low_fidelity)
+        elif self.algorithm == "hierarchical":
+            calibrator = HierarchicalSearch(self.inner_evaluations)
         else:
             raise Exception(f"Unknown calibration algorithm {self.algorithm}")
     
         
-        # Adding platform params
-        calibrator.add_param("cpu_speed", sc.parameter.Linear(20, 100).format("%.2fGf"))
-        calibrator.add_param("pcie_bw", sc.parameter.Linear(16, 160).format("%.2fGBps"))
-        calibrator.add_param("pcie_lat", sc.parameter.Linear(1, 20).format("%.2fns"))
-        calibrator.add_param("xbus_bw", sc.parameter.Linear(60, 70).format("%.2fGBps"))
-        calibrator.add_param("xbus_lat", sc.parameter.Linear(1, 20).format("%.2fns"))
-        calibrator.add_param("limiter_bw", sc.parameter.Linear(90, 10000).format("%.2fGbps"))
-
-        calibrator.add_param("latency", sc.parameter.Linear(1e-8, 1e-10).format("%.10f"))
-        calibrator.add_param("bandwidth", sc.parameter.Linear(25e9, 250e9).format("%.2f"))
-
-
-        # Adding smpi params
-        # should be called like so:
-        # split into 9 parts
-        # --cfg=network/bandwidth-factor:"65472:0.940694;15424:0.697866;9376:0.58729;5776:1.08739;3484:0.77493;1426:0.608902;732:0.341987;257:0.338112;0:0.812084"
-        # calibrator.add_param("network/bandwidth-factor", sc.parameter.Linear(0, 10).format("%.2f"))
-        
-        #latency: 65472:11.6436; 15424:3.48845; 9376:2.59299; 5776:2.18796; 3484:1.88101; 1426:1.61075; 732:1.9503; 257:1.95341;0:2.01467
-        # split into 9 parts
-        # calibrator.add_param("network/latency-factor", sc.parameter.Linear(0, 100).format("%.2f"))
+        # resuming: previously evaluated points seed our own calibrators, simcal ones only get
+        # their losses replayed by the simulator; with minibatch the search ranks estimates
+        journal = self.simulator.recording.journal
+        previous = []
+        if journal is not None:
+            journal.start_session(time_limit)
+            previous = [
+                (record["calibration"], record["loss"]) for record in journal.evaluations()
+                if bool(record.get("estimate")) == bool(self.minibatch)
+            ]
 
-        # Define the coordinator for the calibrator, in this case it's a ThreadPool
-        coordinator = sc.coordinators.ThreadPool(pool_size=num_threads)
+        # workers get the simulators once the journal session started, so they account
+        # their evaluations to it
+        pool = None
+        simulators = [self.simulator] + self.low_fidelity
+        minibatch_index = screening_index = None
+        if self.minibatch:
+            minibatch_index = len(simulators)
+            simulators.append(MiniBatchSimulator(self.simulator, self.minibatch))
+        if self.screening:
+            screening_index = len(simulators)
+            simulators.append(ScreeningSimulator(self.simulator))
+        if coordinator == "process":
+            pool = ProcessPool(simulators, num_threads)
+        elif coordinator == "remote":
+            pool = RemotePool(simulators, remote_workers)
+        elif coordinator != "thread":
+            raise Exception(f"Unknown coordinator {coordinator}")
+        if pool is not None:
+            num_threads = pool.workers
+            simulators = [DispatchingSimulator(pool, index) for index in range(len(simulators))]
+            if isinstance(calibrator, SuccessiveHalving):
+                calibrator.low_fidelity = simulators[1:len(self.low_fidelity) + 1]
+        full_simulator = simulators[0]
+        simulator = simulators[minibatch_index] if self.minibatch else full_simulator
 
         try:
+          # parameters that barely move the loss keep the value of the best screening point
+          fixed = {}
+          screening = None
+          if self.screening:
+              screening_start = perf_counter()
+              screening = screen(simulators[screening_index], PLATFORM_PARAMETERS, self.screening, workers=max(num_threads, 1))
+              print(f"Parameter influence:\n{screening.format()}")
+              if screening.best is not None:
+                  fixed = {name: screening.best[name] for name in screening.insensitive(self.screening_threshold)}
+              if len(fixed) == len(PLATFORM_PARAMETERS) and not self.smpi_factors:
+                  sys.stderr.write("No parameter influences the loss, none is pinned\n")
+                  fixed = {}
+              print(f"Pinned parameters: {fixed}")
+              time_limit -= perf_counter() - screening_start
+
+          # Adding platform params
+          for name, (start, end, fmt) in PLATFORM_PARAMETERS.items():
+              if name in fixed:
+                  continue
+              if isinstance(calibrator, SearchCalibrator):
+                  calibrator.add_param(name, start, end, fmt)
+              else:
+                  calibrator.add_param(name, sc.parameter.Linear(start, end).format(fmt))
+
+
+          # Adding smpi params, one per segment, joined back into e.g.
+          # --cfg=network/bandwidth-factor:65472:0.940694;15424:0.697866;...;0:0.812084
+          if self.smpi_factors:
+              for name, (start, end, fmt) in SMPI_FACTOR_PARAMETERS.items():
+                  for threshold in SMPI_FACTOR_THRESHOLDS:
+                      if isinstance(calibrator, SearchCalibrator):
+                          calibrator.add_param(segment_key(name, threshold), start, end, fmt)
+                      else:
+                          calibrator.add_param(segment_key(name, threshold), sc.parameter.Linear(start, end).format(fmt))
+
+          if isinstance(calibrator, SearchCalibrator):
+              calibrator.restore(previous)
+
+          history = None
+          if self.minibatch:
+              history = simulator = CandidateHistory(simulator)
+              history.restore(previous)
+
+          if self.analytical is not None:
+              if isinstance(calibrator, SearchCalibrator) and self.analytical_mode == "warm_start":
+                  calibrator.warm_start(lambda calibration: self.analytical.loss({**fixed, **calibration}), self.analytical_candidates)
+              else:
+                  simulator = PrescreenedSimulator(simulator, self.analytical)
+
+          # the search only sees the parameters left, the simulators get them all
+          if fixed:
+              simulator = FixedParameters(simulator, fixed)
+              if isinstance(calibrator, SuccessiveHalving):
+                  calibrator.low_fidelity = [FixedParameters(rung, fixed) for rung in calibrator.low_fidelity]
+
+          # Define the coordinator for the calibrator, in this case it's a ThreadPool; with
+          # worker processes its threads only wait for them
+          if isinstance(calibrator, SearchCalibrator):
+              # our own calibrators submit to a concurrent.futures executor
+              executor = ThreadPoolExecutor(max_workers=num_threads)
+          else:
+              executor = sc.coordinators.ThreadPool(pool_size=num_threads)
+
           start_time = perf_counter()
-          calibration, loss = calibrator.calibrate(self.simulator, timelimit=time_limit, coordinator=coordinator)
+          if isinstance(calibrator, SearchCalibrator):
+              calibration, loss = calibrator.calibrate(
+                  simulator, timelimit=time_limit, coordinator=executor, workers=num_threads
+              )
+          else:
+              calibration, loss = calibrator.calibrate(simulator, timelimit=time_limit, coordinator=executor)
+          if calibration is not None:
+              calibration = {**fixed, **calibration}
+
+          # (calibration, full loss) of every candidate for the result
+          candidates = []
+          if history is not None:
+              # the estimates only rank the candidates, the best ones get their actual loss
+              with ThreadPoolExecutor(max_workers=num_threads) as confirmation:
+                  candidates += confirmation.map(
+                      lambda candidate: (candidate, self.confirm(full_simulator, candidate)),
+                      history.best(self.confirm_top),
+                  )
+          elif calibration is not None and loss is not None:
+              candidates.append((calibration, loss))
+          if screening is not None and screening.best is not None:
+              # the screening design points were evaluated on the full loss too
+              candidates.append((screening.best, screening.best_loss))
+          if journal is not None:
+              candidates.append(journal.best())
+          candidates = [candidate for candidate in candidates if candidate[1] is not None]
+          if candidates and min(candidate[1] for candidate in candidates) < float("inf"):
+              calibration, loss = min(candidates, key=lambda candidate: candidate[1])
+          elif history is not None:
+              sys.stderr.write("No candidate confirmed, the loss is a mini-batch estimate\n")
           elapsed = int(perf_counter() - start_time)
           sys.stderr.write(f"Actually ran in {timedelta(seconds=elapsed)}\n")
           print("Calibrated Args: ")
@@ -68,5 +225,17 @@ class SMPISimulatorCalibrator:
           sys.stderr.write(str(type(error)))
           sys.stderr.write(f"Error while running experiments: {error}\n")
           sys.exit(1)
+        finally:
+          if pool is not None:
+              pool.shutdown()
 
         return calibration, loss
+
+    @staticmethod
+    def confirm(simulator, calibration: dict) -> float:
+        # one failed confirmation should not lose the others
+        try:
+            return simulator(calibration)
+        except Exception as error:
+            sys.stderr.write(f"Confirmation of {calibration} failed: {error}\n")
+            return float("inf")
@@ -0,0 +1,231 @@
+import threading
+from collections import deque
+from contextlib import nullcontext
+from math import sqrt
+from typing import Any, Callable, NamedTuple
+
+import numpy as np
+import simcal as sc
+
+from ResultStore import canonical_key
+from Tracing import span
+
+# per-scenario losses and costs remembered for each stratum, to allocate the next samples
+OBSERVATIONS_PER_STRATUM = 200
+
+
+def benchmark_stratum(i: tuple):
+    # known points are (benchmark, node_count, processes, byte_sizes[, executable[, metric]])
+    return i[4] if len(i) > 4 else None, i[0]
+
+
+class Sample(NamedTuple):
+    # sampled scenario indices, and stratum -> (stratum size, sampled indices of the stratum)
+    indices: list
+    strata: dict
+
+    def weight(self, index: int) -> float:
+        # inverse of the inclusion probability of a sampled scenario
+        for size, sampled in self.strata.values():
+            if index in sampled:
+                return size / len(sampled)
+        raise KeyError(index)
+
+
+class ScenarioSet:
+    """The scenarios of a ground truth, to estimate the loss of a candidate on a subset of them.
+
+    Scenarios are grouped in strata, by benchmark executable and benchmark unless stratum
+    is given. sample() draws a simple random sample without replacement in each stratum and
+    estimate() turns the summed entry losses of the sampled scenarios into the
+    Horvitz-Thompson estimate of the full loss, which is unbiased, and its variance.
+
+    Samples are allocated to strata in proportion to their size until every stratum was
+    observed, then by Neyman allocation, in proportion to size times the spread of its
+    scenario losses over the square root of its cost in seconds. Strata of two scenarios
+    or more always get two, so that their variance can be estimated.
+    """
+
+    def __init__(self, ground_truth, stratum: Callable[[tuple], Any] = None):
+        self.known_points, self.data = ground_truth
+        self.stratum = stratum or benchmark_stratum
+        self.entry_count = sum(len(i[3]) for i in self.known_points)
+
+        self.strata: dict[Any, list[int]] = {}
+        for index, i in enumerate(self.known_points):
+            self.strata.setdefault(self.stratum(i), []).append(index)
+
+        self.lock = threading.Lock()
+        self.losses = {key: deque(maxlen=OBSERVATIONS_PER_STRATUM) for key in self.strata}
+        self.costs = {key: deque(maxlen=OBSERVATIONS_PER_STRATUM) for key in self.strata}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.known_points)
+
+    def subset(self, indices: list) -> tuple:
+        # (known_points, data) of the given scenarios, in the same form as the full ground truth
+        first = np.cumsum([0] + [len(i[3]) for i in self.known_points])
+        return (
+            [self.known_points[index] for index in indices],
+            [values for index in indices for values in self.data[first[index]:first[index + 1]]],
+        )
+
+    def allocation(self, size: int) -> dict:
+        with self.lock:
+            spreads = {key: np.std(losses, ddof=1) if len(losses) > 1 else None for key, losses in self.losses.items()}
+            costs = {key: np.mean(costs) if costs else None for key, costs in self.costs.items()}
+        if all(spreads[key] is not None and costs[key] for key in self.strata) and any(spreads.values()):
+            shares = {
+                key: len(indices) * spreads[key] / sqrt(costs[key]) for key, indices in self.strata.items()
+            }
+        else:
+            shares = {key: len(indices) for key, indices in self.strata.items()}
+
+        total = sum(shares.values()) or 1
+        allocation = {}
+        for key, indices in self.strata.items():
+            count = round(size * shares[key] / total)
+            allocation[key] = min(max(count, min(len(indices), 2)), len(indices))
+        return allocation
+
+    def sample(self, size: int, rng: np.random.Generator) -> Sample:
+        strata = {}
+        for key, count in self.allocation(size).items():
+            indices = self.strata[key]
+            sampled = sorted(rng.choice(indices, size=count, replace=False).tolist())
+            strata[key] = (len(indices), sampled)
+        return Sample(sorted(index for _, sampled in strata.values() for index in sampled), strata)
+
+    def observe(self, losses: dict, costs: dict = None):
+        # summed entry losses and seconds of simulated scenarios, by scenario index
+        with self.lock:
+            for index, loss in losses.items():
+                self.losses[self.stratum(self.known_points[index])].append(loss)
+            for index, cost in (costs or {}).items():
+                self.costs[self.stratum(self.known_points[index])].append(cost)
+
+    def estimate(self, sample: Sample, losses: dict) -> tuple[float, float]:
+        # the full loss is the mean entry loss, so the stratum totals over the entry count
+        total, variance = 0.0, 0.0
+        for size, sampled in sample.strata.values():
+            values = np.array([losses[index] for index in sampled])
+            total += size * values.mean()
+            if len(values) > 1:
+                variance += size ** 2 * (1 - len(values) / size) * values.var(ddof=1) / len(values)
+        return total / self.entry_count, variance / self.entry_count ** 2
+
+
+class MiniBatchSimulator(sc.Simulator):
+    """Estimates the loss of a candidate by simulating size scenarios of simulator's ground truth.
+
+    Estimates go to simulator's journal flagged as such, and are replayed from it when resuming.
+    """
+
+    def __init__(self, simulator, size: int, scenarios: ScenarioSet = None, seed: int = None):
+        super().__init__()
+        self.simulator = simulator
+        self.size = size
+        self.scenarios = scenarios if scenarios is not None else ScenarioSet(simulator.ground_truth)
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.replay = {}
+        if simulator.recording.journal is not None:
+            for record in simulator.recording.journal.evaluations():
+                if record.get("estimate"):
+                    self.replay[canonical_key(record["calibration"])] = record["loss"]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def run(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]) -> Any:
+        calibration_key = canonical_key({key: str(value) for key, value in calibration.items()})
+        if calibration_key in self.replay:
+            print(f"Estimated loss from journal: {self.replay[calibration_key]}")
+            return self.replay[calibration_key]
+
+        # identical candidates evaluated concurrently share one sample
+        return self.simulator.caches.results.coalesce(
+            canonical_key("minibatch", calibration_key, self.simulator.benchmark_parent, self.scenarios.known_points),
+            lambda: self.estimate(env, calibration),
+        )
+
+    def estimate(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]) -> float:
+        with self.lock:
+            sample = self.scenarios.sample(self.size, self.rng)
+        subset = self.simulator.variant(ground_truth=self.scenarios.subset(sample.indices))
+
+        tracer = self.simulator.recording.tracer
+        evaluation = tracer.evaluation(
+            calibration={key: str(value) for key, value in calibration.items()}, scenarios=len(sample.indices)
+        ) if tracer is not None else nullcontext()
+        with evaluation:
+            results = subset.simulate(env, calibration)
+            with span("loss"):
+                entry_losses = subset.loss_function.entry_losses(results)[0]
+
+        losses, costs = {}, {}
+        first = 0
+        for index in sample.indices:
+            i = self.scenarios.known_points[index]
+            losses[index] = float(entry_losses[first:first + len(i[3])].sum())
+            first += len(i[3])
+            stats = subset.scenario_stats.get((i[0], i[1], i[2]))
+            if stats is not None:
+                costs[index] = stats["time"]
+        self.scenarios.observe(losses, costs)
+
+        loss, variance = self.scenarios.estimate(sample, losses)
+        print(f"Estimated loss: {loss} +- {sqrt(variance)} on {len(sample.indices)} of {len(self.scenarios)} scenarios")
+        if self.simulator.recording.journal is not None:
+            self.simulator.recording.journal.record(calibration, subset.scenario_outputs(results), loss, estimate=True)
+        return loss
+
+
+class CandidateHistory(sc.Simulator):
+    """Remembers the loss simulator returned for each candidate, to confirm the best ones on the full ground truth."""
+
+    def __init__(self, simulator: Callable):
+        super().__init__()
+        self.simulator = simulator
+        self.lock = threading.Lock()
+        self.history = []
+
+    def run(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]) -> Any:
+        loss = self.simulator(calibration)
+        with self.lock:
+            self.history.append((dict(calibration), loss))
+        return loss
+
+    def restore(self, evaluations: list):
+        # (calibration, loss) pairs of a previous session
+        with self.lock:
+            self.history.extend((dict(calibration), loss) for calibration, loss in evaluations)
+
+    def best(self, count: int) -> list[dict]:
+        # the count distinct candidates with the lowest losses
+        with self.lock:
+            history = sorted(self.history, key=lambda entry: entry[1])
+        candidates, seen = [], set()
+        for calibration, _ in history:
+            key = tuple(sorted((name, str(value)) for name, value in calibration.items()))
+            if key not in seen:
+                seen.add(key)
+                candidates.append(calibration)
+            if len(candidates) == count:
+                break
+        return candidates
@@ -0,0 +1,189 @@
+import math
+import os
+import resource
+import threading
+from collections import deque
+from itertools import count
+from typing import NamedTuple, Optional
+
+# first estimates of a simulation's memory, before one like it was measured: SimGrid
+# itself, each simulated host and each simulated process, which also holds the send and
+# receive buffers of the largest byte size
+BASE_MEMORY = 256 * 2**20
+HOST_MEMORY = 2**20
+RANK_MEMORY = 8 * 2**20
+
+# measured peaks are taken with this margin, the next run may need a bit more
+MEMORY_MARGIN = 1.25
+
+# a run using this share of its cores may have been held back by them, it gets twice as
+# many next time unless a run with the same parameters already left some idle
+SATURATION = 0.9
+
+
+# (index, count) of this worker process among those sharing its machine, set before the
+# simulators are unpickled, see Coordinators.py
+_worker_share = None
+
+
+def set_worker_share(index: int, count: int):
+    global _worker_share
+    _worker_share = (index, count)
+
+
+class Footprint(NamedTuple):
+    cores: int
+    memory: int
+
+
+class Reservation(NamedTuple):
+    key: tuple
+    footprint: Footprint
+    estimate: int
+    cpus: list
+
+
+def available_cores() -> list[int]:
+    return sorted(os.sched_getaffinity(0))
+
+
+def available_memory() -> int:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+
+
+class AdmissionScheduler:
+    """Starts simulations only once the cores and memory they need are free.
+
+    The footprint of a simulation is first estimated from its process count, node count
+    and largest byte size, then taken from the measured resource usage of the previous
+    one with the same parameters; estimates for new parameters are scaled by the worst
+    ratio of measured to estimated memory seen so far. A simulation bigger than the whole
+    machine still runs, alone. Simulations are admitted in the order they asked: one
+    waiting for its resources holds back the smaller ones behind it rather than being
+    starved by them. In the worker processes of a calibration, "machine" is the
+    worker's share: a slice of the cores and of the memory, see set_worker_share.
+
+    Admitted simulations are pinned to their cores and run with RLIMIT_CORE 0, and with
+    RLIMIT_AS at address_space_factor times their memory estimate and RLIMIT_CPU at
+    cpu_seconds when given. SMPI reserves far more address space than it uses, so the
+    former is off by default. Limits are set on the process as soon as it started, so
+    whatever it forks in its first instants escapes them.
+    """
+
+    def __init__(
+        self, cores: list[int] = None, memory_bytes: int = None, memory_fraction: float = 0.8,
+        address_space_factor: float = None, cpu_seconds: int = None
+    ):
+        self.cores = list(cores) if cores is not None else available_cores()
+        self.memory_bytes = memory_bytes or int(memory_fraction * available_memory())
+        self.address_space_factor = address_space_factor
+        self.cpu_seconds = cpu_seconds
+        self.condition = threading.Condition()
+        self.free_cores = list(self.cores)
+        self.used_memory = 0
+        self.running = 0
+        # tickets of the reservations waiting, in arrival order
+        self.tickets = count()
+        self.waiting = deque()
+        # (parent, node_count, processes, largest byte size) -> last measured footprint
+        self.measured: dict[tuple, Footprint] = {}
+        # keys whose runs did not use all the cores they were given
+        self.settled: set[tuple] = set()
+        self.memory_scale = 1.0
+
+    def __getstate__(self):
+        # a worker process schedules its own simulations, starting from what was learned
+        return {
+            "cores": self.cores, "memory_bytes": self.memory_bytes, "address_space_factor": self.address_space_factor,
+            "cpu_seconds": self.cpu_seconds, "measured": self.measured, "settled": self.settled,
+            "memory_scale": self.memory_scale,
+        }
+
+    def __setstate__(self, state):
+        learned = {name: state.pop(name) for name in ("measured", "settled", "memory_scale")}
+        if _worker_share is not None:
+            # workers of one machine split its cores and memory rather than each admitting
+            # simulations for all of them
+            index, count = _worker_share
+            cores = [core for core in state["cores"] if core in available_cores()] or available_cores()
+            state["cores"] = cores[index::count] or [cores[index % len(cores)]]
+            state["memory_bytes"] = state["memory_bytes"] // count
+        self.__init__(**state)
+        self.__dict__.update(learned)
+
+    @staticmethod
+    def heuristic(node_count: int, processes: int, byte_sizes: list) -> int:
+        return BASE_MEMORY + node_count * HOST_MEMORY + processes * (RANK_MEMORY + 2 * max(byte_sizes, default=0))
+
+    def reserve(self, parent: str, node_count: int, processes: int, byte_sizes: list) -> Reservation:
+        # blocks until the simulation can start
+        key = (parent, node_count, processes, max(byte_sizes, default=0))
+        estimate = self.heuristic(node_count, processes, byte_sizes)
+        with self.condition:
+            measured = self.measured.get(key)
+            if measured is not None:
+                footprint = Footprint(measured.cores, int(measured.memory * MEMORY_MARGIN))
+            else:
+                footprint = Footprint(1, int(estimate * self.memory_scale))
+            footprint = footprint._replace(cores=min(footprint.cores, len(self.cores)))
+
+            ticket = next(self.tickets)
+            self.waiting.append(ticket)
+            try:
+                self.condition.wait_for(lambda: self.waiting[0] == ticket and (self.running == 0 or (
+                    len(self.free_cores) >= footprint.cores and self.used_memory + footprint.memory <= self.memory_bytes
+                )))
+            finally:
+                # the next one in line may fit as well
+                self.waiting.remove(ticket)
+                self.condition.notify_all()
+            cpus = self.free_cores[:footprint.cores]
+            del self.free_cores[:footprint.cores]
+            self.used_memory += footprint.memory
+            self.running += 1
+        return Reservation(key, footprint, estimate, cpus)
+
+    def release(self, reservation: Reservation):
+        with self.condition:
+            self.free_cores.extend(reservation.cpus)
+            self.used_memory -= reservation.footprint.memory
+            self.running -= 1
+            self.condition.notify_all()
+
+    def limits(self, reservation: Reservation):
+        # applied by pid to the started simulation, see stream_simulation
+        cpus = reservation.cpus
+        address_space = int(self.address_space_factor * reservation.footprint.memory) if self.address_space_factor else None
+        cpu_seconds = self.cpu_seconds
+
+        def apply(pid: int):
+            os.sched_setaffinity(pid, cpus)
+            resource.prlimit(pid, resource.RLIMIT_CORE, (0, 0))
+            if address_space is not None:
+                resource.prlimit(pid, resource.RLIMIT_AS, (address_space, address_space))
+            if cpu_seconds is not None:
+                resource.prlimit(pid, resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+
+        return apply
+
+    def observe(self, reservation: Reservation, wall_time: float, rusage: Optional[resource.struct_rusage]):
+        # rusage of the finished simulation, as returned by os.wait4
+        if rusage is None or wall_time <= 0:
+            return
+        memory = rusage.ru_maxrss * 1024
+        busy = (rusage.ru_utime + rusage.ru_stime) / wall_time
+        cores = max(math.ceil(busy - (1 - SATURATION)), 1)
+        with self.condition:
+            if busy < SATURATION * reservation.footprint.cores:
+                self.settled.add(reservation.key)
+            elif reservation.key not in self.settled:
+                cores = max(cores, 2 * reservation.footprint.cores)
+            self.measured[reservation.key] = Footprint(min(cores, len(self.cores)), memory)
+            self.memory_scale = max(self.memory_scale, memory / reservation.estimate)
@@ -0,0 +1,184 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Callable, NamedTuple
+
+import numpy as np
+import simcal as sc
+
+from ResultStore import canonical_key
+from Tracing import span
+
+
+class Screening(NamedTuple):
+    names: list
+    # benchmark -> mean absolute elementary effect of each parameter ("all" for the whole loss),
+    # NaN for a parameter none of whose moves could be simulated
+    mu_star: dict
+    sigma: dict
+    # calibration of the design point with the lowest loss, None if every point failed
+    best: dict
+    best_loss: float
+
+    def influence(self, benchmark: str = "all") -> list[tuple[str, float]]:
+        # parameters from the most to the least influential, mu* relative to the largest one;
+        # NaN never compares below a threshold, so an unmeasured parameter is never pinned
+        mu_star = self.mu_star[benchmark]
+        scale = (np.nanmax(mu_star) if not np.isnan(mu_star).all() else 0.0) or 1.0
+        order = np.argsort(-mu_star)
+        return [(self.names[j], float(mu_star[j] / scale)) for j in order]
+
+    def insensitive(self, threshold: float) -> list[str]:
+        # parameters below threshold of the most influential one for every benchmark
+        return [
+            name for name in self.names
+            if all(dict(self.influence(benchmark))[name] < threshold for benchmark in self.mu_star)
+        ]
+
+    def format(self) -> str:
+        benchmarks = sorted(self.mu_star, key=lambda benchmark: (benchmark != "all", benchmark))
+        lines = [f"{'parameter':<14}" + "".join(f"{benchmark:>12}" for benchmark in benchmarks)]
+        relative = {benchmark: dict(self.influence(benchmark)) for benchmark in benchmarks}
+        for name, _ in self.influence():
+            lines.append(f"{name:<14}" + "".join(f"{relative[benchmark][name]:>12.3f}" for benchmark in benchmarks))
+        return "\n".join(lines)
+
+
+def morris_design(dimension: int, trajectories: int, levels: int, rng: np.random.Generator) -> list[tuple]:
+    # (points, steps) of each trajectory: dimension + 1 points of the levels-grid of the unit
+    # hypercube, each moving one parameter by +-delta, and the (parameter, step) of each move
+    delta = levels / (2 * (levels - 1))
+    grid = np.linspace(0, 1, levels)
+    design = []
+    for _ in range(trajectories):
+        point = rng.choice(grid, size=dimension)
+        points, steps = [point.copy()], []
+        for j in rng.permutation(dimension):
+            step = delta if point[j] + delta <= 1 else -delta
+            point[j] += step
+            points.append(point.copy())
+            steps.append((j, step))
+        design.append((points, steps))
+    return design
+
+
+def effect_stats(effect: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # mean absolute value and standard deviation of each column, ignoring NaN
+    known = ~np.isnan(effect)
+    count = known.sum(axis=0)
+    values = np.where(known, effect, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mu_star = np.abs(values).sum(axis=0) / count
+        mean = values.sum(axis=0) / count
+        sigma = np.sqrt(np.where(known, (values - mean) ** 2, 0.0).sum(axis=0) / count)
+    return mu_star, sigma
+
+
+def benchmark_losses(simulator, scoring, env: sc.Environment, calibration: dict) -> dict:
+    # loss of every benchmark of simulator's ground truth, and of all of them ("all"), simulated
+    # by scoring, a variant of simulator without early abort since every benchmark counts
+    tracer = scoring.recording.tracer
+    evaluation = tracer.evaluation(
+        calibration={key: str(value) for key, value in calibration.items()}, screening=True
+    ) if tracer is not None else nullcontext()
+    with evaluation:
+        results = scoring.simulate(env, calibration)
+        with span("loss"):
+            entry_losses = scoring.loss_function.entry_losses(results)[0]
+
+    benchmarks = np.repeat([i[0] for i in scoring.ground_truth[0]], [len(i[3]) for i in scoring.ground_truth[0]])
+    losses = {benchmark: float(entry_losses[benchmarks == benchmark].mean()) for benchmark in set(benchmarks)}
+    losses["all"] = float(entry_losses.mean())
+
+    # journaled and counted towards the best loss like the evaluations of the search
+    with simulator.best_loss_lock:
+        if simulator.best_loss is None or losses["all"] < simulator.best_loss:
+            simulator.best_loss = losses["all"]
+    journal = simulator.recording.journal
+    if journal is not None and canonical_key({key: str(value) for key, value in calibration.items()}) not in simulator.replay:
+        journal.record(calibration, simulator.scenario_outputs(results), losses["all"])
+    return losses
+
+
+class ScreeningSimulator(sc.Simulator):
+    """Returns the benchmark_losses of a calibration, so that screening points can go through a pool."""
+
+    def __init__(self, simulator):
+        super().__init__()
+        self.simulator = simulator
+        self.scoring = simulator.variant()
+
+    def run(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]) -> Any:
+        return benchmark_losses(self.simulator, self.scoring, env, calibration)
+
+
+def screen(
+    evaluate: Callable[[dict], dict], parameters: dict, trajectories: int = 4, levels: int = 4, workers: int = 1,
+    seed: int = None
+) -> Screening:
+    """Morris elementary effects of the parameters, (start, end, format) by name, on the loss of each benchmark.
+
+    The design has trajectories * (len(parameters) + 1) points, passed to evaluate workers at
+    a time, e.g. a ScreeningSimulator. A point that fails is left out of the effects of its
+    two moves instead of ending the screening.
+    """
+    names = list(parameters)
+    rng = np.random.default_rng(seed)
+    design = morris_design(len(names), trajectories, levels, rng)
+
+    def to_calibration(point):
+        return {
+            name: fmt % (start + x * (end - start)) for x, (name, (start, end, fmt)) in zip(point, parameters.items())
+        }
+
+    points = [point for trajectory, _ in design for point in trajectory]
+    calibrations = [to_calibration(point) for point in points]
+
+    def losses_of(calibration):
+        try:
+            return evaluate(calibration)
+        except Exception as error:
+            sys.stderr.write(f"Screening point {calibration} failed: {error}\n")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        losses = list(executor.map(losses_of, calibrations))
+
+    # elementary effects, one row per trajectory
+    benchmarks = sorted({benchmark for point in losses if point is not None for benchmark in point} | {"all"})
+    effects = {benchmark: np.full((trajectories, len(names)), np.nan) for benchmark in benchmarks}
+    first = 0
+    for t, (trajectory, steps) in enumerate(design):
+        for move, (j, step) in enumerate(steps):
+            before, after = losses[first + move], losses[first + move + 1]
+            if before is None or after is None:
+                continue
+            for benchmark in benchmarks:
+                effects[benchmark][t, j] = (after[benchmark] - before[benchmark]) / step
+        first += len(trajectory)
+
+    stats = {benchmark: effect_stats(effect) for benchmark, effect in effects.items()}
+    simulated = [index for index in range(len(points)) if losses[index] is not None]
+    best = min(simulated, key=lambda index: losses[index]["all"], default=None)
+    return Screening(
+        names,
+        {benchmark: mu_star for benchmark, (mu_star, _) in stats.items()},
+        {benchmark: sigma for benchmark, (_, sigma) in stats.items()},
+        calibrations[best] if best is not None else None,
+        losses[best]["all"] if best is not None else float("inf"),
+    )
+
+
+class FixedParameters(sc.Simulator):
+    """Completes the calibrations of a search over some of the parameters with fixed values for the others."""
+
+    def __init__(self, simulator, fixed: dict):
+        super().__init__()
+        self.simulator = simulator
+        self.fixed = dict(fixed)
+
+    def complete(self, calibration: dict) -> dict:
+        return {**self.fixed, **calibration}
+
+    def run(self, env: sc.Environment, calibration: dict[str, sc.parameters.Value]) -> Any:
+        return self.simulator(self.complete(calibration))
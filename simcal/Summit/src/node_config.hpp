@@ -1,19 +1,31 @@
-constexpr int cpu_core_count = 84;
-constexpr const char* cpu_speed = "86.85Gf";
-constexpr const char* gpu_speed = "7.8Tf";
+/* Copyright (c) 2022-2023. The SWAT Team. All rights reserved.          */
 
-constexpr const char* pcie_bw = "145.80Gbps";
-constexpr const char* pcie_lat = "16.45ns";
+/* This program is free software; you can redistribute it and/or modify it
+ * under the terms of the license (GNU LGPL) which comes with this package. */
+#include <string>
 
-constexpr const char* xbus_bw = "68.54GBps";
-constexpr const char* xbus_lat = "11.28ns";
+// Node parameters are filled in by load_platform before the fat-tree is created, either from
+// literals generated by summit_generator.py or from a config file read at load time.
+struct NodeConfig {
+  int cpu_core_count = 84;
+  std::string cpu_speed = "24.56Gf";
+  std::string gpu_speed = "7.8Tf";
 
-constexpr const char* cpu_gpu_nvlink_bw = "50Gbps";
-constexpr const char* cpu_gpu_nvlink_lat = "10ns";
-constexpr const char* gpu_gpu_nvlink_bw = "50Gbps";
-constexpr const char* gpu_gpu_nvlink_lat = "10ns";
+  std::string pcie_bw  = "16GBps";
+  std::string pcie_lat = "10ns";
 
-constexpr const char* nvme_read_bw = "5.5GBps";
-constexpr const char* nvme_write_bw = "2.1GBps";
+  std::string xbus_bw  = "64GBps";
+  std::string xbus_lat = "10ns";
 
-constexpr const char* limiter_bw = "13558.34Gbps";
+  std::string cpu_gpu_nvlink_bw  = "50Gbps";
+  std::string cpu_gpu_nvlink_lat = "10ns";
+  std::string gpu_gpu_nvlink_bw  = "50Gbps";
+  std::string gpu_gpu_nvlink_lat = "10ns";
+
+  std::string nvme_read_bw  = "5.5GBps";
+  std::string nvme_write_bw = "2.1GBps";
+
+  std::string limiter_bw = "100Gbps";
+};
+
+extern NodeConfig node_config;
@@ -7,17 +7,19 @@
 #include "summit_base.hpp"
 #include <iostream>
 
+NodeConfig node_config;
+
 static void add_gpus_to_cpu(sg4::NetZone* node_zone, const sg4::Host* cpu, unsigned int cpu_id)
 {
   const sg4::Host* gpus[3];
   for (unsigned int g = 0; g < 3; g++) {
     std::string gpu_name = node_zone->get_name() + "-gpu-" + std::to_string(3 * cpu_id + g);
-    gpus[g]              = node_zone->create_host(gpu_name, gpu_speed);
+    gpus[g]              = node_zone->create_host(gpu_name, node_config.gpu_speed);
 
     // add direct CPU-GPU NV-links
     auto* nvlink = node_zone->create_link(std::string("nvlink-") + cpu->get_cname() + "-" + gpu_name,
-                                          cpu_gpu_nvlink_bw)
-                            ->set_latency(cpu_gpu_nvlink_lat); // nvlink latency not documented
+                                          node_config.cpu_gpu_nvlink_bw)
+                            ->set_latency(node_config.cpu_gpu_nvlink_lat); // nvlink latency not documented
     node_zone->add_route(cpu, gpus[g], {nvlink});
   }
 
@@ -29,8 +31,8 @@ static void add_gpus_to_cpu(sg4::NetZone* node_zone, const sg4::Host* cpu, unsig
     auto* nvlink =
         node_zone
              ->create_link(std::string("nvlink-") + gpus[g]->get_cname() + "-" + gpus[(g + 1) % 3]->get_cname(),
-                           gpu_gpu_nvlink_bw)
-              ->set_latency(gpu_gpu_nvlink_lat); // nvlink latency not documented
+                           node_config.gpu_gpu_nvlink_bw)
+              ->set_latency(node_config.gpu_gpu_nvlink_lat); // nvlink latency not documented
     node_zone->add_route(gpus[g], gpus[(g + 1) % 3], {nvlink});
   }
 }
@@ -38,7 +40,7 @@ static void add_gpus_to_cpu(sg4::NetZone* node_zone, const sg4::Host* cpu, unsig
 static void add_NVMe_to_cpus(const std::string& node_name, sg4::Host** cpus)
 {
   /* create the NVMe as a disk attached to one CPU */
-  auto* nvme = cpus[0]->create_disk(node_name + "-NVMe", nvme_read_bw, nvme_write_bw);
+  auto* nvme = cpus[0]->create_disk(node_name + "-NVMe", node_config.nvme_read_bw, node_config.nvme_write_bw);
   /* then have the other CPU access it too */
   /* NOTE: PCIe link to NVMe is not modeled here. This is not compatible with how local disk are declared in SimGrid */
   cpus[1]->add_disk(nvme);
@@ -53,20 +55,20 @@ static simgrid::kernel::routing::NetPoint* add_cpus_and_nic(sg4::NetZone* node_z
   sg4::Host* cpus[2];
   for (unsigned int c = 0; c < 2; c++) {
     std::string cpu_name = node_name + "-cpu-" + std::to_string(c);
-    cpus[c]              = node_zone->create_host(cpu_name, cpu_speed)->set_core_count(cpu_core_count);
+    cpus[c]              = node_zone->create_host(cpu_name, node_config.cpu_speed)->set_core_count(node_config.cpu_core_count);
 
     if (with_gpus)
       add_gpus_to_cpu(node_zone, cpus[c], c);
 
     // add PCIe link from CPU to the NIC
-    auto* pcilink = node_zone->create_link(std::string("pcie-link-") + cpu_name, pcie_bw)
-                             ->set_latency(pcie_lat); // PCIe link latency not documented
+    auto* pcilink = node_zone->create_link(std::string("pcie-link-") + cpu_name, node_config.pcie_bw)
+                             ->set_latency(node_config.pcie_lat); // PCIe link latency not documented
     node_zone->add_route(cpus[c]->get_netpoint(), nic, nullptr, nullptr, {sg4::LinkInRoute(pcilink)});
   }
 
   // Add X-bus between the two CPUs
-  auto* xbus = node_zone->create_link(std::string("bus-") + node_name, xbus_bw)
-                   ->set_latency(xbus_lat); // X-bus latency not documented
+  auto* xbus = node_zone->create_link(std::string("bus-") + node_name, node_config.xbus_bw)
+                   ->set_latency(node_config.xbus_lat); // X-bus latency not documented
 
   node_zone->add_route(cpus[0], cpus[1], {xbus});
 
@@ -109,5 +111,5 @@ sg4::NetZone* gpu_nvme(const sg4::NetZone* parent_zone, const std::vector<unsign
 
 sg4::Link* limiter(sg4::NetZone* zone, const std::vector<unsigned long>& /*coord*/, unsigned long id)
 {
-  return zone->create_link("limiter-" + std::to_string(id), limiter_bw);
+  return zone->create_link("limiter-" + std::to_string(id), node_config.limiter_bw);
 }
@@ -0,0 +1,148 @@
+/* Copyright (c) 2022-2023. The SWAT Team. All rights reserved.          */
+
+/* This program is free software; you can redistribute it and/or modify it
+ * under the terms of the license (GNU LGPL) which comes with this package. */
+
+/* Prebuilt variant of the Summit platform: instead of having its parameters baked in by
+ * summit_generator.py, it reads them at load time from a "key = value" file. The file is
+ * given by the SUMMIT_PLATFORM_CONFIG environment variable, or else is the
+ * summit_platform.cfg file sitting next to the loaded library (or to the symlink to it). */
+
+#include "node_config.hpp"
+#include "summit_base.hpp"
+
+#include <cstdlib>
+#include <dlfcn.h>
+#include <fstream>
+#include <map>
+#include <sstream>
+
+XBT_LOG_NEW_DEFAULT_CATEGORY(summit_runtime, "Runtime-configured Summit platform");
+
+using NodeGenerator = sg4::NetZone* (*)(const sg4::NetZone*, const std::vector<unsigned long>&, unsigned long);
+using LimiterGenerator = sg4::Link* (*)(sg4::NetZone*, const std::vector<unsigned long>&, unsigned long);
+
+extern "C" void load_platform(const sg4::Engine& e);
+
+static std::string config_path()
+{
+  if (const char* path = std::getenv("SUMMIT_PLATFORM_CONFIG"))
+    return path;
+
+  Dl_info info;
+  xbt_assert(dladdr(reinterpret_cast<void*>(&load_platform), &info) != 0 && info.dli_fname != nullptr,
+             "Cannot locate the platform library to find its configuration");
+  std::string library = info.dli_fname;
+  auto slash          = library.rfind('/');
+  std::string dir     = slash == std::string::npos ? "." : library.substr(0, slash);
+  return dir + "/summit_platform.cfg";
+}
+
+static std::string trim(const std::string& s)
+{
+  auto begin = s.find_first_not_of(" \t\r\"");
+  if (begin == std::string::npos)
+    return "";
+  auto end = s.find_last_not_of(" \t\r\"");
+  return s.substr(begin, end - begin + 1);
+}
+
+static std::map<std::string, std::string> read_config(const std::string& path)
+{
+  std::ifstream in(path);
+  xbt_assert(in.good(), "Cannot open platform configuration '%s'", path.c_str());
+
+  std::map<std::string, std::string> config;
+  std::string line;
+  while (std::getline(in, line)) {
+    line = trim(line);
+    if (line.empty() || line[0] == '#')
+      continue;
+    auto eq = line.find('=');
+    xbt_assert(eq != std::string::npos, "Malformed line in '%s': %s", path.c_str(), line.c_str());
+    config[trim(line.substr(0, eq))] = trim(line.substr(eq + 1));
+  }
+  return config;
+}
+
+static std::string get(const std::map<std::string, std::string>& config, const std::string& key,
+                       const std::string& fallback)
+{
+  auto it = config.find(key);
+  return it == config.end() ? fallback : it->second;
+}
+
+// "{18, 18, 18}" or "18,18,18"
+static std::vector<unsigned int> parse_list(const std::string& value)
+{
+  std::vector<unsigned int> list;
+  std::string cleaned;
+  for (char c : value)
+    cleaned += (c == '{' || c == '}' || c == ',') ? ' ' : c;
+  std::istringstream in(cleaned);
+  unsigned int v;
+  while (in >> v)
+    list.push_back(v);
+  return list;
+}
+
+static sg4::Link::SharingPolicy parse_sharing_policy(const std::string& value)
+{
+  if (value == "SPLITDUPLEX")
+    return sg4::Link::SharingPolicy::SPLITDUPLEX;
+  if (value == "SHARED")
+    return sg4::Link::SharingPolicy::SHARED;
+  if (value == "FATPIPE")
+    return sg4::Link::SharingPolicy::FATPIPE;
+  xbt_die("Unknown sharing policy '%s'", value.c_str());
+}
+
+static NodeGenerator parse_node_generator(const std::string& value)
+{
+  if (value == "no_gpu_no_nvme")
+    return no_gpu_no_nvme;
+  if (value == "no_gpu_nvme")
+    return no_gpu_nvme;
+  if (value == "gpu_no_nvme")
+    return gpu_no_nvme;
+  if (value == "gpu_nvme")
+    return gpu_nvme;
+  xbt_die("Unknown node generator '%s'", value.c_str());
+}
+
+void load_platform(const sg4::Engine&)
+{
+  auto path   = config_path();
+  auto config = read_config(path);
+  XBT_DEBUG("Loading Summit platform from '%s'", path.c_str());
+
+  node_config.cpu_core_count     = std::stoi(get(config, "cpu_core_count", std::to_string(node_config.cpu_core_count)));
+  node_config.cpu_speed          = get(config, "cpu_speed", node_config.cpu_speed);
+  node_config.gpu_speed          = get(config, "gpu_speed", node_config.gpu_speed);
+  node_config.pcie_bw            = get(config, "pcie_bw", node_config.pcie_bw);
+  node_config.pcie_lat           = get(config, "pcie_lat", node_config.pcie_lat);
+  node_config.xbus_bw            = get(config, "xbus_bw", node_config.xbus_bw);
+  node_config.xbus_lat           = get(config, "xbus_lat", node_config.xbus_lat);
+  node_config.cpu_gpu_nvlink_bw  = get(config, "cpu_gpu_nvlink_bw", node_config.cpu_gpu_nvlink_bw);
+  node_config.cpu_gpu_nvlink_lat = get(config, "cpu_gpu_nvlink_lat", node_config.cpu_gpu_nvlink_lat);
+  node_config.gpu_gpu_nvlink_bw  = get(config, "gpu_gpu_nvlink_bw", node_config.gpu_gpu_nvlink_bw);
+  node_config.gpu_gpu_nvlink_lat = get(config, "gpu_gpu_nvlink_lat", node_config.gpu_gpu_nvlink_lat);
+  node_config.nvme_read_bw       = get(config, "nvme_read_bw", node_config.nvme_read_bw);
+  node_config.nvme_write_bw      = get(config, "nvme_write_bw", node_config.nvme_write_bw);
+  node_config.limiter_bw         = get(config, "limiter_bw", node_config.limiter_bw);
+
+  // Same argument order as the code emitted by summit_generator.py
+  auto levels       = static_cast<unsigned int>(std::stoul(get(config, "levels", "3")));
+  auto up_links     = parse_list(get(config, "up_links", "{18, 18, 18}"));
+  auto down_links   = parse_list(get(config, "down_links", "{1, 2, 9}"));
+  auto links_number = parse_list(get(config, "links_number", "{1, 2, 1}"));
+
+  NodeGenerator node_cb       = parse_node_generator(get(config, "node_generator_cb", "no_gpu_no_nvme"));
+  LimiterGenerator limiter_cb = get(config, "limiter_cb", "limiter") == "limiter" ? limiter : nullptr;
+
+  sg4::create_fatTree_zone(get(config, "name", "summit_temp"), nullptr, {levels, up_links, down_links, links_number},
+                           {node_cb, {}, limiter_cb}, std::stod(get(config, "bandwidth", "25e9")),
+                           std::stod(get(config, "latency", "1e-8")),
+                           parse_sharing_policy(get(config, "sharing_policy", "SPLITDUPLEX")))
+      ->seal();
+}
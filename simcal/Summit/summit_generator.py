@@ -2,81 +2,207 @@
 #
 # This program is free software; you can redistribute it and/or modify it
 # under the terms of the license (GNU LGPL) which comes with this package.
+#
+# Builds the Summit platform library, either with the node and topology parameters compiled
+# in or as the runtime platform reading them from summit_platform.cfg at load time.
+#
+# Usage: summit_generator.py <node_config.json> <topology.json> [--build_dir DIR] [--output FILE]
+#        summit_generator.py --runtime <output.so> [--build_dir DIR]
+#
+# Everything is written to the build directory, under content-addressed names, and the
+# output is renamed into place once complete, so concurrent builds can share a build
+# directory: objects whose source, headers, flags and toolchain did not change are reused.
+# The calibration imports this file and calls build_platform / build_runtime directly.
+import argparse
+import hashlib
 import json
-import sys
+import os
 import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from time import perf_counter
 
 SIMGRID_INSTALL_PATH = "/usr/local"
 
-f_node = open(sys.argv[1])
-node = json.load(f_node)
-
 # get path of this file
 path = Path(__file__).parent.absolute()
+source_dir = path / "src"
+
+CXXFLAGS = ["--std=c++17", "-I" + SIMGRID_INSTALL_PATH + "/include", "-I" + str(source_dir),
+            "-fPIC", "-O2", "-Wall", "-Wextra"]
+LDFLAGS = ["-shared", "-L" + SIMGRID_INSTALL_PATH + "/lib"]
+LIBS = ["-lsimgrid", "-ldl"]
+
+NODE_KEYS = ["cpu_speed", "gpu_speed", "pcie_bw", "pcie_lat", "xbus_bw", "xbus_lat", "cpu_gpu_nvlink_bw",
+             "cpu_gpu_nvlink_lat", "gpu_gpu_nvlink_bw", "gpu_gpu_nvlink_lat", "nvme_read_bw", "nvme_write_bw",
+             "limiter_bw"]
+
+
+class BuildError(Exception):
+    """A compilation or link step failed, with the compiler output."""
+
+    def __init__(self, step, output):
+        super().__init__(step + " failed\n" + output)
+        self.step = step
+        self.output = output
+
+
+@lru_cache(maxsize=None)
+def toolchain():
+    # compiler version and SimGrid headers, anything besides the sources that changes an object
+    parts = []
+    try:
+        parts.append(subprocess.run(["g++", "-dumpfullversion"], capture_output=True, text=True).stdout.strip())
+    except OSError:
+        parts.append("no-g++")
+    version_header = Path(SIMGRID_INSTALL_PATH) / "include/simgrid/version.h"
+    if version_header.exists():
+        parts.append(hashlib.sha256(version_header.read_bytes()).hexdigest())
+    return "|".join(parts)
+
+
+def content_hash(source, flags):
+    # the headers of src/ are hashed whole, they are few
+    digest = hashlib.sha256()
+    for part in [toolchain(), " ".join(flags), Path(source).read_bytes()]:
+        digest.update(part.encode() if isinstance(part, str) else part)
+    for header in sorted(source_dir.glob("*.hpp")):
+        digest.update(header.name.encode())
+        digest.update(header.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def run(step, args, timings):
+    start = perf_counter()
+    result = subprocess.run([str(arg) for arg in args], capture_output=True, text=True)
+    timings.append((step, perf_counter() - start))
+    if result.returncode != 0:
+        raise BuildError(step, result.stdout + result.stderr)
+
+
+def replace_atomically(build, output):
+    # build(tmp_file) writes the file, concurrent readers only ever see a complete one
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(prefix="." + output.name + ".", dir=output.parent)
+    os.close(fd)
+    try:
+        build(tmp_file)
+        os.replace(tmp_file, output)
+    finally:
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+
+
+def compile_object(source, build_dir, timings):
+    # reused when an object of the same content hash exists
+    source = Path(source)
+    obj = Path(build_dir) / (source.stem + "-" + content_hash(source, CXXFLAGS) + ".o")
+    try:
+        # marked as recently used, for the eviction of the build directory
+        os.utime(obj)
+        timings.append(("g++:" + source.name + ":cached", 0.0))
+        return obj
+    except FileNotFoundError:
+        pass
+    replace_atomically(lambda tmp_file: run("g++:" + source.name, ["g++"] + CXXFLAGS + ["-c", source, "-o", tmp_file],
+                                            timings), obj)
+    return obj
+
+
+def link(objects, output, timings):
+    replace_atomically(lambda tmp_file: run("g++:link", ["g++"] + LDFLAGS + list(objects) + LIBS + ["-o", tmp_file],
+                                            timings), output)
+    return Path(output)
+
+
+def platform_source(node, topo):
+    lines = [
+        "#include \"node_config.hpp\"",
+        "#include \"summit_base.hpp\"",
+        "extern \"C\" void load_platform(const sg4::Engine& e);",
+        "void load_platform(const sg4::Engine&)",
+        "{",
+        "node_config.cpu_core_count = " + str(node["cpu_core_count"]) + ";",
+    ]
+    for key in NODE_KEYS:
+        lines.append("node_config." + key + " = \"" + node[key] + "\";")
+    lines.append("sg4::create_fatTree_zone(\"" + topo["name"] + "\", nullptr, {" +
+                 str(topo["Fat-Tree_parameters"]["levels"]) + ", " + topo["Fat-Tree_parameters"]["up_links"] + ", " +
+                 topo["Fat-Tree_parameters"]["down_links"] + ", " + topo["Fat-Tree_parameters"]["links_number"] +
+                 "}, {" + topo["node_generator_cb"] + ", {}, " + topo["limiter_cb"] + "}, " +
+                 str(topo["bandwidth"]) + ", " + str(topo["latency"]) +
+                 ", sg4::Link::SharingPolicy::" + topo["sharing_policy"] + ")->seal();")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def build_platform(node, topo, build_dir, output=None, jobs=None):
+    """Platform with node and topo compiled in, written to output (build_dir/<name>.so by default).
+
+    Returns (output, timings), timings being the (step, seconds) of every g++ run; raises
+    BuildError when one fails.
+    """
+    build_dir = Path(build_dir)
+    build_dir.mkdir(parents=True, exist_ok=True)
+    output = Path(output) if output is not None else build_dir / (topo["name"] + ".so")
+    timings = []
+
+    # the generated source and its object are only used once, in a directory of this build
+    with tempfile.TemporaryDirectory(prefix="platform-", dir=build_dir) as private_dir:
+        source = Path(private_dir) / "platform.cpp"
+        source.write_text(platform_source(node, topo))
+        with ThreadPoolExecutor(max_workers=jobs or 2) as executor:
+            base = executor.submit(compile_object, source_dir / "summit_base.cpp", build_dir, timings)
+            platform = executor.submit(compile_object, source, private_dir, timings)
+            objects = [base.result(), platform.result()]
+        link(objects, output, timings)
+    return output, timings
+
+
+def build_runtime(build_dir, output, jobs=None):
+    """Platform reading its parameters from summit_platform.cfg, see build_platform."""
+    Path(build_dir).mkdir(parents=True, exist_ok=True)
+    timings = []
+    sources = [source_dir / "summit_base.cpp", source_dir / "summit_runtime.cpp"]
+    # one g++ per source, side by side
+    with ThreadPoolExecutor(max_workers=jobs or len(sources)) as executor:
+        objects = list(executor.map(lambda source: compile_object(source, build_dir, timings), sources))
+    return link(objects, output, timings), timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the Summit platform library")
+    parser.add_argument("node_config", nargs="?", help="node_config.json of the platform")
+    parser.add_argument("topology", nargs="?", help="topology.json of the platform")
+    parser.add_argument("--runtime", type=str, default=None, help="Build the runtime platform to this file instead")
+    parser.add_argument("--build_dir", type=str, default=".", help="Directory for the objects and, by default, the platform (Default: .)")
+    parser.add_argument("--output", type=str, default=None, help="Platform file (Default: <build_dir>/<topology name>.so)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Objects compiled at once (Default: all)")
+    args = parser.parse_args()
+
+    try:
+        if args.runtime is not None:
+            _, timings = build_runtime(args.build_dir, args.runtime, args.jobs)
+        else:
+            if args.topology is None:
+                parser.error("node_config and topology are required")
+            with open(args.node_config) as f:
+                node = json.load(f)
+            with open(args.topology) as f:
+                topo = json.load(f)
+            _, timings = build_platform(node, topo, args.build_dir, args.output, args.jobs)
+    except BuildError as error:
+        sys.stderr.write(str(error) + "\n")
+        sys.exit(1)
+
+    # time taken by every g++ step
+    for step, seconds in timings:
+        print(step + ": " + "%.3f" % seconds + "s")
+
 
-# check if lib folder exists
-lib_dir = path / "lib"
-
-if not lib_dir.exists():
-    lib_dir.mkdir(parents=True)
-
-with open(path / 'src/node_config.hpp', 'w') as f:
-      f.write("constexpr int cpu_core_count = " + str(node["cpu_core_count"]) + ";\n")
-      f.write("constexpr const char* cpu_speed = \"" + node["cpu_speed"] + "\";\n")
-      f.write("constexpr const char* gpu_speed = \"" + node["gpu_speed"] + "\";\n\n")
-      f.write("constexpr const char* pcie_bw = \"" + node["pcie_bw"] + "\";\n")
-      f.write("constexpr const char* pcie_lat = \"" + node["pcie_lat"] + "\";\n\n")
-      f.write("constexpr const char* xbus_bw = \"" + node["xbus_bw"] + "\";\n")
-      f.write("constexpr const char* xbus_lat = \"" + node["xbus_lat"] + "\";\n\n")
-      f.write("constexpr const char* cpu_gpu_nvlink_bw = \"" + node["cpu_gpu_nvlink_bw"] + "\";\n")
-      f.write("constexpr const char* cpu_gpu_nvlink_lat = \"" + node["cpu_gpu_nvlink_lat"] + "\";\n")
-      f.write("constexpr const char* gpu_gpu_nvlink_bw = \"" + node["gpu_gpu_nvlink_bw"] + "\";\n")
-      f.write("constexpr const char* gpu_gpu_nvlink_lat = \"" + node["gpu_gpu_nvlink_lat"] + "\";\n\n")
-      f.write("constexpr const char* nvme_read_bw = \"" + node["nvme_read_bw"] + "\";\n")
-      f.write("constexpr const char* nvme_write_bw = \"" + node["nvme_write_bw"] + "\";\n\n")
-      f.write("constexpr const char* limiter_bw = \"" + node["limiter_bw"] + "\";\n")
-
-f_topo = open(sys.argv[2])
-topo = json.load(f_topo)
-
-with open('tmp.cpp', 'w') as f:
-      f.write("#include \"summit_base.hpp\"\n")
-      f.write("extern \"C\" void load_platform(const sg4::Engine& e);\n")
-      f.write("void load_platform(const sg4::Engine&)\n")
-      f.write("{\n")
-      f.write("sg4::create_fatTree_zone(\"" + topo["name"] +"\", nullptr, {" +
-              str(topo["Fat-Tree_parameters"]["levels"]) + ", " + topo["Fat-Tree_parameters"]["up_links"] + ", " +
-              topo["Fat-Tree_parameters"]["down_links"] + ", " + topo["Fat-Tree_parameters"]["links_number"] +
-              "}, {" + topo["node_generator_cb"] + ", {}, " + topo["limiter_cb"] + "}, " +
-              str(topo["bandwidth"]) + ", " + str(topo["latency"]) +
-              ", sg4::Link::SharingPolicy::" + topo["sharing_policy"] +")->seal();\n")
-      f.write("}\n")
-
-base   = subprocess.run(['g++', '-v', '--std=c++17', '-I'+ SIMGRID_INSTALL_PATH +'/include', '-L'+ SIMGRID_INSTALL_PATH +
-                        '/lib/', '-lsimgrid', '-fPIC', '-g', '-O2', '-Wall', '-Wextra', '-c', path / 'src/summit_base.cpp', '-o',
-                        path / 'lib/summit_base.o'])
-if base.returncode != 0:
-      sys.stderr.write("Compilation of summit_base.cpp failed\n")
-      sys.exit(1)
-
-compil = subprocess.run(['g++', '--std=c++17', '-v', '-I'+ SIMGRID_INSTALL_PATH +'/include', '-I' + (str(path / 'src')),
-                         '-L'+ SIMGRID_INSTALL_PATH + '/lib/', '-lsimgrid', '-fPIC', '-g', '-O2', '-Wall', '-Wextra',
-                         '-c', 'tmp.cpp', '-o', 'tmp.o'])
-
-if compil.returncode != 0:
-      sys.stderr.write("Compilation of tmp.cppfailed\n")
-      sys.exit(1)
-
-link   = subprocess.run(['g++','-v', '--std=c++17', '-shared', '-I'+ SIMGRID_INSTALL_PATH +'/include', '-L'+SIMGRID_INSTALL_PATH + '/lib', '-lsimgrid', 'tmp.o', '-o', topo["name"] + ".so",
-                        path / "lib/summit_base.o"])
-if link.returncode != 0:
-      sys.stderr.write("Linking failed\n")
-      sys.exit(1)
-
-clean  = subprocess.run(['rm', '-f', 'tmp.cpp', 'tmp.o'])
-
-base
-compil
-link
-# clean
+if __name__ == "__main__":
+    main()
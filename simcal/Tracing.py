@@ -0,0 +1,254 @@
+import contextvars
+import csv
+import json
+import os
+import sys
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import count
+from pathlib import Path
+from time import perf_counter, time
+from typing import Optional
+
+# (tracer, evaluation id, phase) of the innermost open span, copied into worker threads with
+# contextvars.copy_context() so nested spans know where they belong
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+TRACE_FIELDS = ["evaluation", "phase", "parent", "start", "duration", "attributes"]
+
+
+class Tracer:
+    """Per-evaluation timing spans, written as a JSON-lines or CSV trace as they close.
+
+    An evaluation is opened with tracer.evaluation() and the code it calls opens nested
+    phases with span(phase); span() does nothing when no evaluation is being traced. The
+    trace format follows the extension of trace_file (.csv or anything else for JSON lines)
+    and prometheus_file, when given, is rewritten after every evaluation in the node
+    exporter textfile format, from running totals that only read the part of the trace
+    written since the last update.
+    """
+
+    def __init__(self, trace_file: Path = None, prometheus_file: Path = None):
+        self.trace_file = Path(trace_file).resolve() if trace_file is not None else None
+        self.prometheus_file = Path(prometheus_file).resolve() if prometheus_file is not None else None
+        self.lock = threading.Lock()
+        self.ids = count()
+        self.start = perf_counter()
+        self.created = time()
+        self.spans: list[dict] = []
+        self.evaluations = 0
+        self.phase_seconds = defaultdict(float)
+        # bytes of the trace file already folded into the totals, earlier runs are skipped
+        self.offset = 0
+
+        if self.trace_file is not None and self.trace_file.suffix == ".csv" and not self.trace_file.exists():
+            with open(self.trace_file, "w", newline="") as f:
+                csv.writer(f).writerow(TRACE_FIELDS)
+        if self.trace_file is not None and self.trace_file.exists():
+            self.offset = self.trace_file.stat().st_size
+
+    def __getstate__(self):
+        # worker processes append to the same trace file
+        return {"trace_file": self.trace_file, "prometheus_file": self.prometheus_file, "created": self.created,
+                "offset": self.offset}
+
+    def __setstate__(self, state):
+        self.trace_file = state["trace_file"]
+        self.prometheus_file = state["prometheus_file"]
+        self.created = state["created"]
+        self.lock = threading.Lock()
+        self.ids = count()
+        self.start = perf_counter() - (time() - self.created)
+        self.spans = []
+        self.evaluations = 0
+        self.phase_seconds = defaultdict(float)
+        self.offset = state["offset"]
+
+    @contextmanager
+    def evaluation(self, **attributes):
+        # unique across the processes sharing the trace file
+        evaluation = f"{os.getpid()}.{next(self.ids)}"
+        token = _current_span.set((self, evaluation, None))
+        try:
+            with span("evaluation", **attributes):
+                yield evaluation
+        finally:
+            _current_span.reset(token)
+            self.write_prometheus()
+
+    def add(self, evaluation: str, phase: str, parent: Optional[str], start: float, duration: float, attributes: dict):
+        entry = {
+            "evaluation": evaluation,
+            "phase": phase,
+            "parent": parent,
+            "start": start,
+            "duration": duration,
+            "attributes": attributes,
+        }
+        with self.lock:
+            self.spans.append(entry)
+            if self.trace_file is None:
+                self.fold([entry])
+                return
+            with open(self.trace_file, "a", newline="") as f:
+                if self.trace_file.suffix == ".csv":
+                    csv.writer(f).writerow([entry[field] if field != "attributes" else json.dumps(attributes, default=str)
+                                            for field in TRACE_FIELDS])
+                else:
+                    f.write(json.dumps(entry, default=str) + "\n")
+
+    def summary(self) -> dict:
+        if self.trace_file is not None and self.trace_file.exists():
+            # includes the spans of worker processes, but not those of earlier runs
+            spans = [entry for entry in read_trace(self.trace_file) if entry["start"] >= self.created]
+        else:
+            with self.lock:
+                spans = list(self.spans)
+        return summarize(spans, perf_counter() - self.start)
+
+    def fold(self, spans: list[dict]):
+        for entry in spans:
+            if entry["phase"] == "evaluation":
+                self.evaluations += 1
+            self.phase_seconds[entry["phase"]] += entry["duration"]
+
+    def fold_trace(self):
+        # the spans appended since the last call, by this process or the workers; a line still
+        # being written is left for the next one
+        with open(self.trace_file, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        lines = data[:end].decode().splitlines()
+        if self.trace_file.suffix == ".csv":
+            spans = [span_from_row(dict(zip(TRACE_FIELDS, row))) for row in csv.reader(lines) if row != TRACE_FIELDS]
+        else:
+            spans = [json.loads(line) for line in lines if line.strip()]
+        self.fold([entry for entry in spans if entry["start"] >= self.created])
+
+    def write_prometheus(self):
+        if self.prometheus_file is None:
+            return
+        with self.lock:
+            if self.trace_file is not None and self.trace_file.exists():
+                self.fold_trace()
+            evaluations = self.evaluations
+            phase_seconds = dict(self.phase_seconds)
+        wall_time = perf_counter() - self.start
+        lines = [
+            "# HELP mpi_bench_cal_evaluations_total Calibration evaluations finished.",
+            "# TYPE mpi_bench_cal_evaluations_total counter",
+            f"mpi_bench_cal_evaluations_total {evaluations}",
+            "# HELP mpi_bench_cal_evaluations_per_hour Calibration throughput since the start of the run.",
+            "# TYPE mpi_bench_cal_evaluations_per_hour gauge",
+            f"mpi_bench_cal_evaluations_per_hour {evaluations * 3600 / wall_time if wall_time > 0 else 0.0}",
+            "# HELP mpi_bench_cal_phase_seconds_total Time spent in each phase of the evaluations.",
+            "# TYPE mpi_bench_cal_phase_seconds_total counter",
+        ]
+        for phase, seconds in sorted(phase_seconds.items()):
+            lines.append(f'mpi_bench_cal_phase_seconds_total{{phase="{phase}"}} {seconds}')
+
+        # the node exporter may read at any time, never let it see half a file
+        tmp_file = self.prometheus_file.with_name(f".{self.prometheus_file.name}.{os.getpid()}.{threading.get_ident()}")
+        tmp_file.write_text("\n".join(lines) + "\n")
+        os.replace(tmp_file, self.prometheus_file)
+
+
+@contextmanager
+def span(phase: str, **attributes):
+    current = _current_span.get()
+    if current is None:
+        yield
+        return
+
+    tracer, evaluation, parent = current
+    token = _current_span.set((tracer, evaluation, phase))
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        duration = perf_counter() - start
+        _current_span.reset(token)
+        tracer.add(evaluation, phase, parent, time() - duration, duration, attributes)
+
+
+def record_span(phase: str, duration: float, **attributes):
+    # a phase timed elsewhere, e.g. a g++ step of the platform generator, ending now
+    current = _current_span.get()
+    if current is not None:
+        tracer, evaluation, parent = current
+        tracer.add(evaluation, phase, parent, time() - duration, duration, attributes)
+
+
+def summarize(spans: list[dict], wall_time: float = None) -> dict:
+    evaluations = [entry for entry in spans if entry["phase"] == "evaluation"]
+    evaluation_seconds = sum(entry["duration"] for entry in evaluations)
+    if wall_time is None:
+        wall_time = max((entry["start"] + entry["duration"] for entry in spans), default=0.0) - min(
+            (entry["start"] for entry in spans), default=0.0
+        )
+
+    phase_seconds = defaultdict(float)
+    for entry in spans:
+        phase_seconds[entry["phase"]] += entry["duration"]
+
+    # share of the evaluation time taken by its direct phases, the rest being Python overhead
+    share = defaultdict(float)
+    for entry in spans:
+        if entry["parent"] == "evaluation":
+            share[entry["phase"]] += entry["duration"]
+    if evaluation_seconds > 0:
+        share = {phase: seconds / evaluation_seconds for phase, seconds in share.items()}
+        share["other"] = max(1.0 - sum(share.values()), 0.0)
+
+    return {
+        "evaluations": len(evaluations),
+        "wall_time": wall_time,
+        "evaluations_per_hour": len(evaluations) * 3600 / wall_time if wall_time > 0 else 0.0,
+        "mean_evaluation_seconds": evaluation_seconds / len(evaluations) if evaluations else 0.0,
+        "phase_seconds": dict(phase_seconds),
+        "time_share": dict(share),
+    }
+
+
+def format_summary(summary: dict) -> str:
+    lines = [
+        f"Evaluations: {summary['evaluations']} in {summary['wall_time']:.1f}s "
+        f"({summary['evaluations_per_hour']:.1f}/hour, {summary['mean_evaluation_seconds']:.2f}s each)",
+        "Time share of an evaluation:",
+    ]
+    for phase, share in sorted(summary["time_share"].items(), key=lambda item: -item[1]):
+        lines.append(f"  {phase:<20} {100 * share:5.1f}%")
+    lines.append("Total time per phase:")
+    for phase, seconds in sorted(summary["phase_seconds"].items(), key=lambda item: -item[1]):
+        lines.append(f"  {phase:<20} {seconds:10.2f}s")
+    return "\n".join(lines)
+
+
+def span_from_row(row: dict) -> dict:
+    return {
+        "evaluation": row["evaluation"],
+        "phase": row["phase"],
+        "parent": row["parent"] or None,
+        "start": float(row["start"]),
+        "duration": float(row["duration"]),
+        "attributes": json.loads(row["attributes"]),
+    }
+
+
+def read_trace(trace_file: Path) -> list[dict]:
+    trace_file = Path(trace_file)
+    spans = []
+    with open(trace_file, newline="") as f:
+        if trace_file.suffix == ".csv":
+            spans = [span_from_row(row) for row in csv.DictReader(f)]
+        else:
+            spans = [json.loads(line) for line in f if line.strip()]
+    return spans
+
+
+if __name__ == "__main__":
+    # summary of an existing trace: python Tracing.py trace.jsonl
+    print(format_summary(summarize(read_trace(sys.argv[1]))))
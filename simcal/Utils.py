@@ -1,23 +1,135 @@
+import os
+import re
+from pathlib import Path
 from typing import List
 import numpy as np
 
+# Root for everything persisted between calibration runs (platform builds, results, ...)
+CACHE_ROOT = Path(os.environ.get("MPI_BENCH_CAL_CACHE", Path.home() / ".cache" / "mpi_bench_cal"))
 
-def explained_variance_error(x_simulated: List[float], y_real: List[List[float]]) -> str:
-    overall_loss = 0
+# SimGrid unit suffixes, a number without one is in bytes/s, seconds or flops
+PREFIXES = {"": 1, "k": 1e3, "K": 1e3, "M": 1e6, "G": 1e9, "T": 1e12, "P": 1e15,
+            "Ki": 2**10, "Mi": 2**20, "Gi": 2**30, "Ti": 2**40, "Pi": 2**50}
+BANDWIDTH_UNITS = {**{prefix + "Bps": scale for prefix, scale in PREFIXES.items()},
+                   **{prefix + "bps": scale / 8 for prefix, scale in PREFIXES.items()}}
+LATENCY_UNITS = {"w": 7 * 86400, "d": 86400, "h": 3600, "m": 60, "s": 1, "ms": 1e-3, "us": 1e-6, "ns": 1e-9,
+                 "ps": 1e-12}
+SPEED_UNITS = {prefix + "f": scale for prefix, scale in PREFIXES.items()}
 
-    for i in range(len(y_real)):
-        y_real[i] = np.array(y_real[i])
-        numerator = np.sum(np.sqrt(list(np.power(x_simulated[i] - y_real[i], 2))))
-        denominator = np.sum(np.sqrt(list(np.power(y_real[i] - np.mean(y_real[i]), 2))))
+# separates a piecewise factor from the threshold of one of its segments in calibration keys
+SEGMENT_SEPARATOR = "@"
 
-        if denominator == 0:
-            denominator = 1
 
-        loss = numerator / denominator
+def parse_unit(value, units: dict) -> float:
+    # "16GBps" -> 16e9 with BANDWIDTH_UNITS
+    match = re.fullmatch(r"\s*([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)\s*([A-Za-z]*)\s*", str(value))
+    if match is None or (match.group(2) and match.group(2) not in units):
+        raise ValueError(f"Cannot parse {value!r}, expected a number followed by one of {sorted(units)}")
+    return float(match.group(1)) * units.get(match.group(2), 1)
 
-        overall_loss += loss
 
-    return overall_loss / len(y_real)
+def parse_bandwidth(value) -> float:
+    # bytes per second
+    return parse_unit(value, BANDWIDTH_UNITS)
+
+
+def parse_latency(value) -> float:
+    # seconds
+    return parse_unit(value, LATENCY_UNITS)
+
+
+def parse_speed(value) -> float:
+    # flops
+    return parse_unit(value, SPEED_UNITS)
+
+
+def parse_piecewise(value) -> tuple[np.ndarray, np.ndarray]:
+    # SMPI factor "65472:0.94;15424:0.69;...;0:0.81" -> (thresholds, factors) by increasing threshold
+    pairs = sorted(
+        (float(threshold), float(factor))
+        for threshold, factor in (part.split(":") for part in str(value).strip("\"'").split(";") if part.strip())
+    )
+    return np.array([pair[0] for pair in pairs]), np.array([pair[1] for pair in pairs])
+
+
+def piecewise_factor(piecewise: tuple[np.ndarray, np.ndarray], sizes) -> np.ndarray:
+    # factor of the largest threshold at or below each size
+    thresholds, factors = piecewise
+    index = np.searchsorted(thresholds, np.asarray(sizes, dtype=float), side="right") - 1
+    return factors[np.clip(index, 0, len(factors) - 1)]
+
+
+def format_piecewise(piecewise: tuple[np.ndarray, np.ndarray]) -> str:
+    # inverse of parse_piecewise, by decreasing threshold like SMPI's defaults
+    thresholds, factors = piecewise
+    return ";".join(f"{threshold:g}:{factor:g}" for threshold, factor in sorted(zip(thresholds, factors), reverse=True))
+
+
+def segment_key(name: str, threshold: int) -> str:
+    # calibration key of one segment of a piecewise factor, "network/bandwidth-factor@65472"
+    return f"{name}{SEGMENT_SEPARATOR}{threshold}"
+
+
+def join_segments(calibration: dict) -> dict:
+    # calibration with the segments of each piecewise factor merged into one SMPI value
+    joined, segments = {}, {}
+    for key, value in calibration.items():
+        name, separator, threshold = str(key).partition(SEGMENT_SEPARATOR)
+        if separator:
+            segments.setdefault(name, ([], []))
+            segments[name][0].append(float(threshold))
+            segments[name][1].append(float(value))
+        else:
+            joined[key] = value
+    for name, piecewise in segments.items():
+        joined[name] = format_piecewise(piecewise)
+    return joined
+
+
+class ExplainedVarianceLoss:
+    """explained_variance_error with the ragged ground truth flattened once, scoring one or many result vectors."""
+
+    def __init__(self, y_real: List[List[float]]):
+        lengths = np.array([len(values) for values in y_real])
+        if len(lengths) == 0 or np.any(lengths == 0):
+            raise ValueError("Every ground truth entry needs at least one value")
+
+        self.values = np.concatenate([np.asarray(values, dtype=float) for values in y_real])
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        # position of each flattened value's entry, to broadcast simulated values onto them
+        self.entry = np.repeat(np.arange(len(lengths)), lengths)
+
+        means = np.add.reduceat(self.values, self.offsets) / lengths
+        denominators = np.add.reduceat(np.abs(self.values - means[self.entry]), self.offsets)
+        denominators[denominators == 0] = 1
+        self.denominators = denominators
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def entry_losses(self, x_simulated) -> np.ndarray:
+        # one row per candidate, one column per ground truth entry
+        x_simulated = np.atleast_2d(np.asarray(x_simulated, dtype=float))
+        numerators = np.add.reduceat(np.abs(x_simulated[:, self.entry] - self.values), self.offsets, axis=1)
+        return numerators / self.denominators
+
+    def batch(self, x_simulated) -> np.ndarray:
+        return self.entry_losses(x_simulated).mean(axis=1)
+
+    def lower_bound(self, x_partial) -> float:
+        # NaN marks entries that are not simulated yet, each of them can only add a non-negative loss
+        x_partial = np.asarray(x_partial, dtype=float)
+        known = ~np.isnan(x_partial)
+        losses = self.entry_losses(np.where(known, x_partial, 0))[0]
+        return float(losses[known].sum() / len(self))
+
+    def __call__(self, x_simulated: List[float], y_real: List[List[float]] = None) -> float:
+        # y_real is accepted for compatibility with explained_variance_error and ignored
+        return float(self.batch(x_simulated)[0])
+
+
+def explained_variance_error(x_simulated: List[float], y_real: List[List[float]]) -> float:
+    return ExplainedVarianceLoss(y_real)(x_simulated)
 
 if __name__ == "__main__":
 
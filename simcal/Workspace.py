@@ -0,0 +1,127 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from itertools import count
+from pathlib import Path
+
+DEFAULT_WORKSPACE_ROOT = Path(tempfile.gettempdir()) / "mpi_bench_cal_workspaces"
+
+
+def disk_usage(path: Path) -> int:
+    # bytes actually stored under path, links are not followed
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except FileNotFoundError:
+                continue
+    return total
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkspacePool:
+    """Recycled evaluation directories, so candidates do not each get a fresh one.
+
+    A workspace holds the files of one candidate (configs, platform, simulation outputs).
+    Released workspaces are emptied and handed out again; once the pool holds more than
+    quota_bytes, idle workspaces are deleted instead.
+
+    Each process keeps its workspaces under root/<pid>, directories of processes that no
+    longer exist are removed when a pool is created.
+    """
+
+    def __init__(self, root: Path = DEFAULT_WORKSPACE_ROOT, quota_bytes: int = 5 * 2**30):
+        self.root = Path(root).resolve()
+        self.quota_bytes = quota_bytes
+        self.lock = threading.Lock()
+        self.ids = count()
+        self.idle: list[Path] = []
+        self.busy: set[Path] = set()
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.remove_stale()
+        self.directory = Path(tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=self.root))
+        atexit.register(self.close)
+
+    def __getstate__(self):
+        # a worker process gets a pool of its own, under its own directory
+        return {"root": self.root, "quota_bytes": self.quota_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def remove_stale(self):
+        # left behind by runs that crashed or were killed
+        for directory in self.root.iterdir():
+            pid = directory.name.split("-")[0]
+            if pid.isdigit() and int(pid) != os.getpid() and not process_alive(int(pid)):
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def create(self) -> Path:
+        workspace = self.directory / f"workspace-{next(self.ids)}"
+        workspace.mkdir()
+        return workspace
+
+    def clean(self, workspace: Path):
+        # drop the files of the previous candidate
+        for entry in workspace.iterdir():
+            if entry.is_dir() and not entry.is_symlink():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entry.unlink(missing_ok=True)
+
+    def acquire(self) -> Path:
+        with self.lock:
+            if self.idle:
+                workspace = self.idle.pop()
+            else:
+                workspace = self.create()
+            self.busy.add(workspace)
+        return workspace
+
+    def release(self, workspace: Path):
+        self.clean(workspace)
+        with self.lock:
+            self.busy.discard(workspace)
+            self.idle.append(workspace)
+            self.enforce_quota()
+
+    def enforce_quota(self):
+        # called with self.lock held, only idle workspaces can be deleted
+        usage = disk_usage(self.directory)
+        while usage > self.quota_bytes and self.idle:
+            workspace = self.idle.pop(0)
+            usage -= disk_usage(workspace)
+            shutil.rmtree(workspace, ignore_errors=True)
+        if usage > self.quota_bytes:
+            sys.stderr.write(
+                f"Workspaces use {usage} bytes in {self.directory}, above the {self.quota_bytes} bytes quota\n"
+            )
+
+    @contextmanager
+    def workspace(self):
+        workspace = self.acquire()
+        try:
+            yield workspace
+        finally:
+            self.release(workspace)
+
+    def close(self):
+        with self.lock:
+            self.idle.clear()
+            self.busy.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Stand-in for Summit/summit_generator.py, for benchmarking the calibration pipeline without SimGrid.
+#
+# Usage and API: same as summit_generator.py
+#   fake_summit_generator.py <node_config.json> <topology.json> [--build_dir DIR] [--output FILE]
+#   fake_summit_generator.py --runtime <output.so> [--build_dir DIR]
+#
+# Tuned through the environment:
+#   FAKE_GENERATOR_LATENCY  seconds per build, split over the g++ steps (default 0.2)
+#   FAKE_GENERATOR_FAILURE_RATE  probability of a build failing (default 0)
+#
+# A compiled "platform" is the JSON of its configuration, which fake_wrapper_parallel.py
+# reads back; the runtime one is an empty file. summit_base is "compiled" once per build
+# directory, like the real generator reuses its object.
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+
+class BuildError(Exception):
+    """A compilation or link step failed, with the compiler output."""
+
+    def __init__(self, step, output):
+        super().__init__(step + " failed\n" + output)
+        self.step = step
+        self.output = output
+
+
+def step(name, seconds, timings):
+    start = time.perf_counter()
+    time.sleep(seconds)
+    timings.append((name, time.perf_counter() - start))
+
+
+def build(build_dir, steps, timings):
+    latency = float(os.environ.get("FAKE_GENERATOR_LATENCY", 0.2))
+    base = Path(build_dir) / "summit_base-fake.o"
+    for name in steps:
+        if name == "g++:summit_base.cpp" and base.exists():
+            timings.append((name + ":cached", 0.0))
+            continue
+        step(name, latency / 3, timings)
+        if random.random() < float(os.environ.get("FAKE_GENERATOR_FAILURE_RATE", 0)):
+            raise BuildError(name, "fake failure\n")
+    base.touch()
+
+
+def write_atomically(output, content):
+    output = Path(output)
+    tmp_file = output.with_name(f".{output.name}.{os.getpid()}")
+    tmp_file.write_text(content)
+    os.replace(tmp_file, output)
+
+
+def build_platform(node, topo, build_dir, output=None, jobs=None):
+    build_dir = Path(build_dir)
+    build_dir.mkdir(parents=True, exist_ok=True)
+    output = Path(output) if output is not None else build_dir / (topo["name"] + ".so")
+    timings = []
+    build(build_dir, ["g++:summit_base.cpp", "g++:platform.cpp", "g++:link"], timings)
+    write_atomically(output, json.dumps({"node": node, "topology": topo}))
+    return output, timings
+
+
+def build_runtime(build_dir, output, jobs=None):
+    Path(build_dir).mkdir(parents=True, exist_ok=True)
+    timings = []
+    build(build_dir, ["g++:summit_base.cpp", "g++:summit_runtime.cpp", "g++:link"], timings)
+    write_atomically(output, "")
+    return Path(output), timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("node_config", nargs="?")
+    parser.add_argument("topology", nargs="?")
+    parser.add_argument("--runtime", type=str, default=None)
+    parser.add_argument("--build_dir", type=str, default=".")
+    parser.add_argument("--output", type=str, default=None)
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    try:
+        if args.runtime is not None:
+            _, timings = build_runtime(args.build_dir, args.runtime)
+        else:
+            with open(args.node_config) as f:
+                node = json.load(f)
+            with open(args.topology) as f:
+                topology = json.load(f)
+            _, timings = build_platform(node, topology, args.build_dir, args.output)
+    except BuildError as error:
+        sys.stderr.write(str(error) + "\n")
+        sys.exit(1)
+
+    for name, seconds in timings:
+        print(name + ": " + "%.3f" % seconds + "s")
+
+
+if __name__ == "__main__":
+    main()
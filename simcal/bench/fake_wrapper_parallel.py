@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Stand-in for wrapper_parallel, for benchmarking the calibration pipeline without SimGrid.
+#
+# Usage: same as wrapper_parallel
+#   fake_wrapper_parallel.py <platform.so> <hostfile> <executable> <benchmark,...> <threshold> <iterations> <bytes,...> [smpirun args]
+#
+# Tuned through the environment:
+#   FAKE_WRAPPER_LATENCY       seconds per run (default 0.05)
+#   FAKE_WRAPPER_SIZE_LATENCY  extra seconds per byte size (default 0.005)
+#   FAKE_WRAPPER_PROTOCOL      "records" to write MPI_BENCH_RESULT_FILE, "legacy" for stdout only (default records)
+#   FAKE_WRAPPER_FAILURE_RATE  probability of a run printing nothing (default 0)
+#   FAKE_WRAPPER_STDERR        bytes written to stderr, like smpirun warnings (default 0)
+#   FAKE_WRAPPER_NOISE         relative standard deviation of one repetition (default 0.1)
+#   FAKE_WRAPPER_REPETITION_LATENCY  seconds per repetition of a 1 MiB message, the
+#                              repetitions running until the relstderr target (default 0)
+#
+# Values follow a latency/bandwidth model of the platform parameters, read from the
+# summit_platform.cfg next to a runtime platform or from the JSON the fake generator
+# writes in place of a compiled one, and of the network/bandwidth-factor and
+# network/latency-factor --cfg options, so the loss does depend on the calibration.
+# Repetitions follow the relstderr targets of MPI_BENCH_TARGET_FILE, or the threshold.
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+# ResultStream.py, next to bench/, which only needs the standard library
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from ResultStream import MEGABYTE
+
+
+def number(value, default):
+    match = re.match(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?", str(value))
+    return float(match.group()) if match else default
+
+
+def platform_parameters(platform_file: Path) -> dict:
+    config = platform_file.parent / "summit_platform.cfg"
+    if config.exists():
+        parameters = {}
+        for line in config.read_text().splitlines():
+            if "=" in line:
+                key, value = line.split("=", 1)
+                parameters[key.strip()] = value.strip()
+        return parameters
+    try:
+        built = json.loads(platform_file.read_text())
+        return {**built["node"], **built["topology"]}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def smpi_factor(args: list, name: str, byte_size: int) -> float:
+    # factor of the largest threshold at or below byte_size in --cfg=<name>:<threshold>:<factor>;...
+    prefix = f"--cfg={name}:"
+    for arg in args:
+        if arg.startswith(prefix):
+            segments = sorted(
+                (float(threshold), float(factor))
+                for threshold, factor in (part.split(":") for part in arg[len(prefix):].split(";") if part)
+            )
+            return next((factor for threshold, factor in reversed(segments) if threshold <= byte_size), 1.0)
+    return 1.0
+
+
+def relstderr_targets() -> dict:
+    target_file = os.environ.get("MPI_BENCH_TARGET_FILE")
+    if not target_file:
+        return {}
+    targets = {}
+    for line in Path(target_file).read_text().splitlines():
+        if line.strip():
+            target = json.loads(line)
+            targets[(target["benchmark"], target["bytes"])] = target["relstderr"]
+    return targets
+
+
+def repetitions(noise: float, target: float, iterations: int) -> int:
+    # at least 10, then until noise / sqrt(repetitions) is below the target
+    if target <= 0:
+        return iterations
+    return min(max(math.ceil((noise / target) ** 2) + 1, 10), iterations)
+
+
+def main():
+    platform_file = Path(sys.argv[1])
+    benchmarks = sys.argv[4].split(",")
+    threshold = float(sys.argv[5])
+    iterations = int(sys.argv[6])
+    byte_sizes = [int(size) for size in sys.argv[7].split(",")]
+
+    latency = float(os.environ.get("FAKE_WRAPPER_LATENCY", 0.05))
+    size_latency = float(os.environ.get("FAKE_WRAPPER_SIZE_LATENCY", 0.005))
+    protocol = os.environ.get("FAKE_WRAPPER_PROTOCOL", "records")
+    failure_rate = float(os.environ.get("FAKE_WRAPPER_FAILURE_RATE", 0))
+    noise = int(os.environ.get("FAKE_WRAPPER_STDERR", 0))
+    repetition_noise = float(os.environ.get("FAKE_WRAPPER_NOISE", 0.1))
+    repetition_latency = float(os.environ.get("FAKE_WRAPPER_REPETITION_LATENCY", 0))
+    targets = relstderr_targets()
+
+    parameters = platform_parameters(platform_file)
+    link_bandwidth = number(parameters.get("bandwidth"), 25e9)
+    link_latency = number(parameters.get("latency"), 1e-9) + 1e-9 * number(parameters.get("pcie_lat"), 10)
+
+    if noise:
+        sys.stderr.write("x" * noise + "\n")
+
+    time.sleep(latency)
+    if random.random() < failure_rate:
+        return
+
+    result_file = os.environ.get("MPI_BENCH_RESULT_FILE") if protocol == "records" else None
+    values = []
+    for benchmark, byte_size in [(benchmark, byte_size) for benchmark in benchmarks for byte_size in byte_sizes]:
+        start = time.perf_counter()
+        count = repetitions(repetition_noise, targets.get((benchmark, byte_size), threshold), iterations)
+        time.sleep(size_latency + repetition_latency * count * (1 + byte_size / 2**20))
+        # both directions share the links when both ranks send
+        bandwidth = link_bandwidth if benchmark == "PingPong" else link_bandwidth / 2
+        t_avg = (
+            smpi_factor(sys.argv[8:], "network/latency-factor", byte_size) * link_latency
+            + byte_size / (smpi_factor(sys.argv[8:], "network/bandwidth-factor", byte_size) * bandwidth)
+        )
+        value = byte_size / t_avg / MEGABYTE
+        values.append(value)
+        if result_file:
+            with open(result_file, "a") as f:
+                f.write(json.dumps({
+                    "benchmark": benchmark,
+                    "bytes": byte_size,
+                    "mbytes_per_sec": value,
+                    "repetitions": count,
+                    "relstderr": repetition_noise / math.sqrt(count),
+                    "t_avg": t_avg * 1e6,
+                    "wall_time": time.perf_counter() - start,
+                }) + "\n")
+
+    print(" ".join(str(value) for value in values))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from time import perf_counter
+
+from GroundTruth import MPIGroundTruth
+from PlatformCache import PlatformCache
+from ResultStore import ResultStore
+from SMPISimulator import SMPISimulator, Caches, Admission, Recording, PlatformBuild
+from SMPISimulatorCalibrator import SMPISimulatorCalibrator
+from Tracing import Tracer
+from Workspace import WorkspacePool
+from run_smpi_calibrator import build_ground_truth
+
+BENCH_DIR = Path(__file__).parent.resolve() / "bench"
+SUMMIT_CONFIG = Path(__file__).parent.resolve() / "Summit/config"
+
+BENCHMARKS = ["Birandom", "PingPing", "PingPong"]
+
+
+def link_executable(source: Path, destination: Path):
+    source.chmod(source.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    destination.symlink_to(source)
+
+
+def fake_installation(work_dir: Path):
+    # bin/ with the fake wrapper_parallel, Summit/ with the fake generator and the real configs
+    bin_dir = work_dir / "bin"
+    bin_dir.mkdir()
+    link_executable(BENCH_DIR / "fake_wrapper_parallel.py", bin_dir / "wrapper_parallel")
+    (bin_dir / "IMB-P2P").write_bytes(b"")
+
+    summit_dir = work_dir / "Summit"
+    (summit_dir / "src").mkdir(parents=True)
+    (summit_dir / "config").symlink_to(SUMMIT_CONFIG)
+    shutil.copy(BENCH_DIR / "fake_summit_generator.py", summit_dir / "summit_generator.py")
+    return bin_dir, summit_dir
+
+
+def fake_ground_truth(filename: Path, scenario_count: int, byte_sizes: list, samples: int = 3, seed: int = 0):
+    # scenario_count scenarios at 128 nodes, one process count per group of benchmarks
+    rng = np.random.default_rng(seed)
+    rows = []
+    for scenario in range(scenario_count):
+        benchmark = BENCHMARKS[scenario % len(BENCHMARKS)]
+        processes = 2 ** (scenario // len(BENCHMARKS) + 1)
+        for byte_size in byte_sizes:
+            for _ in range(samples):
+                rows.append({
+                    "benchmark_parent": "P2P",
+                    "benchmark": benchmark,
+                    "node_count": 128,
+                    "processes": processes,
+                    "bytes": byte_size,
+                    "repetitions": 1000,
+                    "Mbytes/sec": byte_size / (2e-6 + byte_size / 12.5e9) / 1e6 * rng.uniform(0.9, 1.1),
+                    "t_avg[usec]": np.nan,
+                    "remark": np.nan,
+                })
+    pd.DataFrame(rows).to_csv(filename, index=False)
+
+
+def run_case(args, pool_size: int, scenario_count: int) -> dict:
+    work_dir = Path(tempfile.mkdtemp(prefix="mpi_bench_cal_benchmark-"))
+    try:
+        bin_dir, summit_dir = fake_installation(work_dir)
+
+        csv_file = work_dir / "ground_truth.csv"
+        fake_ground_truth(csv_file, scenario_count, args.byte_sizes)
+
+        start = perf_counter()
+        ground_truth = MPIGroundTruth(csv_file, cache_dir=work_dir / "ground_truth_cache")
+        load_cold = perf_counter() - start
+        start = perf_counter()
+        ground_truth = MPIGroundTruth(csv_file, cache_dir=work_dir / "ground_truth_cache")
+        ground_truth.set_benchmark_parent("P2P")
+        ground_truth_data = build_ground_truth(ground_truth, args.byte_sizes)
+        load_warm = perf_counter() - start
+
+        tracer = Tracer(work_dir / "trace.jsonl")
+        simulator = SMPISimulator(
+            ground_truth_data, "IMB-P2P", work_dir / "hostfile.txt", 0.05, 24,
+            batch_benchmarks=args.batched,
+            adaptive_repetitions=args.adaptive_repetitions,
+            caches=Caches(ResultStore(work_dir / "results.sqlite"), PlatformCache(work_dir / "platforms")),
+            admission=Admission(workspaces=WorkspacePool(root=work_dir / "workspaces")),
+            recording=Recording(tracer=tracer, log_dir=work_dir / "logs"),
+            platform_build=PlatformBuild(
+                mpi_exec=bin_dir,
+                summit_dir=summit_dir,
+                runtime_platform=args.platform == "runtime",
+                build_dir=work_dir / "build",
+                hostspeed=1e9,
+            ),
+        )
+
+        start = perf_counter()
+        SMPISimulatorCalibrator(args.algorithm, simulator).compute_calibration(args.time_limit, pool_size, args.coordinator)
+        wall_time = perf_counter() - start
+
+        summary = tracer.summary()
+        evaluations = max(summary["evaluations"], 1)
+        phases = {phase: seconds / evaluations for phase, seconds in summary["phase_seconds"].items()}
+        # what the framework itself adds to an evaluation, besides building and simulating
+        overhead = phases.get("evaluation", 0.0) - phases.get("simulations", 0.0) - phases.get("generator", 0.0)
+
+        return {
+            "case": f"{args.platform}{' batched' if args.batched else ''}{' adaptive' if args.adaptive_repetitions else ''}{' ' + args.coordinator if args.coordinator != 'thread' else ''} pool={pool_size} scenarios={scenario_count}",
+            "pool_size": pool_size,
+            "scenarios": len(ground_truth_data[0]),
+            "evaluations": summary["evaluations"],
+            "evaluations_per_second": summary["evaluations"] / wall_time,
+            "mean_evaluation_seconds": summary["mean_evaluation_seconds"],
+            "overhead_seconds": overhead,
+            "phase_seconds_per_evaluation": phases,
+            "ground_truth_cold_seconds": load_cold,
+            "ground_truth_warm_seconds": load_warm,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    # slower throughput or more overhead than the baseline by more than tolerance
+    regressions = []
+    previous = {result["case"]: result for result in baseline["results"]}
+    for result in results:
+        old = previous.get(result["case"])
+        if old is None:
+            continue
+        if result["evaluations_per_second"] < old["evaluations_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{result['case']}: {result['evaluations_per_second']:.3f} evaluations/s, "
+                f"was {old['evaluations_per_second']:.3f}"
+            )
+        if result["overhead_seconds"] > old["overhead_seconds"] * (1 + tolerance) + 1e-3:
+            regressions.append(
+                f"{result['case']}: {1e3 * result['overhead_seconds']:.1f}ms overhead per evaluation, "
+                f"was {1e3 * old['overhead_seconds']:.1f}ms"
+            )
+    return regressions
+
+
+def print_results(results: list[dict]):
+    print(f"{'case':<36}{'evals':>7}{'evals/s':>10}{'eval (s)':>10}{'overhead (ms)':>15}{'gt cold/warm (ms)':>20}")
+    for result in results:
+        print(
+            f"{result['case']:<36}{result['evaluations']:>7}{result['evaluations_per_second']:>10.3f}"
+            f"{result['mean_evaluation_seconds']:>10.3f}{1e3 * result['overhead_seconds']:>15.1f}"
+            f"{1e3 * result['ground_truth_cold_seconds']:>11.1f}/{1e3 * result['ground_truth_warm_seconds']:.1f}"
+        )
+    print("\nSeconds per evaluation by phase:")
+    for result in results:
+        phases = ", ".join(
+            f"{phase} {seconds:.3f}"
+            for phase, seconds in sorted(result["phase_seconds_per_evaluation"].items(), key=lambda item: -item[1])
+        )
+        print(f"  {result['case']}: {phases}")
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent)
+        return out.stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the calibration pipeline against a fake SimGrid")
+
+    parser.add_argument("--pool_sizes", type=lambda s: [int(item) for item in s.split(",")], default=[1, 4], help="Calibrator pool sizes to measure (Default: 1,4)")
+    parser.add_argument("--scenario_counts", type=lambda s: [int(item) for item in s.split(",")], default=[3, 12], help="Scenario counts to measure (Default: 3,12)")
+    parser.add_argument("--byte_sizes", type=lambda s: [int(item) for item in s.split(",")], default=[0, 1024, 65536, 4194304], help="Byte sizes of every scenario (Default: 0,1024,65536,4194304)")
+    parser.add_argument("-a", "--algorithm", type=str, default="random", help="Calibration algorithm driven by the benchmark (Default: random)")
+    parser.add_argument("-t", "--time_limit", type=float, default=20, help="Seconds of calibration per case (Default: 20)")
+    parser.add_argument("--platform", choices=["runtime", "compiled"], default="runtime", help="Platform mode of the simulator (Default: runtime)")
+    parser.add_argument("--batched", action="store_true", help="One simulation per executable, node count and process count")
+    parser.add_argument("--adaptive_repetitions", action="store_true", help="Relative standard error targets derived from the ground truth")
+    parser.add_argument("--coordinator", choices=["thread", "process"], default="thread", help="Run the evaluations in threads or in worker processes (Default: thread)")
+    parser.add_argument("--save", type=str, default=None, help="Write the results to this JSON file")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline JSON file written by --save, exits with 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative slowdown tolerated by --compare (Default: 0.1)")
+
+    args = parser.parse_args()
+
+    # the fake tools are tuned through FAKE_* variables, see bench/
+    results = []
+    for scenario_count in args.scenario_counts:
+        for pool_size in args.pool_sizes:
+            results.append(run_case(args, pool_size, scenario_count))
+
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "host": platform.node(),
+                "cpu_count": os.cpu_count(),
+                "arguments": vars(args),
+                "results": results,
+            }, f, indent=4)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {baseline.get('commit', args.compare)[:12]}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regression against {baseline.get('commit', args.compare)[:12]}")
+
+
+if __name__ == "__main__":
+    main()
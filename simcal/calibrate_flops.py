@@ -3,6 +3,19 @@ import sys
 import os
 import subprocess
 import math
+import json
+import hashlib
+import platform
+import tempfile
+from time import time
+
+from Utils import CACHE_ROOT
+
+SIZE = 2000
+COMPILER_FLAGS = ["-Ofast", "-DSIZE=" + str(SIZE)]
+
+HOSTSPEED_CACHE = CACHE_ROOT / "hostspeed.json"
+HOSTSPEED_TTL = 7 * 24 * 3600
 
 
 ###########################################
@@ -86,79 +99,138 @@ int main(int argc, char *argv[])
   return 0;
 }
 """
-def calibrate_hostspeed():
-    SIZE=2000
-    
-    callibrating_code_filename = "/tmp/callibrating_code.c"
-    fh = open(callibrating_code_filename, 'w')
-    fh.write(callibrating_C_code)
-    fh.close()
-    error_code = os.system("smpicc -Ofast "+"-DSIZE="+str(SIZE)+" "+callibrating_code_filename+" -o /tmp/callibration_code")
-    if (error_code != 0):
-    	sys.stderr.write("Can't compile '"+callibrating_code_filename+"'... aborting\n")
-    	exit(1)
-    sys.stderr.write("Callibrating code compiled\n")
-    
-    
-    ###########################################
-    # Create XML platform file (one host)
-    ###########################################
-    platform_filename = "/tmp/platform_one_host.xml"
-    fh = open(platform_filename, 'w')
-    fh.write("<?xml version='1.0'?>\n<!DOCTYPE platform SYSTEM \"http://simgrid.gforge.inria.fr/simgrid/simgrid.dtd\">\n<platform version=\"4.1\">\n<AS id=\"AS0\" routing=\"Full\">\n")
-    fh.write("  <host id=\"host-0\" speed=\"200Gf\"/>\n")
-    fh.write("</AS>\n</platform>\n")
-    fh.close()
-    sys.stderr.write("One-host XML platform file generated\n")
-    
-    ###########################################
-    # Create host file (one host)
-    ###########################################
-    hostfile_filename = "/tmp/hostfile_one_host"
-    fh = open(hostfile_filename, 'w')
-    fh.write("host-0\n")
-    fh.close()
-    sys.stderr.write("One-host hostfile generated\n")
-    
-    ###########################################
-    # Binary search to find the running power
-    ###########################################
-    
-    sys.stderr.write("Initiating binary search...\n")
-    
-    # Coarse approximation of the traget simulated time
-    desired_simulated_gflops_rate=200.0
-    number_gflop = (3.0 * SIZE * SIZE * SIZE + SIZE * SIZE) / (1000000000.0)
-    target = number_gflop / desired_simulated_gflops_rate
-    
-    # Initial bounds for the binary search
-    low = 0
-    high = 62500000000.0
-    
-    while (True):
-    
-    	attempt =  (low + high) / 2
-    
-    	# Run the code
-    	FNULL = open(os.devnull, 'w')
-    	output = subprocess.check_output(["smpirun","--cfg=smpi/host-speed:"+str(attempt)+"f","-platform",platform_filename,"-hostfile",hostfile_filename,"-np","1","/tmp/callibration_code"],stderr = FNULL, encoding='UTF-8')
-    	FNULL.close()
-    
-    	# Get the wall-clock time
-    	simulated_wallclock = float(output.split('\t')[0])
-    
-    	sys.stderr.write("candidate value: "+str(("%.3f" % attempt))+"\t-->  wallclock = "+str(("%.3f" % simulated_wallclock))+" (target ="+str(("%.3f" % target))+")\n")
-    
-    	if (simulated_wallclock < target):
-    		low = attempt
-    	else:
-    		high = attempt
-    	
-    
-    	if ((abs(simulated_wallclock - target) < 0.001) or (abs(high - low) < 100)):
-    		break
-    
-    return attempt
+def host_fingerprint():
+    # the calibrated speed is only valid for this CPU, this SimGrid and these compiler flags
+    cpu_model = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+
+    try:
+        simgrid_version = subprocess.run(["smpirun", "-version"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        simgrid_version = ""
+
+    return {
+        "host": platform.node(),
+        "cpu": cpu_model,
+        "simgrid": simgrid_version,
+        "flags": " ".join(COMPILER_FLAGS),
+    }
+
+
+def search_hostspeed(initial_guess=1e9, tolerance=0.01, max_runs=10):
+    # (host speed, whether its wallclock came within tolerance of the target, relatively)
+    # per-process scratch directory so parallel calibrators do not clobber each other
+    with tempfile.TemporaryDirectory(prefix="callibration-") as tmp_dir:
+        callibrating_code_filename = os.path.join(tmp_dir, "callibrating_code.c")
+        callibration_code = os.path.join(tmp_dir, "callibration_code")
+        with open(callibrating_code_filename, 'w') as fh:
+            fh.write(callibrating_C_code)
+        error_code = subprocess.run(["smpicc"] + COMPILER_FLAGS + [callibrating_code_filename, "-o", callibration_code]).returncode
+        if (error_code != 0):
+            sys.stderr.write("Can't compile '"+callibrating_code_filename+"'... aborting\n")
+            exit(1)
+        sys.stderr.write("Callibrating code compiled\n")
+
+
+        ###########################################
+        # Create XML platform file (one host)
+        ###########################################
+        platform_filename = os.path.join(tmp_dir, "platform_one_host.xml")
+        with open(platform_filename, 'w') as fh:
+            fh.write("<?xml version='1.0'?>\n<!DOCTYPE platform SYSTEM \"http://simgrid.gforge.inria.fr/simgrid/simgrid.dtd\">\n<platform version=\"4.1\">\n<AS id=\"AS0\" routing=\"Full\">\n")
+            fh.write("  <host id=\"host-0\" speed=\"200Gf\"/>\n")
+            fh.write("</AS>\n</platform>\n")
+        sys.stderr.write("One-host XML platform file generated\n")
+
+        ###########################################
+        # Create host file (one host)
+        ###########################################
+        hostfile_filename = os.path.join(tmp_dir, "hostfile_one_host")
+        with open(hostfile_filename, 'w') as fh:
+            fh.write("host-0\n")
+        sys.stderr.write("One-host hostfile generated\n")
+
+        ###########################################
+        # Fixed-point search on the running power
+        ###########################################
+
+        sys.stderr.write("Initiating search...\n")
+
+        # Coarse approximation of the traget simulated time
+        desired_simulated_gflops_rate=200.0
+        number_gflop = (3.0 * SIZE * SIZE * SIZE + SIZE * SIZE) / (1000000000.0)
+        target = number_gflop / desired_simulated_gflops_rate
+
+        # SMPI times the benchmark on the real host and scales it by host-speed / platform
+        # speed, so the simulated wallclock is close to proportional to the host speed and
+        # rescaling the attempt by target / wallclock lands next to the answer after one
+        # or two runs instead of a full bisection.
+        attempt = initial_guess
+        best, best_error = None, float("inf")
+
+        for _ in range(max_runs):
+
+            # Run the code
+            output = subprocess.check_output(["smpirun","--cfg=smpi/host-speed:"+str(attempt)+"f","-platform",platform_filename,"-hostfile",hostfile_filename,"-np","1",callibration_code],stderr = subprocess.DEVNULL, encoding='UTF-8')
+
+            # Get the wall-clock time
+            simulated_wallclock = float(output.split('\t')[0])
+
+            sys.stderr.write("candidate value: "+str(("%.3f" % attempt))+"\t-->  wallclock = "+str(("%.3f" % simulated_wallclock))+" (target ="+str(("%.3f" % target))+")\n")
+
+            if simulated_wallclock <= 0:
+                raise RuntimeError(f"Host speed calibration measured a wallclock of {simulated_wallclock} at {attempt}f")
+            error = abs(simulated_wallclock / target - 1)
+            if error < best_error:
+                best, best_error = attempt, error
+            if error < tolerance:
+                return attempt, True
+
+            attempt *= target / simulated_wallclock
+
+    # timing noise on a loaded host, the closest attempt is still usable
+    sys.stderr.write(f"Host speed calibration did not converge within {max_runs} runs, using {best}f "
+                     f"({100 * best_error:.1f}% off the target)\n")
+    return best, False
+
+
+def calibrate_hostspeed(cache_file=HOSTSPEED_CACHE, ttl=HOSTSPEED_TTL):
+    fingerprint = host_fingerprint()
+    key = hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+
+    entry = cache.get(key)
+    if entry is not None and time() - entry["time"] < ttl:
+        sys.stderr.write(f"Using cached host speed {entry['hostspeed']:.3f} from {cache_file}\n")
+        return entry["hostspeed"]
+
+    # an expired value is still the best starting point for the search
+    hostspeed, converged = search_hostspeed(entry["hostspeed"] if entry is not None else 1e9)
+
+    # an unconverged value is only used by this run
+    if cache_file is not None and converged:
+        cache[key] = {"hostspeed": hostspeed, "time": time(), "fingerprint": fingerprint}
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f, indent=4)
+        os.replace(tmp_name, cache_file)
+
+    return hostspeed
 
 if __name__ == "__main__":
     result = calibrate_hostspeed()
@@ -1,43 +1,36 @@
 import argparse
+import os
+import sys
+import numpy as np
 import pandas as pd
 import pytimeparse
+from time import time
 
 from GroundTruth import MPIGroundTruth
-from SMPISimulator import SMPISimulator
+from SMPISimulator import SMPISimulator, BENCHMARK_EXECUTABLES, Admission, Recording
 from SMPISimulatorCalibrator import SMPISimulatorCalibrator
+from Journal import Journal
+from Tracing import Tracer, format_summary
+from AnalyticalSimulator import AnalyticalSimulator
+from Scheduler import AdmissionScheduler
+from Coordinators import AUTHKEY_ENV
 
-def main():    
-    # Create the parser
-    parser = argparse.ArgumentParser(description="Example script using argparse")
-
-    # Add arguments
-    # byte_sizes is a list of integers separated by commas
-    parser.add_argument("byte_sizes", type=lambda s: [int(item) for item in s.split(",")], help="List of byte sizes to calibrate")  # Required
-    parser.add_argument("--verbose", action="store_true", help="Enable verbose mode")  # Optional flag
-    parser.add_argument("-a", "--algorithm", type=str, default="random", help="Algorithms to use for calibration (Default: random)")  # Optional argument
-    parser.add_argument("-t", "--time_limit", type=str, default="3h", help="Time limit for calibration (Default: 3h)")  # Optional argument
-
-    # Parse the arguments
-    args = parser.parse_args()
-
-    time_limit =  pytimeparse.parse(args.time_limit)
-
-    summit_df = MPIGroundTruth("../imb-summit.csv") #NOTE: change
-
-    summit_df.set_benchmark_parent("P2P")
-
+DEFAULT_BENCHMARKS = ["PingPing", "PingPong", "Birandom"]
 
+def build_ground_truth(summit_df: MPIGroundTruth, byte_sizes, node_count=128, benchmarks=DEFAULT_BENCHMARKS):
     # TODO: clean up data filtering
 
     filtered_df = summit_df.get_ground_truth(
-        node_count=128,
+        node_count=node_count,
         metrics=[
+            "benchmark_parent",
             "benchmark",
             "node_count",
             "processes",
             "repetitions",
             "bytes",
             "Mbytes/sec",
+            "t_avg[usec]",
             "remark",
         ]
     )
@@ -45,15 +38,21 @@ def main():
     # remove rows where remark isn't NaN
     filtered_df = filtered_df[pd.isnull(filtered_df["remark"])].reset_index(drop=True)
 
-    filtered_df = filtered_df[filtered_df["benchmark"].isin(["PingPing", "PingPong", "Birandom"])]
+    filtered_df = filtered_df[filtered_df["benchmark"].isin(benchmarks)]
 
     # filter by byte sizes
-    filtered_df = filtered_df[filtered_df["bytes"].isin(args.byte_sizes)]
+    filtered_df = filtered_df[filtered_df["bytes"].isin(byte_sizes)].copy()
 
-    scenario_df = filtered_df[["benchmark", "node_count", "processes", "bytes"]].drop_duplicates().reset_index(drop=True)
-    scenario_df = scenario_df.sort_values(by=["benchmark", "node_count", "processes", "bytes"]).reset_index(drop=True)
+    # throughput where the benchmark reports one, the average time otherwise (collectives, NBC)
+    has_bandwidth = filtered_df.groupby(["benchmark_parent", "benchmark"])["Mbytes/sec"].transform(lambda values: values.notna().any())
+    filtered_df["metric"] = np.where(has_bandwidth, "mbytes_per_sec", "t_avg")
+    filtered_df["value"] = np.where(has_bandwidth, filtered_df["Mbytes/sec"], filtered_df["t_avg[usec]"])
+
+    scenario_columns = ["benchmark_parent", "benchmark", "node_count", "processes"]
+    scenario_df = filtered_df[scenario_columns + ["metric", "bytes"]].drop_duplicates().reset_index(drop=True)
+    scenario_df = scenario_df.sort_values(by=scenario_columns + ["bytes"]).reset_index(drop=True)
     scenario_df["bytes"] = scenario_df["bytes"].astype(int)
-    scenario_df = scenario_df.groupby(['benchmark', 'node_count', 'processes'])['bytes'].agg(list).reset_index()
+    scenario_df = scenario_df.groupby(scenario_columns + ["metric"])['bytes'].agg(list).reset_index()
 
     # check for stencil benchmarks
     is_stencil = scenario_df["benchmark"].str.contains("Stencil")
@@ -63,41 +62,139 @@ def main():
     # get validation set of ground truth data that only contains stencil benchmarks
     validation_df = scenario_df[is_stencil].reset_index(drop=True)
 
-    data_df = filtered_df[["benchmark", "node_count", "processes", "bytes", "Mbytes/sec"]].sort_values(by=["benchmark", "node_count", "processes", "bytes"]).reset_index(drop=True)
-    data_df = data_df.groupby(['benchmark', 'node_count', 'processes', 'bytes'])['Mbytes/sec'].agg(list).reset_index()
+    data_df = filtered_df[scenario_columns + ["bytes", "value"]].sort_values(by=scenario_columns + ["bytes"]).reset_index(drop=True)
+    data_df = data_df.groupby(scenario_columns + ['bytes'])['value'].agg(list).reset_index()
 
     
     is_stencil = data_df["benchmark"].str.contains("Stencil")
     test_data_df = data_df[~is_stencil].reset_index(drop=True)
     validation_data_df = data_df[is_stencil].reset_index(drop=True)
 
-    assert scenario_df["bytes"].apply(len).sum() == len(data_df["Mbytes/sec"])
-    assert test_df["bytes"].apply(len).sum() == len(test_data_df["Mbytes/sec"])
-    assert validation_df["bytes"].apply(len).sum() == len(validation_data_df["Mbytes/sec"])
+    assert scenario_df["bytes"].apply(len).sum() == len(data_df["value"])
+    assert test_df["bytes"].apply(len).sum() == len(test_data_df["value"])
+    assert validation_df["bytes"].apply(len).sum() == len(validation_data_df["value"])
 
 
 
     known_points = []
     for _, row in test_df.iterrows():
-        known_points.append((row['benchmark'], row['node_count'], row['processes'], row['bytes']))
+        known_points.append((
+            row['benchmark'], row['node_count'], row['processes'], row['bytes'],
+            BENCHMARK_EXECUTABLES[row['benchmark_parent']], row['metric'],
+        ))
 
-    data = list(test_data_df["Mbytes/sec"])
+    data = list(test_data_df["value"])
 
     ground_truth_data = (known_points, data)
-    
+
+    return ground_truth_data
+
+def main():    
+    # Create the parser
+    parser = argparse.ArgumentParser(description="Example script using argparse")
+
+    # Add arguments
+    # byte_sizes is a list of integers separated by commas
+    parser.add_argument("byte_sizes", type=lambda s: [int(item) for item in s.split(",")], help="List of byte sizes to calibrate")  # Required
+    parser.add_argument("--verbose", action="store_true", help="Enable verbose mode")  # Optional flag
+    parser.add_argument("-a", "--algorithm", type=str, default="random", help="Algorithms to use for calibration: grid, random, gradient, bayesopt, hyperband or hierarchical (Default: random)")  # Optional argument
+    parser.add_argument("-t", "--time_limit", type=str, default="3h", help="Time limit for calibration (Default: 3h)")  # Optional argument
+    parser.add_argument("--fidelity_levels", type=int, default=3, help="Number of fidelity levels used by hyperband, including the full one (Default: 3)")  # Optional argument
+    parser.add_argument("--fidelity_node_count", type=int, default=None, help="Node count of the scenarios used by the lowest fidelity level (Default: same as full)")  # Optional argument
+    parser.add_argument("--journal", type=str, default="calibration_journal.jsonl", help="Journal of evaluated calibrations (Default: calibration_journal.jsonl)")  # Optional argument
+    parser.add_argument("--resume", action="store_true", help="Resume the campaign recorded in the journal within its remaining time")  # Optional flag
+    parser.add_argument("--trace", type=str, default="calibration_trace.jsonl", help="Per-phase timing trace of every evaluation, CSV if it ends in .csv (Default: calibration_trace.jsonl)")  # Optional argument
+    parser.add_argument("--prometheus", type=str, default=None, help="Prometheus textfile updated with throughput metrics after every evaluation")  # Optional argument
+    parser.add_argument("--analytical", choices=["off", "warm_start", "prescreen"], default="off", help="Use the analytical model to warm start the search or to skip unpromising candidates (Default: off)")  # Optional argument
+    parser.add_argument("--benchmark_parent", type=str, default="P2P", help="benchmark_parent of the ground truth to calibrate on, P2P, 1, NBC, RMA or all (Default: P2P)")  # Optional argument
+    parser.add_argument("--benchmarks", type=lambda s: s.split(","), default=DEFAULT_BENCHMARKS, help="Benchmarks to calibrate on (Default: PingPing,PingPong,Birandom)")  # Optional argument
+    parser.add_argument("--batched", action="store_true", help="Run all the benchmarks of an executable, node count and process count in one simulation")  # Optional flag
+    parser.add_argument("-j", "--workers", type=int, default=1, help="Number of evaluations run at once (Default: 1)")  # Optional argument
+    parser.add_argument("--coordinator", choices=["thread", "process", "remote"], default="thread", help="Run evaluations in threads, in worker processes or on the --remote_workers servers (Default: thread)")  # Optional argument
+    parser.add_argument("--remote_workers", type=lambda s: s.split(","), default=None, help="host:port of the servers started with Coordinators.py, for --coordinator remote")  # Optional argument
+    parser.add_argument("--memory_gb", type=float, default=None, help="Memory the concurrent simulations may use, in GiB (Default: 80%% of the available memory)")  # Optional argument
+    parser.add_argument("--rlimit_as_factor", type=float, default=None, help="Limit the address space of a simulation to this factor of its estimated memory (Default: no limit)")  # Optional argument
+    parser.add_argument("--rlimit_cpu", type=int, default=None, help="CPU seconds a simulation may use (Default: no limit)")  # Optional argument
+    parser.add_argument("--adaptive_repetitions", action="store_true", help="Stop each measurement once its relative standard error is --target_ratio times the one of the ground truth")  # Optional flag
+    parser.add_argument("--target_ratio", type=float, default=0.5, help="Relative standard error target of adaptive repetitions, as a fraction of the ground truth one (Default: 0.5)")  # Optional argument
+    parser.add_argument("--log_dir", type=str, default="simulation_logs", help="Where the logs of failed simulations are archived (Default: simulation_logs)")  # Optional argument
+    parser.add_argument("--minibatch", type=int, default=None, help="Score candidates on an estimate from this many scenarios, stratified by benchmark (Default: all scenarios)")  # Optional argument
+    parser.add_argument("--confirm_top", type=int, default=3, help="Candidates evaluated on all the scenarios at the end of a --minibatch calibration (Default: 3)")  # Optional argument
+    parser.add_argument("--screening", type=int, default=0, help="Morris trajectories of the sensitivity screening run before the search, 0 to search all the parameters (Default: 0)")  # Optional argument
+    parser.add_argument("--screening_threshold", type=float, default=0.05, help="Parameters whose influence stays below this fraction of the largest one for every benchmark are pinned (Default: 0.05)")  # Optional argument
+    parser.add_argument("--smpi_factors", action="store_true", help="Also calibrate the segments of the SMPI bandwidth and latency factors, always on with -a hierarchical")  # Optional flag
+    parser.add_argument("--inner_evaluations", type=int, default=20, help="SMPI factor candidates evaluated on each platform by -a hierarchical (Default: 20)")  # Optional argument
+    parser.add_argument("--early_abort", action="store_true", help="Stop evaluating a candidate once it cannot beat the best loss")  # Optional flag
+
+    # Parse the arguments
+    args = parser.parse_args()
+    if args.coordinator == "remote" and not args.remote_workers:
+        parser.error("--coordinator remote needs --remote_workers")
+    if args.coordinator == "remote" and not os.environ.get(AUTHKEY_ENV):
+        parser.error(f"--coordinator remote needs the secret shared with the workers in ${AUTHKEY_ENV}")
+
+    time_limit =  pytimeparse.parse(args.time_limit)
+
+    if not args.resume and os.path.exists(args.journal):
+        # a new campaign never appends to an old one
+        os.rename(args.journal, f"{args.journal}.{int(time())}")
+    journal = Journal(args.journal)
+    if args.resume:
+        time_limit -= journal.elapsed()
+        sys.stderr.write(f"Resuming {len(journal.evaluations())} evaluations, {max(time_limit, 0):.0f}s left\n")
+        if time_limit <= 0:
+            print(f"Calibrated Args: \n{journal.best()[0]}\n----------------\nLoss: {journal.best()[1]}")
+            return
+
+    summit_df = MPIGroundTruth("../imb-summit.csv") #NOTE: change
+
+    summit_df.set_benchmark_parent(args.benchmark_parent)
+
+
+    ground_truth_data = build_ground_truth(summit_df, args.byte_sizes, benchmarks=args.benchmarks)
+    known_points, data = ground_truth_data
+
     print(f"Known Points: {known_points}")
     print(f"GroundTruth: {data}")
 
+    tracer = Tracer(args.trace, args.prometheus)
+
     smpi_sim = SMPISimulator(
-        ground_truth_data, "IMB-P2P", "../hostfile.txt", 0.05, 24
+        ground_truth_data, "IMB-P2P", "../hostfile.txt", 0.05, 24, early_abort=args.early_abort,
+        batch_benchmarks=args.batched,
+        adaptive_repetitions=args.adaptive_repetitions, target_ratio=args.target_ratio,
+        recording=Recording(journal=journal, tracer=tracer, log_dir=args.log_dir),
+        admission=Admission(scheduler=AdmissionScheduler(
+            memory_bytes=int(args.memory_gb * 2**30) if args.memory_gb else None,
+            address_space_factor=args.rlimit_as_factor, cpu_seconds=args.rlimit_cpu
+        ))
     )
 
 
+    # lower fidelities use fewer iterations and every eta-th byte size, the lowest one
+    # possibly on a smaller node count
+    low_fidelity = []
+    if args.algorithm == "hyperband":
+        eta = 3
+        for level in range(args.fidelity_levels - 1, 0, -1):
+            node_count = args.fidelity_node_count if level == args.fidelity_levels - 1 and args.fidelity_node_count else 128
+            byte_sizes = args.byte_sizes[::eta ** level]
+            low_fidelity.append(smpi_sim.variant(
+                build_ground_truth(summit_df, byte_sizes, node_count, args.benchmarks), max(smpi_sim.iterations // eta ** (level + 1), 10)
+            ))
+
+    analytical = AnalyticalSimulator(ground_truth_data) if args.analytical != "off" else None
+
     calibrator = SMPISimulatorCalibrator(
-        args.algorithm, smpi_sim
+        args.algorithm, smpi_sim, low_fidelity, analytical, args.analytical,
+        minibatch=args.minibatch, confirm_top=args.confirm_top,
+        screening=args.screening, screening_threshold=args.screening_threshold,
+        smpi_factors=args.smpi_factors or args.algorithm == "hierarchical", inner_evaluations=args.inner_evaluations
     )
 
-    calibrator.compute_calibration(time_limit, 1)
+    calibrator.compute_calibration(time_limit, args.workers, args.coordinator, args.remote_workers)
+
+    print(format_summary(tracer.summary()))
 
 if __name__ == "__main__":
     main()